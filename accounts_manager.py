@@ -18,6 +18,7 @@ class AccountManager:
     def __init__(self):
         self.accounts: Dict[str, dict] = {}
         self.clients: Dict[str, TelegramClient] = {}
+        self.accounts_mtime = 0.0  # mtime של accounts.json בטעינה האחרונה
         os.makedirs(ACCOUNTS_DIR, exist_ok=True)
         self.load_accounts()
     
@@ -25,12 +26,33 @@ class AccountManager:
         """טוען חשבונות מהקובץ"""
         if os.path.exists(ACCOUNTS_FILE):
             try:
+                self.accounts_mtime = os.path.getmtime(ACCOUNTS_FILE)
                 with open(ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
                     self.accounts = json.load(f)
             except (json.JSONDecodeError, IOError) as e:
                 print(f"Warning: Could not load accounts: {e}")
                 self.accounts = {}
     
+    def reload_accounts(self) -> bool:
+        """טוען מחדש את accounts.json אם השתנה (למשל מה-Web UI); True אם נטען
+        
+        קובץ לא קריא לא מוחק את החשבונות הידועים
+        """
+        try:
+            mtime = os.path.getmtime(ACCOUNTS_FILE)
+            if mtime == self.accounts_mtime:
+                return False
+            with open(ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
+                accounts = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Could not reload accounts: {e}")
+            return False
+        self.accounts = accounts
+        self.accounts_mtime = mtime
+        return True
+    
     def save_accounts(self):
         """שומר חשבונות לקובץ עם retry"""
         max_retries = 3
@@ -82,6 +104,8 @@ class AccountManager:
             routes_file = self.accounts[name].get("routes_file")
             if routes_file and os.path.exists(routes_file):
                 os.remove(routes_file)
+            if routes_file and os.path.exists(routes_file + ".journal"):
+                os.remove(routes_file + ".journal")
             
             # מחיקת הגדרות
             del self.accounts[name]
@@ -106,8 +130,12 @@ class AccountManager:
             self.accounts[name]["enabled"] = enabled
             self.save_accounts()
     
-    async def create_client(self, name: str) -> Optional[TelegramClient]:
-        """יוצר client לחשבון"""
+    async def create_client(self, name: str, flood_sleep_threshold: int = 60) -> Optional[TelegramClient]:
+        """יוצר client לחשבון
+
+        flood_sleep_threshold - FloodWait עד כמה שניות Telethon ממתין בעצמו (ה-router מעביר 0 כדי
+        שכל FloodWait יגיע למאגר השולחים)
+        """
         account = self.get_account(name)
         if not account or not account.get("enabled"):
             return None
@@ -125,9 +153,11 @@ class AccountManager:
         
         # בוט או משתמש?
         if account.get("bot_token"):
-            client = TelegramClient(session, api_id, api_hash)
+            client = TelegramClient(session, api_id, api_hash,
+                                    flood_sleep_threshold=flood_sleep_threshold)
         else:
-            client = TelegramClient(session, api_id, api_hash)
+            client = TelegramClient(session, api_id, api_hash,
+                                    flood_sleep_threshold=flood_sleep_threshold)
         
         return client
     
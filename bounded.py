@@ -0,0 +1,41 @@
+"""
+מכלים חסומים בגודל - ל-caches שמתמלאים לפי תעבורת ההודעות
+"""
+from collections import OrderedDict
+
+class BoundedSet:
+    """קבוצה עם גודל מקסימלי; כשהיא מלאה - הרשומה הישנה ביותר נזרקת"""
+    __slots__ = ("maxlen", "_items")
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._items = OrderedDict()
+
+    def add(self, key) -> bool:
+        """מוסיף מפתח; מחזיר False אם כבר היה קיים"""
+        if key in self._items:
+            return False
+        self._items[key] = None
+        if len(self._items) > self.maxlen:
+            self._items.popitem(last=False)
+        return True
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class BoundedDict(OrderedDict):
+    """dict עם גודל מקסימלי (LRU לפי כתיבה)"""
+
+    def __init__(self, maxlen: int):
+        super().__init__()
+        self.maxlen = maxlen
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super().__setitem__(key, value)
+        if len(self) > self.maxlen:
+            self.popitem(last=False)
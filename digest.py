@@ -0,0 +1,187 @@
+"""
+מצב DIGEST - איסוף הודעות מקור לבאפר לכל יעד ושליחת פוסט מסכם אחד מעת לעת
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from accounts_manager import ACCOUNTS_DIR
+from digest_config import DigestConfig, parse_digest_config, TELEGRAM_MAX_CHARS
+
+DIGEST_FILE = os.path.join(ACCOUNTS_DIR, "digest_buffers.json")
+DIGEST_CHECK_EVERY = float(os.getenv("DIGEST_CHECK_EVERY", "5"))  # שניות בין בדיקות flush ושמירה
+SNIPPET_CHARS = 200    # אורך מקסימלי לכל הודעה בסיכום
+
+def message_link(chat_id: int, msg_id: int) -> Optional[str]:
+    """קישור להודעה בערוץ/סופרגרופ (t.me/c/...)"""
+    text = str(chat_id)
+    if text.startswith("-100"):
+        return f"https://t.me/c/{text[4:]}/{msg_id}"
+    return None
+
+def _snippet(text: str) -> str:
+    text = " ".join((text or "").split())
+    if len(text) > SNIPPET_CHARS:
+        text = text[:SNIPPET_CHARS - 1] + "…"
+    return text or "[מדיה]"
+
+def _entry_line(entry: list) -> str:
+    chat_id, msg_id, snippet = entry[0], entry[1], entry[2]
+    link = message_link(chat_id, msg_id)
+    return f"• {snippet}" + (f"\n  {link}" if link else "")
+
+def _budget(config: DigestConfig) -> int:
+    """תווים לשורות ההודעות בפוסט אחד (בלי הכותרת)"""
+    return config.max_chars - len(config.title) - 2
+
+class DigestBuffer:
+    """באפר של יעד אחד"""
+    __slots__ = ("entries", "chars", "opened_at", "config")
+
+    def __init__(self, config: DigestConfig, opened_at: float = None):
+        self.entries = []   # [chat_id, msg_id, snippet]
+        self.chars = 0
+        self.opened_at = opened_at or time.time()
+        self.config = config
+
+    def render(self) -> str:
+        return self.config.title + "\n\n" + "\n".join(_entry_line(e) for e in self.entries)
+
+class DigestManager:
+    """מנהל באפרים לכל (חשבון, יעד) ושולח סיכומים
+
+    send(owner, dest, text) - שולח פוסט ומחזיר False אם לא נשלח (הבאפר נשמר לניסיון הבא)
+    path=None - בלי שמירה לדיסק (replay/בדיקות)
+    """
+
+    def __init__(self, send: Callable[[str, object, str], Awaitable[bool]],
+                 path: Optional[str] = DIGEST_FILE):
+        self.send = send
+        self.path = path
+        self.buffers: Dict[Tuple[str, object], DigestBuffer] = {}
+        self._dirty = False
+        self._flushing = set()
+        self.load()
+
+    def add(self, owner: str, dest, config: DigestConfig, message) -> bool:
+        """מוסיף הודעה לבאפר; מחזיר True אם צריך לשלוח עכשיו (מלא)"""
+        key = (owner, dest)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = DigestBuffer(config)
+        buffer.config = config
+
+        entry = [message.chat_id, message.id, _snippet(message.message)]
+        line_chars = len(_entry_line(entry)) + 1
+        # ההודעה לא נכנסת בתקציב התווים - מה שכבר בבאפר הוא פוסט שלם
+        full = bool(buffer.entries) and buffer.chars + line_chars > _budget(config)
+        buffer.entries.append(entry)
+        buffer.chars += line_chars
+        self._dirty = True
+        return full or len(buffer.entries) >= config.max_messages
+
+    async def flush(self, owner: str, dest, complete_only: bool = False):
+        """שולח את הבאפר של יעד (ומשאיר אותו אם השליחה נכשלה)
+
+        complete_only - שולח רק פוסטים מלאים (תקציב תווים / max_messages); השארית נשארת בבאפר
+        """
+        key = (owner, dest)
+        buffer = self.buffers.get(key)
+        if not buffer or not buffer.entries or key in self._flushing:
+            return
+        self._flushing.add(key)
+        try:
+            # פיצול לפי תקציב התווים ו-max_messages
+            while buffer.entries:
+                part = DigestBuffer(buffer.config, buffer.opened_at)
+                budget = _budget(buffer.config)
+                for entry in buffer.entries:
+                    line_chars = len(_entry_line(entry)) + 1
+                    if part.entries and (part.chars + line_chars > budget
+                                         or len(part.entries) >= buffer.config.max_messages):
+                        break
+                    part.entries.append(entry)
+                    part.chars += line_chars
+                if (complete_only and len(part.entries) == len(buffer.entries)
+                        and len(part.entries) < buffer.config.max_messages):
+                    # הפוסט האחרון עוד לא מלא - ממשיך לאסוף מעכשיו
+                    buffer.opened_at = time.time()
+                    return
+                if not await self.send(owner, dest, part.render()[:TELEGRAM_MAX_CHARS]):
+                    return
+                del buffer.entries[:len(part.entries)]
+                buffer.chars -= part.chars
+                self._dirty = True
+                print(f"[{owner}] 📰 Digest with {len(part.entries)} messages → {dest}")
+            del self.buffers[key]
+        finally:
+            self._flushing.discard(key)
+
+    async def flush_due(self):
+        """שולח באפרים שעבר זמנם"""
+        now = time.time()
+        for (owner, dest), buffer in list(self.buffers.items()):
+            if buffer.entries and now - buffer.opened_at >= buffer.config.interval:
+                await self.flush(owner, dest)
+
+    async def flush_owner(self, owner: str, drop: bool = False):
+        """שולח את הבאפרים של חשבון (שנעצר); drop - מה שלא נשלח נזרק (החשבון נמחק)"""
+        for key in [k for k in self.buffers if k[0] == owner]:
+            await self.flush(*key)
+            if drop and self.buffers.pop(key, None) is not None:
+                self._dirty = True
+                print(f"[{owner}] ✗ Dropped unsent digest for {key[1]}")
+
+    async def flush_all(self):
+        """שולח את כל הבאפרים (לפני כיבוי)"""
+        for owner, dest in list(self.buffers):
+            await self.flush(owner, dest)
+
+    async def run(self):
+        """לולאת בדיקה: שליחת באפרים שעבר זמנם ושמירה לדיסק"""
+        while True:
+            await asyncio.sleep(DIGEST_CHECK_EVERY)
+            try:
+                await self.flush_due()
+            except Exception as e:
+                print(f"✗ Digest flush error: {e}")
+            self.save()
+
+    # ====== שמירה בין הפעלות ======
+    def save(self, force: bool = False):
+        """שומר את הבאפרים (רק אם השתנו)"""
+        if not self.path or (not self._dirty and not force):
+            return
+        data = [
+            {"owner": owner, "dest": dest, "opened_at": b.opened_at, "entries": b.entries,
+             "config": {"interval": b.config.interval, "max_messages": b.config.max_messages,
+                        "max_chars": b.config.max_chars, "title": b.config.title}}
+            for (owner, dest), b in self.buffers.items() if b.entries
+        ]
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+            self._dirty = False
+        except Exception as e:
+            print(f"Warning: Could not save digest buffers: {e}")
+
+    def load(self):
+        """טוען באפרים שנשמרו לפני הפעלה מחדש"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Could not load digest buffers: {e}")
+            return
+        for item in data:
+            buffer = DigestBuffer(parse_digest_config(item.get("config")), item.get("opened_at"))
+            buffer.entries = item.get("entries", [])
+            buffer.chars = sum(len(_entry_line(e)) + 1 for e in buffer.entries)
+            self.buffers[(item["owner"], item["dest"])] = buffer
+        if self.buffers:
+            print(f"📰 Restored {len(self.buffers)} digest buffers")
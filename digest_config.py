@@ -0,0 +1,26 @@
+"""
+הגדרות digest של route - בלי תלויות, כדי ש-routing יוכל לייבא אותן בלי accounts_manager/telethon
+"""
+from typing import Optional
+
+TELEGRAM_MAX_CHARS = 4096
+
+class DigestConfig:
+    """הגדרות digest של route"""
+    __slots__ = ("interval", "max_messages", "max_chars", "title")
+
+    def __init__(self, interval: float, max_messages: int, max_chars: int, title: str):
+        self.interval = interval
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.title = title
+
+def parse_digest_config(raw: Optional[dict]) -> DigestConfig:
+    """ממיר את שדה digest מה-YAML להגדרות (עם ברירות מחדל)"""
+    raw = raw or {}
+    return DigestConfig(
+        interval=float(raw.get('interval', 600)),
+        max_messages=int(raw.get('max_messages', 20)),
+        max_chars=min(int(raw.get('max_chars', 3500)), TELEGRAM_MAX_CHARS),
+        title=str(raw.get('title', '📰 Digest')),
+    )
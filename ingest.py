@@ -0,0 +1,107 @@
+"""
+בחירת חשבון קולט יחיד (ingestor) לכל צ'אט מקור שמשותף לכמה חשבונות
+כך שכל הודעה מעובדת פעם אחת בלבד, עם failover אוטומטי
+"""
+import os
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from bounded import BoundedSet
+
+INGEST_FAILOVER_SECS = float(os.getenv("INGEST_FAILOVER_SECS", "30"))
+INGEST_DEDUP_SIZE = int(os.getenv("INGEST_DEDUP_SIZE", "20000"))
+
+class IngestElector:
+    """בוחר חשבון אחד שמעבד את ההודעות של כל צ'אט מקור חופף"""
+
+    def __init__(self, is_alive: Callable[[str], bool],
+                 failover_after: float = INGEST_FAILOVER_SECS,
+                 dedup_size: int = INGEST_DEDUP_SIZE):
+        self.is_alive = is_alive
+        self.failover_after = failover_after
+        self.subscriptions: Dict[str, frozenset] = {}   # account → צ'אטי מקור
+        self.members: Dict[int, Tuple[str, ...]] = {}    # chat → חשבונות עם routes עליו
+        self.ingestor: Dict[int, str] = {}               # chat → החשבון הנבחר
+        self.last_seen: Dict[int, Dict[str, float]] = {}  # chat → account → זמן עדכון אחרון
+        self.account_seen: Dict[str, float] = {}          # account → עדכון אחרון מכל צ'אט
+        self._processed = BoundedSet(dedup_size)  # (chat, msg) שכבר עובדו
+
+    def set_subscriptions(self, account_name: str, chats: Iterable[int]):
+        """מעדכן את צ'אטי המקור של חשבון (אחרי טעינת routes)"""
+        chats = frozenset(chats)
+        old = self.subscriptions.get(account_name, frozenset())
+        if chats:
+            self.subscriptions[account_name] = chats
+        else:
+            self.subscriptions.pop(account_name, None)
+
+        # עדכון אינקרמנטלי - רק הצ'אטים שהשתנו
+        for chat in old - chats:
+            members = tuple(a for a in self.members.get(chat, ()) if a != account_name)
+            if members:
+                self.members[chat] = members
+            else:
+                self.members.pop(chat, None)
+                self.last_seen.pop(chat, None)
+            # ביטול בחירה שכבר לא רלוונטית
+            if self.ingestor.get(chat) == account_name:
+                del self.ingestor[chat]
+        for chat in chats - old:
+            self.members[chat] = tuple(sorted(self.members.get(chat, ()) + (account_name,)))
+
+    def remove_account(self, account_name: str):
+        """מסיר חשבון מכל הבחירות"""
+        self.set_subscriptions(account_name, ())
+        self.account_seen.pop(account_name, None)
+
+    def touch(self, account_name: str):
+        """נקרא על כל עדכון שמגיע לחשבון (מכל צ'אט) - סימן שהחיבור שלו חי"""
+        self.account_seen[account_name] = time.monotonic()
+
+    def owners(self, chat_id: int) -> Tuple[str, ...]:
+        """החשבונות שיש להם routes על צ'אט המקור"""
+        return self.members.get(chat_id, ())
+
+    def shared_chats(self) -> Dict[int, Tuple[str, ...]]:
+        """צ'אטים שמשותפים ליותר מחשבון אחד"""
+        return {chat: accounts for chat, accounts in self.members.items() if len(accounts) > 1}
+
+    def _elect(self, chat_id: int) -> Optional[str]:
+        members = self.members.get(chat_id, ())
+        current = self.ingestor.get(chat_id)
+        seen = self.last_seen.get(chat_id, {})
+
+        if current and self.is_alive(current):
+            # failover רק אם ה-ingestor עצמו שותק (שום עדכון מאף צ'אט) בזמן שחשבון אחר מקבל
+            # עדכונים מהצ'אט - צ'אט שקט לבד לא מעיד על בעיה בחיבור
+            current_seen = max(seen.get(current, 0.0), self.account_seen.get(current, 0.0))
+            freshest = max(seen.values(), default=0.0)
+            if freshest - current_seen <= self.failover_after:
+                return current
+
+        alive = [a for a in members if a != current and self.is_alive(a)]
+        if not alive:
+            return current if current and self.is_alive(current) else None
+        # עדיפות לחשבון שקיבל עדכון מהצ'אט לאחרונה
+        chosen = max(alive, key=lambda a: seen.get(a, 0.0))
+        if chosen != current:
+            self.ingestor[chat_id] = chosen
+            reason = "failover from " + current if current else "elected"
+            print(f"[{chosen}] 📡 Ingesting chat {chat_id} ({reason})")
+        return chosen
+
+    def should_ingest(self, account_name: str, chat_id: int, msg_id: int) -> bool:
+        """האם החשבון הזה צריך לעבד את ההודעה (עבור כל בעלי ה-routes)"""
+        self.last_seen.setdefault(chat_id, {})[account_name] = time.monotonic()
+
+        if self._elect(chat_id) != account_name:
+            return False
+
+        # הגנה מכפילויות בזמן מעבר בין חשבונות
+        return self._processed.add((chat_id, msg_id))
+
+    def status(self) -> Dict[int, dict]:
+        """מצב הבחירות לכל צ'אט משותף"""
+        return {
+            chat: {"members": list(accounts), "ingestor": self.ingestor.get(chat)}
+            for chat, accounts in self.shared_chats().items()
+        }
@@ -0,0 +1,93 @@
+"""
+בדיקת תקציב זיכרון - בונה routes ל-N חשבונות ובודק עם tracemalloc שהזיכרון בתקציב
+
+python memory_budget.py                        # 100 חשבונות × 1,000 routes
+python memory_budget.py --accounts 300 --routes 2000 --budget-mb 150
+"""
+import sys
+import random
+import asyncio
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+
+KEYWORDS = ["דחוף", "חשוב", "bitcoin", "crypto", "breaking", "עדכון", "alert", "news"]
+
+def make_raw_routes(rng: random.Random, count: int, chats: int, dests: int) -> list:
+    """routes כפי שהם נטענים מה-YAML (מחרוזות, כמו בקובץ)"""
+    routes = []
+    for _ in range(count):
+        route = {
+            "source": str(-1000000000000 - rng.randrange(chats)),
+            "dest": str(-1000000000000 - rng.randrange(dests)),
+            "mode": rng.choice(["FORWARD", "COPY", "PREFIX"]),
+        }
+        if rng.random() < 0.3:
+            route["filters"] = {"keywords": rng.sample(KEYWORDS, 2), "min_length": 10}
+        if route["mode"] == "PREFIX":
+            route["prefix"] = "📢"
+        routes.append(route)
+    return routes
+
+def measure(accounts: int, routes: int, chats: int, dests: int,
+            messages: int) -> SimpleNamespace:
+    """מודד זיכרון של routes מקומפלים + caches אחרי תעבורה"""
+    from telefeed_multi import MultiAccountTelefeed
+    from message_index import MessageIndex
+    from routing import compile_routes
+
+    rng = random.Random(42)
+    raw = {f"acc{i}": make_raw_routes(rng, routes, chats, dests) for i in range(accounts)}
+
+    system = MultiAccountTelefeed(index=MessageIndex(":memory:"), digest_file=None,
+                                  peer_cache_file=None, stats_file=None, trace_file=None)
+    system.manager.accounts = {name: {"enabled": True} for name in raw}
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for name, account_routes in raw.items():
+        system.set_routes(name, compile_routes(account_routes))
+    routes_size = _diff(before, tracemalloc.take_snapshot())
+
+    # תעבורה - caches לכל הודעה חייבים להישאר חסומים
+    before = tracemalloc.take_snapshot()
+    for i in range(messages):
+        chat = -1000000000000 - rng.randrange(chats)
+        for name in system.elector.owners(chat)[:2]:
+            system.elector.should_ingest(name, chat, i)
+    caches_size = _diff(before, tracemalloc.take_snapshot())
+    tracemalloc.stop()
+    system.index.close()
+
+    return SimpleNamespace(routes_mb=routes_size / 2**20, caches_mb=caches_size / 2**20)
+
+def _diff(before, after) -> int:
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Telefeed memory budget check")
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--routes", type=int, default=1000, help="routes per account")
+    parser.add_argument("--chats", type=int, default=20000, help="distinct source chats")
+    parser.add_argument("--dests", type=int, default=2000, help="distinct destinations")
+    parser.add_argument("--messages", type=int, default=200000, help="messages through per-message caches")
+    parser.add_argument("--budget-mb", type=float, default=80.0, help="budget for compiled routes")
+    parser.add_argument("--cache-budget-mb", type=float, default=8.0, help="budget for per-message caches")
+    args = parser.parse_args(argv)
+
+    result = measure(args.accounts, args.routes, args.chats, args.dests, args.messages)
+    total_routes = args.accounts * args.routes
+    ok_routes = result.routes_mb <= args.budget_mb
+    ok_caches = result.caches_mb <= args.cache_budget_mb
+
+    print("=" * 50)
+    print(f"📐 {args.accounts} accounts × {args.routes} routes = {total_routes:,} routes")
+    print(f"{'✓' if ok_routes else '✗'} Routes: {result.routes_mb:.1f} MB "
+          f"(budget {args.budget_mb} MB, {result.routes_mb * 2**20 / total_routes:.0f} B/route)")
+    print(f"{'✓' if ok_caches else '✗'} Per-message caches after {args.messages:,} messages: "
+          f"{result.caches_mb:.1f} MB (budget {args.cache_budget_mb} MB)")
+    print("=" * 50)
+    return 0 if ok_routes and ok_caches else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
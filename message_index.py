@@ -0,0 +1,116 @@
+"""
+אינדקס הודעות - מיפוי הודעת מקור להעתקים שנוצרו ביעדים
+(account, source chat, msg id) → [(dest, dest msg id, sender)]
+"""
+import os
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+
+INDEX_TTL = int(os.getenv("MSG_INDEX_TTL", str(2 * 24 * 3600)))       # שניות
+INDEX_MAX_ROWS = int(os.getenv("MSG_INDEX_MAX_ROWS", "200000"))
+EVICT_EVERY = 500  # בדיקת ניקוי כל N רשומות חדשות
+
+class MessageIndex:
+    """אינדקס מבוסס SQLite, חסום בגודל ועם פקיעת תוקף (TTL)"""
+
+    def __init__(self, path: str, ttl: int = INDEX_TTL, max_rows: int = INDEX_MAX_ROWS):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._inserts = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS copies ("
+            " account TEXT NOT NULL,"
+            " src_chat INTEGER NOT NULL,"
+            " src_msg INTEGER NOT NULL,"
+            " dest INTEGER NOT NULL,"
+            " dest_msg INTEGER NOT NULL,"
+            " ts INTEGER NOT NULL,"
+            " sender TEXT,"
+            " PRIMARY KEY (account, src_chat, src_msg, dest)"
+            ") WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS copies_ts ON copies (ts)")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(copies)")}
+        if "sender" not in columns:
+            self.db.execute("ALTER TABLE copies ADD COLUMN sender TEXT")
+
+    def add(self, account: str, src_chat: int, src_msg: int, dest: int, dest_msg: int,
+            sender: str = None):
+        """רושם העתק של הודעה ביעד (sender - החשבון ששלח, אם שונה מ-account)"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO copies VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (account, src_chat, src_msg, dest, dest_msg, int(time.time()),
+             sender if sender != account else None)
+        )
+        self._inserts += 1
+        if self._inserts >= EVICT_EVERY:
+            self._inserts = 0
+            self.evict()
+
+    def lookup(self, account: str, src_chat: int, src_msg: int) -> List[Tuple[int, int, str]]:
+        """מחזיר [(dest, dest_msg, sender)] עבור הודעת מקור"""
+        rows = self.db.execute(
+            "SELECT dest, dest_msg, COALESCE(sender, account) FROM copies"
+            " WHERE account = ? AND src_chat = ? AND src_msg = ? AND ts >= ?",
+            (account, src_chat, src_msg, int(time.time()) - self.ttl)
+        )
+        return rows.fetchall()
+
+    def lookup_many(self, account: str, src_chat: int,
+                    src_msgs: List[int]) -> List[Tuple[int, int, int, str]]:
+        """מחזיר [(src_msg, dest, dest_msg, sender)] עבור כמה הודעות מקור (מחיקות מגיעות בקבוצות)"""
+        if not src_msgs:
+            return []
+        marks = ",".join("?" * len(src_msgs))
+        rows = self.db.execute(
+            f"SELECT src_msg, dest, dest_msg, COALESCE(sender, account) FROM copies"
+            f" WHERE account = ? AND src_chat = ? AND src_msg IN ({marks}) AND ts >= ?",
+            (account, src_chat, *src_msgs, int(time.time()) - self.ttl)
+        )
+        return rows.fetchall()
+
+    def remove(self, account: str, src_chat: int, src_msgs: List[int]):
+        """מוחק מיפויים של הודעות שנמחקו במקור"""
+        if not src_msgs:
+            return
+        marks = ",".join("?" * len(src_msgs))
+        self.db.execute(
+            f"DELETE FROM copies WHERE account = ? AND src_chat = ? AND src_msg IN ({marks})",
+            (account, src_chat, *src_msgs)
+        )
+
+    def evict(self):
+        """ניקוי רשומות שפג תוקפן וחיתוך לגודל המקסימלי"""
+        self.db.execute("DELETE FROM copies WHERE ts < ?", (int(time.time()) - self.ttl,))
+        count = self.db.execute("SELECT COUNT(*) FROM copies").fetchone()[0]
+        excess = count - self.max_rows
+        if excess > 0:
+            self.db.execute(
+                "DELETE FROM copies WHERE (account, src_chat, src_msg, dest) IN ("
+                " SELECT account, src_chat, src_msg, dest FROM copies ORDER BY ts LIMIT ?)",
+                (excess,)
+            )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM copies").fetchone()[0]
+
+    def close(self):
+        """סוגר את מסד הנתונים"""
+        try:
+            self.db.close()
+        except sqlite3.Error:
+            pass
+
+def message_id_of(sent) -> Optional[int]:
+    """מחזיר id של הודעה שנשלחה (forward_messages עשוי להחזיר רשימה)"""
+    if isinstance(sent, (list, tuple)):
+        sent = sent[0] if sent else None
+    return getattr(sent, "id", None)
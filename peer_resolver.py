@@ -0,0 +1,200 @@
+"""
+המרת @username, קישורי הזמנה ומספרי טלפון למזהי צ'אט מספריים, עם cache שנשמר לדיסק
+
+טעינת routes משתמשת רק ב-cache; מה שחסר נפתר ברקע (refresh) וה-routes נטענים מחדש
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional
+from telethon import errors, utils
+from telethon.tl import functions, types
+from accounts_manager import ACCOUNTS_DIR
+
+PEER_CACHE_FILE = os.path.join(ACCOUNTS_DIR, "peer_cache.json")
+PEER_REFRESH_EVERY = float(os.getenv("PEER_REFRESH_EVERY", "86400"))  # שניות עד רענון של מזהה שנפתר
+PEER_RETRY_EVERY = float(os.getenv("PEER_RETRY_EVERY", "600"))        # שניות בין ניסיונות למה שלא נפתר
+
+def peer_key(value) -> Optional[str]:
+    """מפתח אחיד ל-username/קישור/טלפון ("@name", "+hash" או "tel:+972..."); None למזהה מספרי"""
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    if not text or text.lstrip('-').isdigit():
+        return None
+    for scheme in ("https://", "http://"):
+        if text.startswith(scheme):
+            text = text[len(scheme):]
+    for host in ("t.me/", "telegram.me/", "telegram.dog/"):
+        if text.startswith(host):
+            text = text[len(host):]
+            break
+    if text.startswith("joinchat/"):
+        return "+" + text[len("joinchat/"):]
+    if text.startswith("+"):
+        phone = "".join(c for c in text[1:] if c not in " -()")
+        if phone.isdigit():
+            return "tel:+" + phone   # t.me/+972... הוא קישור טלפון, לא קישור הזמנה
+        return text
+    return "@" + text.lstrip("@").split("/")[0].lower()
+
+class PeerResolver:
+    """cache משותף לכל החשבונות: מפתח → מזהה צ'אט (או שגיאה)"""
+
+    def __init__(self, path: Optional[str] = PEER_CACHE_FILE):
+        self.path = path
+        self.peers: Dict[str, dict] = {}     # key → {"id", "resolved_at"} או {"error", "failed_at"}
+        self.users: Dict[str, set] = {}      # key → חשבונות שה-routes שלהם משתמשים בו
+        self._dirty = False
+        self.wakeup = asyncio.Event()        # נקבע כשנוסף מפתח שלא ב-cache - הרענון ברקע מתחיל מיד
+        self.load()
+
+    async def _resolve_one(self, client, key: str) -> int:
+        if key.startswith("+"):
+            invite = await client(functions.messages.CheckChatInviteRequest(key[1:]))
+            if isinstance(invite, (types.ChatInviteAlready, types.ChatInvitePeek)):
+                return utils.get_peer_id(invite.chat)
+            raise ValueError("account is not a member of this invite link")
+        if key.startswith("tel:"):
+            return await client.get_peer_id(key[4:])   # רק אנשי קשר של החשבון
+        return await client.get_peer_id(key[1:])
+
+    async def resolve(self, clients: list, key: str, force: bool = False) -> Optional[int]:
+        """פותר מפתח (מה-cache אם אפשר) דרך החשבון הראשון שמצליח; None אם לא נפתר
+
+        השגיאה נרשמת רק אם כל החשבונות נכשלו (חשבון אחר יכול להיות חבר בקבוצה / איש קשר)
+        """
+        entry = self.peers.get(key)
+        if entry and not force:
+            if "id" in entry:
+                return entry["id"]
+            if time.time() - entry.get("failed_at", 0) < PEER_RETRY_EVERY:
+                return None
+        if not clients:
+            return entry.get("id") if entry else None
+        error, flood = None, None
+        for client in clients:
+            try:
+                peer_id = await self._resolve_one(client, key)
+            except errors.FloodWaitError as e:
+                flood = f"flood wait {e.seconds}s"   # לא ממתינים כאן - חשבון הבא או הרענון הבא
+                continue
+            except Exception as e:
+                error = str(e)
+                continue
+            self.peers[key] = {"id": peer_id, "resolved_at": time.time()}
+            self._dirty = True
+            return peer_id
+        if entry and "id" in entry:
+            return entry["id"]  # שגיאה זמנית - ממשיכים עם הערך הידוע
+        failed = {"error": error or flood, "failed_at": time.time()}
+        if flood:
+            failed["transient"] = True   # החשבון שב-FloodWait אולי כן יכול לפתור
+        self.peers[key] = failed
+        self._dirty = True
+        return None
+
+    def resolve_routes(self, account_name: str, raw_routes: List[dict],
+                       full: bool = True) -> List[dict]:
+        """מחליף source/dest סימבוליים במזהים מה-cache (עותקים של ה-routes) - בלי קריאות RPC
+
+        מפתח שלא ב-cache נשאר כמו שהוא ומעיר את הרענון ברקע, שיפתור אותו ויטען את החשבון מחדש.
+        full=True - אלה כל ה-routes של החשבון (ולא delta), מאפס את רשימת השימושים שלו
+        """
+        if full:
+            for accounts in self.users.values():
+                accounts.discard(account_name)
+        resolved = []
+        for raw in raw_routes:
+            if not isinstance(raw, dict):
+                resolved.append(raw)
+                continue
+            for field in ('source', 'dest'):
+                key = peer_key(raw.get(field))
+                if key is None:
+                    continue
+                self.users.setdefault(key, set()).add(account_name)
+                entry = self.peers.get(key)
+                if entry is None:
+                    self.wakeup.set()
+                elif "id" in entry:
+                    raw = dict(raw, **{field: entry["id"]})
+            resolved.append(raw)
+        return resolved
+
+    def unresolved(self, account_name: str = None) -> Dict[str, dict]:
+        """מפתחות בשימוש שלא נפתרו, עם השגיאה והחשבונות שמשתמשים בהם"""
+        report = {}
+        for key, accounts in self.users.items():
+            if not accounts or (account_name and account_name not in accounts):
+                continue
+            entry = self.peers.get(key) or {"error": "not resolved yet"}
+            if "id" not in entry:
+                report[key] = {"error": entry.get("error"), "accounts": sorted(accounts)}
+        return report
+
+    async def refresh(self, get_client) -> List[str]:
+        """רענון ברקע: מפתחות חדשים, מזהים ישנים וניסיון חוזר למה שלא נפתר
+
+        מחזיר חשבונות שמזהה שלהם השתנה (כולל מפתח חדש שנפתר)
+        """
+        self.wakeup.clear()
+        now = time.time()
+        changed = set()
+        for key, accounts in list(self.users.items()):
+            if not accounts:
+                continue
+            entry = self.peers.get(key) or {}
+            if "id" in entry and now - entry.get("resolved_at", 0) < PEER_REFRESH_EVERY:
+                continue
+            if "id" not in entry and now - entry.get("failed_at", 0) < PEER_RETRY_EVERY:
+                continue
+            clients = [c for c in map(get_client, sorted(accounts)) if c]
+            if not clients:
+                continue
+            old = entry.get("id")
+            new = await self.resolve(clients, key, force=True)
+            if new != old:
+                changed |= accounts
+            await asyncio.sleep(1)  # ResolveUsername מוגבל בקצב
+        self.save()
+        return sorted(changed)
+
+    def unresolved_sources(self, routes) -> List[str]:
+        """שגיאות validation ל-routes שה-source שלהם נכשל בפתרון (route כזה לא יתאים לאף הודעה)
+
+        מפתח שעוד לא נוסה או שנכשל ב-FloodWait לא נחשב שגיאה
+        """
+        errors_found = []
+        for i, raw in enumerate(routes or [], 1):
+            if not isinstance(raw, dict):
+                continue
+            key = peer_key(raw.get('source'))
+            entry = self.peers.get(key) if key else None
+            if entry and "id" not in entry and not entry.get("transient"):
+                errors_found.append(f"route {i}: source {raw['source']} could not be resolved "
+                                    f"({entry.get('error')})")
+        return errors_found
+
+    # ====== שמירה בין הפעלות ======
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.peers, f, ensure_ascii=False, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+            self._dirty = False
+        except Exception as e:
+            print(f"Warning: Could not save peer cache: {e}")
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.peers = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Could not load peer cache: {e}")
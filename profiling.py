@@ -0,0 +1,245 @@
+"""
+פרופיילינג בזמן ריצה - spans של זמנים, דגימת stacks ו-tracemalloc
+ניתן להפעלה/כיבוי תוך כדי ריצה (קובץ בקרה מה-Web UI או פקודת /profile)
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from collections import Counter
+from typing import Dict, Optional
+from accounts_manager import ACCOUNTS_DIR
+
+PROFILE_DIR = os.path.join(ACCOUNTS_DIR, "profile")
+PROFILE_CONTROL_FILE = os.path.join(PROFILE_DIR, "control.json")
+PROFILE_SUMMARY_FILE = os.path.join(PROFILE_DIR, "summary.json")
+PROFILE_FOLDED_FILE = os.path.join(PROFILE_DIR, "profile.folded")
+
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))  # שניות בין דגימות
+MAX_STACKS = 20000   # מספר מקסימלי של stacks שונים שנשמרים
+MAX_DEPTH = 64       # עומק מקסימלי של stack בדגימה
+TOP_N = 20
+
+_NULL_SPAN = contextlib.nullcontext()
+
+class _Span:
+    """מודד זמן של קטע קוד ומוסיף לסטטיסטיקה"""
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats: dict, name: str):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = self.stats.get(self.name)
+        if entry is None:
+            self.stats[self.name] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+        return False
+
+class Profiler:
+    """instrumentation עם עלות זניחה כשהוא כבוי"""
+
+    def __init__(self):
+        self.enabled = False           # spans
+        self.sampling = False          # דגימת stacks
+        self.tracing_memory = False    # tracemalloc
+        self.spans: Dict[str, list] = {}   # name → [count, total, max]
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._target_thread: Optional[int] = None
+        self._control_mtime = 0.0
+        self._last_memory: list = []   # snapshot אחרון לפני כיבוי tracemalloc
+
+    def span(self, name: str):
+        """context manager למדידת זמן; כשכבוי מחזיר null context משותף"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self.spans, name)
+
+    # ====== הפעלה/כיבוי ======
+    def start(self, sampling: bool = False, tracemalloc_on: bool = False):
+        """מפעיל פרופיילינג (spans תמיד, sampling ו-tracemalloc לפי בקשה)"""
+        if not self.enabled:
+            self.reset()
+            self.started_at = time.time()
+        self.enabled = True
+        if sampling and not self.sampling:
+            self._start_sampler()
+        elif not sampling and self.sampling:
+            self.sampling = False
+        if tracemalloc_on and not self.tracing_memory:
+            import tracemalloc
+            tracemalloc.start(16)
+            self.tracing_memory = True
+        elif not tracemalloc_on and self.tracing_memory:
+            self._stop_tracemalloc()
+
+    def stop(self):
+        """מכבה את כל סוגי הפרופיילינג (הנתונים נשמרים עד reset)"""
+        self.enabled = False
+        self.sampling = False
+        if self.tracing_memory:
+            self._stop_tracemalloc()
+
+    def reset(self):
+        """מאפס נתונים שנאספו"""
+        self.spans = {}
+        self.stacks = Counter()
+        self.samples = 0
+
+    def _stop_tracemalloc(self):
+        import tracemalloc
+        self._last_memory = self._memory_top()
+        tracemalloc.stop()
+        self.tracing_memory = False
+
+    # ====== דגימת stacks ======
+    def _start_sampler(self):
+        self._target_thread = threading.get_ident()
+        self.sampling = True
+        if self._sampler and self._sampler.is_alive():
+            return
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler",
+                                         daemon=True)
+        self._sampler.start()
+
+    def _sample_loop(self):
+        while self.sampling:
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is not None:
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                if key in self.stacks or len(self.stacks) < MAX_STACKS:
+                    self.stacks[key] += 1
+                self.samples += 1
+            time.sleep(SAMPLE_INTERVAL)
+
+    # ====== תוצאות ======
+    def _memory_top(self, limit: int = TOP_N) -> list:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return self._last_memory
+        snapshot = tracemalloc.take_snapshot()
+        return [
+            {"where": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1),
+             "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
+
+    def summary(self, limit: int = TOP_N) -> dict:
+        """סיכום top-N: spans, פונקציות חמות ו-allocations"""
+        spans = sorted(self.spans.items(), key=lambda kv: kv[1][1], reverse=True)
+
+        # זמן עצמי (self) ומצטבר לכל פונקציה מתוך ה-stacks
+        own = Counter()
+        cumulative = Counter()
+        # העתקה - ה-sampler מעדכן את ה-Counter מ-thread אחר
+        for stack, count in list(self.stacks.items()):
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for fn in set(frames):
+                cumulative[fn] += count
+
+        total = self.samples or 1
+        return {
+            "enabled": self.enabled,
+            "sampling": self.sampling,
+            "tracemalloc": self.tracing_memory,
+            "started_at": self.started_at,
+            "generated_at": time.time(),
+            "spans": [
+                {"name": name, "count": c, "total_ms": round(t * 1000, 3),
+                 "avg_ms": round(t / c * 1000, 3), "max_ms": round(m * 1000, 3)}
+                for name, (c, t, m) in spans[:limit]
+            ],
+            "samples": self.samples,
+            "hot_self": [{"frame": fn, "pct": round(n * 100 / total, 1)}
+                         for fn, n in own.most_common(limit)],
+            "hot_cumulative": [{"frame": fn, "pct": round(n * 100 / total, 1)}
+                               for fn, n in cumulative.most_common(limit)],
+            "memory_top": self._memory_top(limit),
+        }
+
+    def format_summary(self, limit: int = 10) -> str:
+        """סיכום טקסטואלי קצר (לתשובה בטלגרם)"""
+        s = self.summary(limit)
+        lines = [f"⏱ spans ({'on' if s['enabled'] else 'off'}):"]
+        for sp in s["spans"]:
+            lines.append(f"  {sp['name']}: n={sp['count']} avg={sp['avg_ms']}ms max={sp['max_ms']}ms")
+        if s["samples"]:
+            lines.append(f"🔥 hot frames ({s['samples']} samples):")
+            for h in s["hot_self"]:
+                lines.append(f"  {h['pct']}% {h['frame']}")
+        for m in s["memory_top"][:5]:
+            lines.append(f"💾 {m['size_kb']}KB {m['where']}")
+        return "\n".join(lines)
+
+    def dump(self, directory: str = PROFILE_DIR):
+        """כותב summary.json ו-profile.folded (פורמט flamegraph)"""
+        os.makedirs(directory, exist_ok=True)
+        summary_file = os.path.join(directory, "summary.json")
+        folded_file = os.path.join(directory, "profile.folded")
+
+        with open(summary_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        os.replace(summary_file + ".tmp", summary_file)
+
+        with open(folded_file + ".tmp", "w", encoding="utf-8") as f:
+            for stack, count in list(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        os.replace(folded_file + ".tmp", folded_file)
+
+    # ====== בקרה מרחוק (Web UI) ======
+    def apply_control(self, control: dict):
+        """מחיל הגדרות: {"enabled", "sampling", "tracemalloc", "reset"}"""
+        if control.get("reset"):
+            self.reset()
+        if control.get("enabled"):
+            self.start(sampling=bool(control.get("sampling")),
+                       tracemalloc_on=bool(control.get("tracemalloc")))
+        elif self.enabled:
+            self.stop()
+
+    def poll_control_file(self, path: str = PROFILE_CONTROL_FILE) -> bool:
+        """קורא את קובץ הבקרה אם השתנה; מחזיר True אם הוחל שינוי"""
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return False
+        if mtime == self._control_mtime:
+            return False
+        self._control_mtime = mtime
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.apply_control(json.load(f))
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Could not read profile control: {e}")
+            return False
+        return True
+
+def write_control(control: dict, path: str = PROFILE_CONTROL_FILE):
+    """כותב קובץ בקרה (נקרא ע"י ה-router)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(control, f)
+    os.replace(path + ".tmp", path)
+
+profiler = Profiler()
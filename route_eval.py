@@ -0,0 +1,310 @@
+"""
+הרצת routes על היסטוריית הודעות offline - כמה הודעות כל route היה מעביר, והשוואה לסט routes מועמד
+
+python route_eval.py history.jsonl --routes accounts/main_routes.yaml
+python route_eval.py accounts/traffic.trace --routes current.yaml --candidate new.yaml --json
+
+ההיסטוריה מעובדת בעמודות לפי צ'אט: לכל תנאי סינון נבנה bitmask (int) על כל הודעות הצ'אט,
+ו-route = AND של המסכות. filters זהים משותפים בין routes ולכן כל מסכה מחושבת פעם אחת.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Dict, Iterable, List, Optional, Tuple
+import yaml
+from routing import RouteTable, compile_routes, validate_routes
+from traffic_trace import MAGIC as TRACE_MAGIC, read_trace
+from peer_resolver import PeerResolver, PEER_CACHE_FILE, peer_key
+
+LOAD_CHUNK = 4 << 20   # בתים של JSON-lines לכל פענוח
+
+class ChatColumns:
+    """הודעות של צ'אט אחד בעמודות, עם cache של מסכות"""
+    __slots__ = ("texts", "lengths", "media", "all", "_masks")
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.lengths: List[int] = []
+        self.media = 0      # bit i = להודעה i יש מדיה
+        self.all = 0
+        self._masks: Dict[tuple, int] = {}
+
+    def append(self, text: str, length: int, has_media: bool):
+        if has_media:
+            self.media |= 1 << len(self.texts)
+        self.texts.append(text)
+        self.lengths.append(length)
+
+    def seal(self):
+        self.all = (1 << len(self.texts)) - 1
+
+    def _bits(self, flags: Iterable[bool]) -> int:
+        # bit i = הודעה i (הספרה הימנית ביותר היא ההודעה הראשונה)
+        return int("".join("1" if f else "0" for f in flags)[::-1] or "0", 2)
+
+    def keyword_mask(self, keyword: str) -> int:
+        key = ("kw", keyword)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._masks[key] = self._bits(keyword in t for t in self.texts)
+        return mask
+
+    def length_mask(self, min_length: int) -> int:
+        key = ("len", min_length)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._masks[key] = self._bits(n >= min_length for n in self.lengths)
+        return mask
+
+    def filter_mask(self, route_filter) -> int:
+        """ההודעות שעוברות RouteFilter (אותה לוגיקה כמו RouteFilter.matches)"""
+        key = ("filter", id(route_filter))
+        mask = self._masks.get(key)
+        if mask is not None:
+            return mask
+        mask = self.all
+        if route_filter.keywords:
+            any_kw = 0
+            for keyword in route_filter.keywords:
+                any_kw |= self.keyword_mask(keyword)
+            mask &= any_kw
+        if route_filter.min_length:
+            mask &= self.length_mask(route_filter.min_length)
+        if route_filter.only_media:
+            mask &= self.media
+        if route_filter.only_text:
+            mask &= ~self.media & self.all
+        self._masks[key] = mask
+        return mask
+
+class History:
+    """היסטוריית הודעות מקובצת לפי צ'אט"""
+
+    def __init__(self):
+        self.chats: Dict[object, ChatColumns] = {}
+        self.messages = 0
+        self.redacted = 0   # הודעות בלי טקסט (trace מוסתר) - מילות מפתח לא יתאימו
+
+    def add(self, chat_id, text: Optional[str], length: int, has_media: bool):
+        columns = self.chats.get(chat_id)
+        if columns is None:
+            columns = self.chats[chat_id] = ChatColumns()
+        if text is None:
+            if length:
+                self.redacted += 1
+            text = ""
+        columns.append(text, length, has_media)
+        self.messages += 1
+
+    def seal(self):
+        for columns in self.chats.values():
+            columns.seal()
+
+def _history_item(item, lineno: int) -> Tuple[int, str, bool]:
+    """(chat_id, טקסט, מדיה) משורת JSON; ValueError עם מספר השורה אם היא לא תקינה"""
+    if not isinstance(item, dict):
+        raise ValueError(f"line {lineno}: expected a JSON object")
+    if "chat_id" not in item:
+        raise ValueError(f"line {lineno}: missing chat_id")
+    try:
+        chat_id = int(item["chat_id"])
+    except (TypeError, ValueError):
+        raise ValueError(f"line {lineno}: invalid chat_id {item['chat_id']!r}")
+    text = item.get("text", item.get("message")) or ""
+    if not isinstance(text, str):
+        raise ValueError(f"line {lineno}: text must be a string")
+    return chat_id, text, bool(item.get("media"))
+
+def _bad_line(lines: List[str], first: int, failed: int = None) -> ValueError:
+    """מאתר את השורה הבעייתית ב-chunk (רק בנתיב השגיאה - הנתיב המהיר לא סופר שורות)"""
+    numbered = [(first + i, line) for i, line in enumerate(lines) if line.strip()]
+    if failed is not None:
+        numbered = numbered[failed:failed + 1]
+    for lineno, line in numbered:
+        try:
+            _history_item(json.loads(line), lineno)
+        except json.JSONDecodeError as e:
+            return ValueError(f"line {lineno}: invalid JSON ({e.msg})")
+        except ValueError as e:
+            return e
+    return ValueError(f"lines {first}-{first + len(lines) - 1}: invalid history entry")
+
+def load_history(path: str) -> History:
+    """טוען JSON-lines (chat_id, text/message, media) או קובץ trace של ה-recorder
+
+    ValueError עם מספר השורה אם שורה לא תקינה; בתים שאינם UTF-8 מוחלפים ב-�
+    """
+    history = History()
+    with open(path, "rb") as f:
+        is_trace = f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+    if is_trace:
+        for rec in read_trace(path):
+            history.add(rec.chat_id, rec.text, rec.text_len, bool(rec.media_kind))
+    else:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            first = 1   # מספר השורה הראשונה ב-chunk
+            while True:
+                # מפענחים אלפי שורות בקריאה אחת ל-json (מהיר פי 2 משורה-שורה)
+                lines = f.readlines(LOAD_CHUNK)
+                if not lines:
+                    break
+                try:
+                    items = json.loads("[" + ",".join(l for l in lines if l.strip()) + "]")
+                except json.JSONDecodeError:
+                    raise _bad_line(lines, first)
+                for i, item in enumerate(items):
+                    try:
+                        chat_id, text, media = _history_item(item, 0)
+                    except ValueError:
+                        # אותה בדיקה כמו בנתיב השגיאה; מספר השורה מחושב רק כאן
+                        raise _bad_line(lines, first, i)
+                    history.add(chat_id, text, len(text), media)
+                first += len(lines)
+    history.seal()
+    return history
+
+def load_table(path: str = None, content: str = None,
+               peer_cache: str = PEER_CACHE_FILE) -> RouteTable:
+    """מקמפל routes מקובץ/טקסט; usernames מומרים לפי ה-cache של ה-router
+
+    ValueError עם רשימת השגיאות אם ה-routes לא תקינים
+    """
+    if content is None:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+    try:
+        data = yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        raise ValueError([f"YAML error: {e}"])
+    errors = validate_routes(data)
+    if errors:
+        raise ValueError(errors)
+    peers = PeerResolver(peer_cache).peers if peer_cache else {}
+    resolved = []
+    for raw in (data or {}).get("routes") or []:
+        for field in ("source", "dest"):
+            entry = peers.get(peer_key(raw.get(field)) or "", {})
+            if "id" in entry:
+                raw = dict(raw, **{field: entry["id"]})
+        resolved.append(raw)
+    return compile_routes(resolved)
+
+def _route_name(route) -> str:
+    return route.id or f"{route.source or '*'}>{route.dest}"
+
+def evaluate(history: History, table: RouteTable) -> Tuple[Dict[str, int], Dict[object, Dict[object, int]]]:
+    """(התאמות לכל route, מסכת שליחות לכל צ'אט ויעד - אחרי מניעת כפילויות ליעד)"""
+    matches: Dict[str, int] = {_route_name(route): 0 for route in table}
+    delivered: Dict[object, Dict[object, int]] = {}
+    for chat_id, columns in history.chats.items():
+        routes = table.for_chat(chat_id)
+        if not routes:
+            continue
+        per_dest = delivered[chat_id] = {}
+        for route in routes:
+            mask = columns.filter_mask(route.filter)
+            if not mask or not route.dest:
+                continue
+            matches[_route_name(route)] += mask.bit_count()
+            per_dest[route.dest] = per_dest.get(route.dest, 0) | mask
+    return matches, delivered
+
+def _dest_totals(delivered) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for per_dest in delivered.values():
+        for dest, mask in per_dest.items():
+            totals[str(dest)] = totals.get(str(dest), 0) + mask.bit_count()
+    return totals
+
+def run(history: History, current: RouteTable, candidate: RouteTable = None) -> dict:
+    """דוח: התאמות לכל route ושליחות לכל יעד; עם candidate - גם הפרשים"""
+    start = time.perf_counter()
+    matches, delivered = evaluate(history, current)
+    dests = _dest_totals(delivered)
+    report = {
+        "messages": history.messages,
+        "chats": len(history.chats),
+        "redacted_messages": history.redacted,
+        "routes": matches,
+        "dests": dests,
+        "deliveries": sum(dests.values()),
+    }
+    if candidate is not None:
+        cand_matches, cand_delivered = evaluate(history, candidate)
+        added = removed = 0
+        for chat_id in set(delivered) | set(cand_delivered):
+            old, new = delivered.get(chat_id, {}), cand_delivered.get(chat_id, {})
+            for dest in set(old) | set(new):
+                before, after = old.get(dest, 0), new.get(dest, 0)
+                added += (after & ~before).bit_count()
+                removed += (before & ~after).bit_count()
+        cand_dests = _dest_totals(cand_delivered)
+        names = list(matches) + [n for n in cand_matches if n not in matches]
+        report["candidate"] = {
+            "routes": cand_matches,
+            "dests": cand_dests,
+            "deliveries": sum(cand_dests.values()),
+            "added_deliveries": added,
+            "removed_deliveries": removed,
+            "route_diff": {n: [matches.get(n), cand_matches.get(n)] for n in names
+                           if matches.get(n) != cand_matches.get(n)},
+        }
+    report["elapsed_s"] = round(time.perf_counter() - start, 3)
+    return report
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate routes against exported message history")
+    parser.add_argument("history", help="JSON-lines export or recorder trace file")
+    parser.add_argument("--routes", required=True, help="current routes YAML")
+    parser.add_argument("--candidate", help="candidate routes YAML to compare with")
+    parser.add_argument("--peer-cache", default=PEER_CACHE_FILE, help="router peer cache for @usernames")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    load_start = time.perf_counter()
+    try:
+        history = load_history(args.history)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read history: {e}")
+        return 1
+    load_s = time.perf_counter() - load_start
+    peer_cache = args.peer_cache if os.path.exists(args.peer_cache) else None
+    try:
+        current = load_table(args.routes, peer_cache=peer_cache)
+        candidate = load_table(args.candidate, peer_cache=peer_cache) if args.candidate else None
+    except ValueError as e:
+        print("❌ Invalid routes:")
+        for error in e.args[0]:
+            print(f"   {error}")
+        return 1
+    report = run(history, current, candidate)
+    report["load_s"] = round(load_s, 3)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    print("=" * 50)
+    print(f"📨 {report['messages']:,} messages in {report['chats']:,} chats "
+          f"(load {report['load_s']}s, evaluate {report['elapsed_s']}s)")
+    if report["redacted_messages"]:
+        print(f"⚠ {report['redacted_messages']:,} messages without text (redacted trace) - "
+              f"keyword filters never match them")
+    print(f"📤 {report['deliveries']:,} deliveries")
+    for name, count in sorted(report["routes"].items(), key=lambda item: -item[1]):
+        print(f"   {name}: {count:,}")
+    cand = report.get("candidate")
+    if cand:
+        print("-" * 50)
+        print(f"🆕 Candidate: {cand['deliveries']:,} deliveries "
+              f"(+{cand['added_deliveries']:,} / -{cand['removed_deliveries']:,})")
+        for name, (before, after) in cand["route_diff"].items():
+            print(f"   {name}: {before if before is not None else '-'} → "
+                  f"{after if after is not None else '-'}")
+    print("=" * 50)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+סטטיסטיקת תעבורה לכל route ולכל יעד - ring buffers בגודל קבוע (array), נשמרים תחת accounts/
+"""
+import os
+import json
+import time
+import struct
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+from accounts_manager import ACCOUNTS_DIR
+
+STATS_FILE = os.path.join(ACCOUNTS_DIR, "route_stats.bin")
+STATS_SUMMARY_FILE = os.path.join(ACCOUNTS_DIR, "route_stats.json")
+STATS_SAVE_EVERY = float(os.getenv("STATS_SAVE_EVERY", "60"))       # שניות בין שמירות
+DEAD_ROUTE_AFTER = float(os.getenv("DEAD_ROUTE_AFTER", "86400"))    # שניות בלי שליחות → route מת
+
+# (שניות לתא, מספר תאים): 10 שניות × שעה, 10 דקות × שבוע
+RESOLUTIONS = ((10, 360), (600, 1008))
+MAGIC = b"TFSTATS2"
+MAX_VALUE = 0xFFFFFFFF
+
+class RingSeries:
+    """count/bytes/failed לכל תא זמן; תאים ישנים מתאפסים כשהזמן מתקדם
+
+    total - סכום רץ של כל התאים בטבעת (מתעדכן בהוספה ובאיפוס), כך שסיכום החלון המלא לא סורק תאים
+    """
+    __slots__ = ("step", "head", "count", "bytes", "failed", "total")
+
+    def __init__(self, step: int, slots: int):
+        self.step = step
+        self.head = 0   # מספר התא האחרון שנכתב (זמן / step)
+        zero = bytes(4 * slots)
+        self.count = array("I", zero)
+        self.bytes = array("I", zero)
+        self.failed = array("I", zero)
+        self.total = [0, 0, 0]
+
+    def _advance(self, bucket: int):
+        slots = len(self.count)
+        gap = bucket - self.head
+        if gap >= slots:
+            zero = array("I", bytes(4 * slots))
+            self.count[:] = zero
+            self.bytes[:] = zero
+            self.failed[:] = zero
+            self.total = [0, 0, 0]
+        else:
+            total = self.total
+            for b in range(self.head + 1, bucket + 1):
+                i = b % slots
+                total[0] -= self.count[i]
+                total[1] -= self.bytes[i]
+                total[2] -= self.failed[i]
+                self.count[i] = self.bytes[i] = self.failed[i] = 0
+        self.head = bucket
+
+    def expire(self, now: float):
+        """מאפס תאים שיצאו מהחלון (לפני קריאת total)"""
+        bucket = int(now // self.step)
+        if bucket > self.head:
+            self._advance(bucket)
+
+    def add(self, now: float, nbytes: int, failed: bool):
+        bucket = int(now // self.step)
+        if bucket > self.head:
+            self._advance(bucket)
+        elif bucket <= self.head - len(self.count):
+            return  # ישן מדי
+        i = bucket % len(self.count)
+        if failed:
+            if self.failed[i] < MAX_VALUE:
+                self.failed[i] += 1
+                self.total[2] += 1
+        else:
+            if self.count[i] < MAX_VALUE:
+                self.count[i] += 1
+                self.total[0] += 1
+            added = min(nbytes, MAX_VALUE - self.bytes[i])
+            self.bytes[i] += added
+            self.total[1] += added
+
+    def recount(self):
+        """מחשב את total מהתאים (אחרי טעינה מהדיסק)"""
+        self.total = [sum(self.count), sum(self.bytes), sum(self.failed)]
+
+    def points(self, now: float) -> List[Tuple[int, int, int, int]]:
+        """(זמן תחילת התא, count, bytes, failed) מהישן לחדש, עד עכשיו"""
+        slots = len(self.count)
+        last = int(now // self.step)
+        result = []
+        for b in range(last - slots + 1, last + 1):
+            if b > self.head or b <= self.head - slots:
+                result.append((b * self.step, 0, 0, 0))
+            else:
+                i = b % slots
+                result.append((b * self.step, self.count[i], self.bytes[i], self.failed[i]))
+        return result
+
+    def totals(self, now: float, seconds: float) -> Tuple[int, int, int]:
+        """סכום count/bytes/failed ב-seconds האחרונות"""
+        slots = len(self.count)
+        self.expire(now)
+        if seconds >= slots * self.step:
+            return tuple(self.total)
+        first = max(int((now - seconds) // self.step) + 1, self.head - slots + 1)
+        last = min(int(now // self.step), self.head)
+        if first > last:
+            return 0, 0, 0
+        # טווח התאים בטבעת - חתיכה אחת או שתיים (sum על array רץ ב-C)
+        start, end = first % slots, last % slots + 1
+        if start < end:
+            parts = ((start, end),)
+        else:
+            parts = ((start, slots), (0, end))
+        return tuple(sum(sum(values[a:b]) for a, b in parts)
+                     for values in (self.count, self.bytes, self.failed))
+
+class KeyStats:
+    """סטטיסטיקה של route/יעד אחד - נוצרת רק כשיש תעבורה"""
+    __slots__ = ("series", "last_seen")
+
+    def __init__(self):
+        self.series = tuple(RingSeries(step, slots) for step, slots in RESOLUTIONS)
+        self.last_seen: Optional[float] = None
+
+def route_key(account_name: str, route) -> str:
+    # ל-routes של ה-router תמיד יש id (routes בלי id בקובץ מקבלים auto_route_id)
+    return f"route:{account_name}:{route.id or f'{route.source}>{route.dest}'}"
+
+def dest_key(dest) -> str:
+    return f"dest:{dest}"
+
+# רשומה קבועה לכל מפתח בקובץ: heads, last_seen ואז count/bytes/failed לכל רזולוציה
+RECORD_HEAD = struct.Struct("<" + "q" * len(RESOLUTIONS) + "d")
+RECORD_SIZE = RECORD_HEAD.size + sum(4 * 3 * slots for _, slots in RESOLUTIONS)
+
+def _index_path(path: str) -> str:
+    return path + ".idx"
+
+def _encode(stats: KeyStats) -> bytes:
+    parts = [RECORD_HEAD.pack(*(s.head for s in stats.series),
+                              stats.last_seen if stats.last_seen is not None else -1.0)]
+    for series in stats.series:
+        parts += [series.count.tobytes(), series.bytes.tobytes(), series.failed.tobytes()]
+    return b"".join(parts)
+
+def _decode(record: bytes) -> KeyStats:
+    if len(record) != RECORD_SIZE:
+        raise ValueError("truncated route stats record")
+    stats = KeyStats()
+    *heads, last_seen = RECORD_HEAD.unpack_from(record)
+    stats.last_seen = last_seen if last_seen >= 0 else None
+    offset = RECORD_HEAD.size
+    for series, head in zip(stats.series, heads):
+        series.head = head
+        size = 4 * len(series.count)
+        for values in (series.count, series.bytes, series.failed):
+            values[:] = array("I", record[offset:offset + size])
+            offset += size
+        series.recount()
+    return stats
+
+class StatsWrite:
+    """מה שצריך לכתוב בשמירה אחת - עותק, כך שהכתיבה רצה ב-thread בלי לגעת במצב החי"""
+    __slots__ = ("records", "index", "summary")
+
+    def __init__(self, records: List[Tuple[int, bytes]], index: Optional[dict], summary: Optional[dict]):
+        self.records = records   # (slot, רשומה) למפתחות שהשתנו בלבד
+        self.index = index       # None = רשימת המפתחות לא השתנתה
+        self.summary = summary
+
+class RouteStats:
+    """ring buffers לכל מפתח (route / יעד)
+
+    בקובץ: רשומה בגודל קבוע לכל מפתח (route_stats.bin) ואינדקס מפתח → slot (route_stats.bin.idx).
+    בכל שמירה נכתבות רק הרשומות של מפתחות שהייתה להם תעבורה מאז השמירה הקודמת.
+    """
+
+    def __init__(self, path: Optional[str] = STATS_FILE):
+        self.path = path
+        self.keys: Dict[str, KeyStats] = {}
+        self.first_seen: Dict[str, float] = {}   # מתי route הופיע לראשונה (לזיהוי routes מתים)
+        self.slots: Dict[str, int] = {}          # מפתח → מיקום הרשומה בקובץ
+        self.free: List[int] = []                # slots של מפתחות שנמחקו
+        self.dirty = set()                       # מפתחות שהשתנו מאז השמירה האחרונה
+        self._index_changed = False
+        self._write_lock = threading.Lock()
+        self.load()
+
+    def record(self, key: str, nbytes: int = 0, failed: bool = False, now: float = None):
+        now = now or time.time()
+        stats = self.keys.get(key)
+        if stats is None:
+            stats = self.keys[key] = KeyStats()
+        for series in stats.series:
+            series.add(now, nbytes, failed)
+        if not failed:
+            stats.last_seen = now
+        self.dirty.add(key)
+
+    def _evict(self, key: str):
+        del self.keys[key]
+        self.dirty.discard(key)
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.free.append(slot)
+            self._index_changed = True
+
+    def summary(self, routes: Dict[str, object], now: float = None) -> dict:
+        """סיכום לכל route (כולל routes בלי תעבורה) ולכל יעד, עם סימון routes מתים"""
+        now = now or time.time()
+        hour, week = RESOLUTIONS[0][0] * RESOLUTIONS[0][1], RESOLUTIONS[1][0] * RESOLUTIONS[1][1]
+
+        def row(key: str) -> dict:
+            stats = self.keys.get(key)
+            if stats is None:
+                return {"hour": [0, 0, 0], "day": [0, 0, 0], "week": [0, 0, 0], "last_seen": None}
+            return {
+                "hour": list(stats.series[0].totals(now, hour)),
+                "day": list(stats.series[1].totals(now, 86400)),
+                "week": list(stats.series[1].totals(now, week)),
+                "last_seen": stats.last_seen,
+            }
+
+        route_rows = []
+        first_seen = {}
+        dests = set()
+        for account_name, table in routes.items():
+            for route in table:
+                key = route_key(account_name, route)
+                first = first_seen[key] = self.first_seen.get(key, now)
+                dests.add(dest_key(route.dest))
+                data = row(key)
+                idle = now - (data["last_seen"] or first)
+                route_rows.append(dict(data, key=key, account=account_name, id=route.id,
+                                       source=route.source, dest=route.dest, mode=route.mode,
+                                       dead=idle > DEAD_ROUTE_AFTER))
+        if first_seen != self.first_seen:
+            self.first_seen = first_seen
+            self._index_changed = True
+        # routes/יעדים שנמחקו ולא היו פעילים שבוע - משחררים את ה-buffers שלהם
+        for key in [k for k, stats in self.keys.items()
+                    if k not in first_seen and k not in dests
+                    and now - (stats.last_seen or 0) > week]:
+            self._evict(key)
+        dest_rows = [dict(row(key), key=key, dest=key[len("dest:"):])
+                     for key in self.keys if key.startswith("dest:")]
+        return {"updated_at": now, "dead_after_s": DEAD_ROUTE_AFTER,
+                "routes": route_rows, "dests": dest_rows}
+
+    # ====== שמירה ======
+    def snapshot(self, routes: Dict[str, object] = None) -> StatsWrite:
+        """מה שצריך לכתוב מאז השמירה הקודמת (ב-event loop; הכתיבה עצמה ב-write)"""
+        summary = self.summary(routes) if routes is not None else None
+        records = []
+        for key in self.dirty:
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.slots[key] = self.free.pop() if self.free else len(self.slots) + len(self.free)
+                self._index_changed = True
+            records.append((slot, _encode(self.keys[key])))
+        self.dirty = set()
+        index = None
+        if self._index_changed:
+            index = {"first_seen": dict(self.first_seen), "slots": dict(self.slots)}
+            self._index_changed = False
+        return StatsWrite(records, index, summary)
+
+    def write(self, job: StatsWrite, summary_path: str = STATS_SUMMARY_FILE):
+        """כותב רשומות שהשתנו במקומן, ואת האינדקס והסיכום בכתיבה אטומית (בטוח ל-thread)"""
+        if not self.path:
+            return
+        with self._write_lock:
+            try:
+                if job.records:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    mode = "r+b" if os.path.exists(self.path) else "w+b"
+                    with open(self.path, mode) as f:
+                        if f.read(len(MAGIC)) != MAGIC:
+                            f.seek(0)
+                            f.truncate()
+                            f.write(MAGIC)
+                        for slot, record in sorted(job.records):
+                            f.seek(len(MAGIC) + slot * RECORD_SIZE)
+                            f.write(record)
+                # האינדקס אחרי הרשומות - הוא אף פעם לא מצביע על רשומה שלא נכתבה
+                if job.index is not None:
+                    _write_json(_index_path(self.path), job.index)
+                if job.summary is not None:
+                    _write_json(summary_path, job.summary)
+            except Exception as e:
+                print(f"Warning: Could not save route stats: {e}")
+
+    def save(self, routes: Dict[str, object] = None, summary_path: str = STATS_SUMMARY_FILE):
+        """שמירה סינכרונית (בכיבוי)"""
+        if self.path:
+            self.write(self.snapshot(routes), summary_path)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            index = _read_index(self.path)
+            with open(self.path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError("not a route stats file")
+                blob = f.read()
+        except (ValueError, IOError) as e:
+            print(f"Warning: Could not load route stats: {e}")
+            return
+        self.first_seen = index.get("first_seen", {})
+        for key, slot in index.get("slots", {}).items():
+            offset = slot * RECORD_SIZE
+            try:
+                self.keys[key] = _decode(blob[offset:offset + RECORD_SIZE])
+            except ValueError:
+                continue
+            self.slots[key] = slot
+        used = set(self.slots.values())
+        self.free = [slot for slot in range(max(used, default=-1) + 1) if slot not in used]
+
+def _write_json(path: str, data: dict):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def _read_index(path: str) -> dict:
+    try:
+        with open(_index_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"bad route stats index: {e}")
+
+def read_summary(path: str = STATS_SUMMARY_FILE) -> dict:
+    """הסיכום האחרון שה-router שמר ({} אם אין)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, IOError):
+        return {}
+
+def read_series(key: str, resolution: int = 0, path: str = STATS_FILE) -> Optional[List[Tuple[int, int, int, int]]]:
+    """סדרת הזמן של מפתח מהקובץ השמור (לגרפים ב-Web UI)"""
+    try:
+        slot = _read_index(path).get("slots", {}).get(key)
+        if slot is None:
+            return None
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            f.seek(len(MAGIC) + slot * RECORD_SIZE)
+            stats = _decode(f.read(RECORD_SIZE))
+    except (FileNotFoundError, ValueError, IOError):
+        return None
+    return stats.series[resolution].points(time.time())
@@ -0,0 +1,210 @@
+"""
+עדכון routes בודדים לפי id - בדיקה, כתיבה אטומית ויומן שינויים שה-router מחיל כ-delta
+"""
+import os
+import json
+import uuid
+import threading
+from typing import List, Optional, Tuple
+import yaml
+from routing import validate_route, validate_routes, with_route_ids
+
+JOURNAL_MAX_BYTES = 1 << 20   # מעבר לזה היומן מתאפס (וה-router טוען את הקובץ מחדש)
+
+_lock = threading.Lock()
+
+def journal_path(routes_file: str) -> str:
+    return routes_file + ".journal"
+
+def new_route_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+def _read(routes_file: str) -> Tuple[str, dict]:
+    """(טקסט הקובץ, data) - routes תמיד רשימה"""
+    if not os.path.exists(routes_file):
+        return "", {"routes": []}
+    with open(routes_file, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return text, _load(text)
+
+def _load(text: str) -> dict:
+    data = yaml.safe_load(text) or {}
+    if not isinstance(data.get('routes'), list):
+        data['routes'] = []
+    return data
+
+def _write_atomic(path: str, text: str):
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_file, path)
+
+def _dump(data) -> str:
+    return yaml.safe_dump(data, allow_unicode=True, sort_keys=False)
+
+def _last_line(node) -> int:
+    """השורה האחרונה שיש בה תוכן של node (בלי שורות ריקות/הערות שאחריו)"""
+    if isinstance(node, yaml.MappingNode) and not node.flow_style and node.value:
+        return _last_line(node.value[-1][1])
+    if isinstance(node, yaml.SequenceNode) and not node.flow_style and node.value:
+        return _last_line(node.value[-1])
+    end = node.end_mark
+    # block scalar (|, >) מסתיים בתחילת השורה הבאה
+    return end.line - 1 if end.column == 0 and end.line > node.start_mark.line else end.line
+
+def _item_spans(text: str) -> Optional[List[Tuple[int, int, int]]]:
+    """(שורה ראשונה, שורה אחרונה, עמודת ה-'-') לכל route; None אם אי אפשר לערוך במקום"""
+    try:
+        root = yaml.compose(text)
+    except yaml.YAMLError:
+        return None
+    if not isinstance(root, yaml.MappingNode):
+        return None
+    lines = text.splitlines()
+    for key, value in root.value:
+        if key.value != 'routes':
+            continue
+        if not isinstance(value, yaml.SequenceNode) or value.flow_style or not value.value:
+            return None
+        spans = []
+        for item in value.value:
+            first, last = item.start_mark.line, _last_line(item)
+            line = lines[first]
+            dash = line.rfind('-', 0, item.start_mark.column)
+            if dash < 0 or line[:dash].strip():
+                return None
+            while last > first and not lines[last].strip():
+                last -= 1  # שורות ריקות אחרי block scalar
+            spans.append((first, last, dash))
+        return spans
+    return None
+
+def _edit_text(text: str, index: Optional[int], raw: Optional[dict]) -> Optional[str]:
+    """מחליף/מוחק (raw=None) את route מספר index או מוסיף (index=None) - שאר הקובץ נשאר כמו שהוא"""
+    spans = _item_spans(text)
+    if not spans:
+        return None
+    lines = text.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    if index is None:
+        first, last, dash = spans[-1]
+        first = last = last + 1
+    else:
+        first, last, dash = spans[index]
+        last += 1
+    new = []
+    if raw is not None:
+        new = [" " * dash + line for line in _dump([raw]).splitlines(keepends=True)]
+    return "".join(lines[:first] + new + lines[last:])
+
+def _save(routes_file: str, text: str, data: dict, index: Optional[int], raw: Optional[dict]):
+    """כותב רק את ה-route שהשתנה (שומר הערות ועיצוב); כתיבה מלאה אם אי אפשר"""
+    new_text = _edit_text(text, index, raw)
+    if new_text is None or _load(new_text) != data:
+        new_text = _dump(data)
+    _write_atomic(routes_file, new_text)
+
+def _reset_journal(routes_file: str):
+    """יומן חדש (inode חדש) - ה-router יזהה ויטען את הקובץ כולו"""
+    _write_atomic(journal_path(routes_file), "")
+
+def _append_journal(routes_file: str, entry: dict):
+    path = journal_path(routes_file)
+    if os.path.exists(path) and os.path.getsize(path) > JOURNAL_MAX_BYTES:
+        _reset_journal(routes_file)
+    entry["mtime"] = os.path.getmtime(routes_file)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def _find(routes: list, route_id: str) -> Optional[int]:
+    for i, existing in enumerate(with_route_ids(routes)):
+        if isinstance(existing, dict) and str(existing.get('id')) == route_id:
+            return i
+    return None
+
+def list_routes(routes_file: str) -> List[dict]:
+    """ה-routes של הקובץ; routes בלי id מקבלים id יציב בזיכרון בלבד (הקובץ לא משתנה)"""
+    _, data = _read(routes_file)
+    return with_route_ids(data['routes'])
+
+def put_route(routes_file: str, raw: dict, route_id: str = None) -> dict:
+    """מוסיף route (route_id=None) או מחליף route קיים לפי id"""
+    errors = validate_route(raw)
+    if errors:
+        return {'success': False, 'errors': errors}
+    with _lock:
+        text, data = _read(routes_file)
+        routes = data['routes']
+        if route_id is None:
+            route_id = str(raw.get('id') or new_route_id())
+            if _find(routes, route_id) is not None:
+                return {'success': False, 'errors': [f"id {route_id} already exists"]}
+            index = None
+        else:
+            index = _find(routes, route_id)
+            if index is None:
+                return {'success': False, 'not_found': True, 'errors': [f"route {route_id} not found"]}
+        # id ראשון - כך הוא נראה בקובץ
+        raw = dict({'id': route_id}, **{k: v for k, v in raw.items() if k != 'id'})
+        if index is None:
+            routes.append(raw)
+        else:
+            routes[index] = raw
+        _save(routes_file, text, data, index, raw)
+        _append_journal(routes_file, {"op": "put", "id": route_id, "route": raw})
+    return {'success': True, 'route': raw}
+
+def delete_route(routes_file: str, route_id: str) -> dict:
+    """מוחק route לפי id"""
+    with _lock:
+        text, data = _read(routes_file)
+        index = _find(data['routes'], route_id)
+        if index is None:
+            return {'success': False, 'not_found': True, 'errors': [f"route {route_id} not found"]}
+        del data['routes'][index]
+        _save(routes_file, text, data, index, None)
+        _append_journal(routes_file, {"op": "delete", "id": route_id})
+    return {'success': True}
+
+def write_routes_text(routes_file: str, content: str) -> List[str]:
+    """שמירת קובץ routes שלם (עורך הטקסט) - רק אם הוא תקין; מחזיר שגיאות"""
+    try:
+        data = yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        return [f"YAML error: {e}"]
+    errors = validate_routes(data)
+    if errors:
+        return errors
+    with _lock:
+        _write_atomic(routes_file, content)
+        _reset_journal(routes_file)
+    return []
+
+def journal_position(routes_file: str) -> Tuple[int, int]:
+    """(inode, סוף היומן) - נקודת ההתחלה לקריאת שינויים חדשים"""
+    try:
+        stat = os.stat(journal_path(routes_file))
+        return stat.st_ino, stat.st_size
+    except FileNotFoundError:
+        return 0, 0
+
+def read_journal(routes_file: str, position: Tuple[int, int]) -> Tuple[Optional[List[dict]], Tuple[int, int]]:
+    """שינויים שנוספו ליומן מאז position; None אם היומן התאפס או לא קריא"""
+    inode, offset = position
+    path = journal_path(routes_file)
+    try:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != inode or stat.st_size < offset:
+                return None, position
+            f.seek(offset)
+            chunk = f.read()
+    except FileNotFoundError:
+        return None, position
+    chunk = chunk[:chunk.rfind(b"\n") + 1]  # בלי שורה שעוד נכתבת
+    try:
+        entries = [json.loads(line) for line in chunk.splitlines() if line]
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None, position
+    return entries, (inode, offset + len(chunk))
@@ -0,0 +1,320 @@
+"""
+ייצוג routes קומפקטי - רשומות עם __slots__, מזהי צ'אט משותפים ו-filters משותפים
+"""
+import sys
+import json
+import hashlib
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple
+from digest_config import DigestConfig, parse_digest_config
+from scheduler import parse_priority
+
+MODES = ("FORWARD", "COPY", "PREFIX", "DIGEST")
+
+# מאגר מזהים משותף - אותו מספר צ'אט מופיע באלפי routes ונשמר פעם אחת
+_PEERS: Dict[int, int] = {}
+
+def intern_peer(value):
+    """ממיר מזהה צ'אט למספר (אם אפשר) ומחזיר עותק משותף"""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lstrip('-').isdigit():
+            value = int(value)
+        else:
+            return sys.intern(value) if value else None
+    if isinstance(value, int):
+        return _PEERS.setdefault(value, value)
+    return value
+
+class RouteFilter:
+    """תנאי סינון של route; filters זהים משותפים בין routes"""
+    __slots__ = ("keywords", "min_length", "only_media", "only_text", "__weakref__")
+
+    def __init__(self, keywords: Tuple[str, ...], min_length: int,
+                 only_media: bool, only_text: bool):
+        self.keywords = keywords
+        self.min_length = min_length
+        self.only_media = only_media
+        self.only_text = only_text
+
+    def matches(self, message) -> bool:
+        """בודק אם הודעה עומדת בתנאים"""
+        # בדיקת מילות מפתח
+        if self.keywords:
+            text = message.text or ""
+            if not any(kw in text for kw in self.keywords):
+                return False
+
+        # בדיקת אורך מינימלי
+        if self.min_length and len(message.text or "") < self.min_length:
+            return False
+
+        # בדיקת מדיה / טקסט בלבד
+        if self.only_media and not message.media:
+            return False
+        if self.only_text and message.media:
+            return False
+
+        return True
+
+_FILTERS: "weakref.WeakValueDictionary[tuple, RouteFilter]" = weakref.WeakValueDictionary()
+
+def make_filter(filters: Optional[dict]) -> RouteFilter:
+    """מחזיר RouteFilter משותף עבור הגדרת filters"""
+    filters = filters or {}
+    keywords = filters.get('keywords') or ()
+    if isinstance(keywords, str):
+        keywords = (keywords,)
+    key = (
+        tuple(sys.intern(str(kw)) for kw in keywords),
+        int(filters.get('min_length') or 0),
+        bool(filters.get('only_media')),
+        bool(filters.get('only_text')),
+    )
+    shared = _FILTERS.get(key)
+    if shared is None:
+        shared = RouteFilter(*key)
+        _FILTERS[key] = shared
+    return shared
+
+class Route:
+    """route מקומפל"""
+    __slots__ = ("id", "source", "dest", "mode", "prefix", "filter", "digest", "priority")
+
+    def __init__(self, source, dest, mode: str, prefix: str, filter: RouteFilter,
+                 digest: Optional[DigestConfig] = None, priority: int = 0,
+                 id: Optional[str] = None):
+        self.id = id  # מזהה יציב לעדכונים דרך ה-API
+        self.source = source
+        self.dest = dest
+        self.mode = mode
+        self.prefix = prefix
+        self.filter = filter
+        self.digest = digest  # רק ב-mode DIGEST
+        self.priority = priority  # נתיב בתור השליחה (גבוה = קודם)
+
+def compile_route(raw: dict) -> Route:
+    """ממיר route מה-YAML לרשומה קומפקטית"""
+    mode = str(raw.get('mode') or 'FORWARD').upper()
+    prefix = raw.get('prefix') or ""
+    return Route(
+        source=intern_peer(raw.get('source')),
+        dest=intern_peer(raw.get('dest')),
+        mode=sys.intern(mode),
+        prefix=sys.intern(prefix) if prefix else "",
+        filter=make_filter(raw.get('filters')),
+        digest=parse_digest_config(raw.get('digest')) if mode == 'DIGEST' else None,
+        priority=parse_priority(raw.get('priority')),
+        id=sys.intern(str(raw['id'])) if raw.get('id') else None,
+    )
+
+FILTER_KEYS = ("keywords", "min_length", "only_media", "only_text")
+DIGEST_KEYS = ("interval", "max_messages", "max_chars", "title")
+
+def validate_route(raw) -> List[str]:
+    """בודק route מה-YAML/API; מחזיר רשימת שגיאות (ריקה = תקין)"""
+    if not isinstance(raw, dict):
+        return ["route must be a mapping"]
+    errors = []
+    if not raw.get('dest'):
+        errors.append("dest is required")
+    for field in ('source', 'dest'):
+        value = raw.get(field)
+        if value is not None and not isinstance(value, (int, str)):
+            errors.append(f"{field} must be a chat id or @username")
+    mode = str(raw.get('mode') or 'FORWARD').upper()
+    if mode not in MODES:
+        errors.append(f"mode must be one of {', '.join(MODES)}")
+    if raw.get('prefix') is not None and not isinstance(raw.get('prefix'), str):
+        errors.append("prefix must be a string")
+    try:
+        parse_priority(raw.get('priority'))
+    except (TypeError, ValueError):
+        errors.append("priority must be a number or urgent/high/normal/low")
+
+    filters = raw.get('filters')
+    if filters is not None:
+        if not isinstance(filters, dict):
+            errors.append("filters must be a mapping")
+        else:
+            unknown = set(filters) - set(FILTER_KEYS)
+            if unknown:
+                errors.append(f"unknown filters: {', '.join(sorted(map(str, unknown)))}")
+            keywords = filters.get('keywords')
+            if keywords is not None and not isinstance(keywords, (str, list)):
+                errors.append("filters.keywords must be a list")
+            try:
+                int(filters.get('min_length') or 0)
+            except (TypeError, ValueError):
+                errors.append("filters.min_length must be a number")
+
+    digest = raw.get('digest')
+    if digest is not None:
+        if mode != 'DIGEST':
+            errors.append("digest is only valid with mode DIGEST")
+        elif not isinstance(digest, dict):
+            errors.append("digest must be a mapping")
+        else:
+            unknown = set(digest) - set(DIGEST_KEYS)
+            if unknown:
+                errors.append(f"unknown digest fields: {', '.join(sorted(map(str, unknown)))}")
+            try:
+                config = parse_digest_config(digest)
+            except (TypeError, ValueError):
+                errors.append("digest interval/max_messages/max_chars must be numbers")
+            else:
+                for field in ('interval', 'max_messages', 'max_chars'):
+                    if getattr(config, field) <= 0:
+                        errors.append(f"digest.{field} must be positive")
+    return errors
+
+def validate_routes(data) -> List[str]:
+    """בודק קובץ routes שלם (אחרי yaml.safe_load)"""
+    if data is None:
+        return []
+    if not isinstance(data, dict):
+        return ["file must be a mapping with a 'routes' list"]
+    routes = data.get('routes') or []
+    if not isinstance(routes, list):
+        return ["'routes' must be a list"]
+    errors = []
+    seen = set()
+    for i, raw in enumerate(routes, 1):
+        errors.extend(f"route {i}: {e}" for e in validate_route(raw))
+        route_id = raw.get('id') if isinstance(raw, dict) else None
+        if route_id:
+            if route_id in seen:
+                errors.append(f"route {i}: duplicate id {route_id}")
+            seen.add(route_id)
+    return errors
+
+def auto_route_id(raw: dict) -> str:
+    """id יציב (לפי התוכן) ל-route שאין לו id בקובץ"""
+    content = json.dumps(raw, sort_keys=True, ensure_ascii=False, default=str)
+    return "auto-" + hashlib.sha1(content.encode()).hexdigest()[:8]
+
+def with_route_ids(routes: list) -> list:
+    """עותק של הרשימה שבו לכל route יש id - בלי לשנות את הקובץ
+
+    ה-API וה-router מחשבים את אותם ids, כך שאפשר לערוך/למחוק route בלי id לפי ה-id שהוחזר
+    """
+    seen = {str(r['id']) for r in routes if isinstance(r, dict) and r.get('id')}
+    result = []
+    for raw in routes:
+        if isinstance(raw, dict) and not raw.get('id'):
+            base = route_id = auto_route_id(raw)
+            n = 2
+            while route_id in seen:
+                route_id = f"{base}-{n}"
+                n += 1
+            seen.add(route_id)
+            raw = dict(raw, id=route_id)
+        result.append(raw)
+    return result
+
+def split_routes(data) -> Tuple[Optional[list], List[str]]:
+    """(routes תקינים, שגיאות) - route שגוי מדולג; None אם הקובץ עצמו לא תקין"""
+    errors = validate_routes(data)
+    if data is None:
+        return [], []
+    if not isinstance(data, dict) or not isinstance(data.get('routes') or [], list):
+        return None, errors
+    valid = []
+    seen = set()
+    for raw in with_route_ids(data.get('routes') or []):
+        if validate_route(raw):
+            continue
+        route_id = raw.get('id')
+        if route_id:
+            if route_id in seen:
+                continue
+            seen.add(route_id)
+        valid.append(raw)
+    return valid, errors
+
+class RouteTable:
+    """routes של חשבון, מאונדקסים לפי צ'אט מקור"""
+    __slots__ = ("routes", "by_source", "catch_all")
+
+    def __init__(self, routes: Iterable[Route] = ()):
+        self.routes: Tuple[Route, ...] = tuple(routes)
+        by_source: Dict[object, List[Route]] = {}
+        catch_all = []
+        for route in self.routes:
+            if route.source:
+                by_source.setdefault(route.source, []).append(route)
+            else:
+                catch_all.append(route)
+        self.by_source: Dict[object, Tuple[Route, ...]] = {
+            source: tuple(rs) for source, rs in by_source.items()
+        }
+        self.catch_all: Tuple[Route, ...] = tuple(catch_all)
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def __iter__(self):
+        return iter(self.routes)
+
+    def for_chat(self, chat_id, sourced: bool = True, catch_all: bool = True) -> Tuple[Route, ...]:
+        """ה-routes שרלוונטיים לצ'אט"""
+        matched = self.by_source.get(chat_id, ()) if sourced else ()
+        if catch_all and self.catch_all:
+            return matched + self.catch_all
+        return matched
+
+    def sources(self) -> List[int]:
+        """צ'אטי המקור המספריים"""
+        return [s for s in self.by_source if isinstance(s, int)]
+
+    def dests(self) -> set:
+        """כל היעדים"""
+        return {route.dest for route in self.routes if route.dest}
+
+    def with_changes(self, put: Dict[str, Route], delete: Iterable[str] = ()) -> "RouteTable":
+        """טבלה חדשה עם routes שנוספו/הוחלפו (לפי id) או נמחקו
+
+        רק רשימות המקור שהשתנו נבנות מחדש; שאר ה-tuples משותפים עם הטבלה הקודמת
+        """
+        delete = set(delete)
+        changed = delete | set(put)
+        touched = set()   # מקורות שהרשימה שלהם משתנה (None = catch-all)
+        routes = []
+        for route in self.routes:
+            if route.id in changed:
+                touched.add(route.source or None)
+                if route.id in delete or route.id not in put:
+                    continue
+                route = put[route.id]
+                touched.add(route.source or None)
+                changed.discard(route.id)
+            routes.append(route)
+        for route_id in changed - delete:
+            route = put[route_id]
+            touched.add(route.source or None)
+            routes.append(route)
+
+        table = RouteTable.__new__(RouteTable)
+        table.routes = tuple(routes)
+        rebuilt: Dict[object, List[Route]] = {source: [] for source in touched}
+        for route in table.routes:
+            source = route.source or None
+            if source in rebuilt:
+                rebuilt[source].append(route)
+        by_source = dict(self.by_source)
+        for source, rs in rebuilt.items():
+            if source is None:
+                continue
+            if rs:
+                by_source[source] = tuple(rs)
+            else:
+                by_source.pop(source, None)
+        table.by_source = by_source
+        table.catch_all = tuple(rebuilt[None]) if None in rebuilt else self.catch_all
+        return table
+
+def compile_routes(raw_routes: Optional[list]) -> RouteTable:
+    """מקמפל רשימת routes מה-YAML"""
+    return RouteTable(compile_route(r) for r in (raw_routes or []) if isinstance(r, dict))
+
+EMPTY_TABLE = RouteTable()
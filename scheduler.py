@@ -0,0 +1,289 @@
+"""
+תור שליחה לפי עדיפות - routes דחופים נשלחים לפני תעבורה המונית, עם הגנה מהרעבה
+"""
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))             # שליחות במקביל
+STARVATION_AFTER = float(os.getenv("STARVATION_AFTER", "5"))   # שניות המתנה מקסימליות לנתיב נמוך
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", "10000"))     # שליחות בתור לפני שהקליטה ממתינה
+SEND_QUEUE_RESERVE = int(os.getenv("SEND_QUEUE_RESERVE", "1000"))  # מקומות נוספים מעל SEND_QUEUE_MAX רק ל-high/urgent
+WAIT_SAMPLES = 256   # זמני המתנה אחרונים לכל נתיב (לחישוב p95)
+
+PRIORITIES = {"low": -1, "normal": 0, "high": 1, "urgent": 2}
+
+def parse_priority(value) -> int:
+    """ממיר priority מה-YAML (שם או מספר) למספר; גבוה = קודם"""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, str):
+        name = value.strip().lower()
+        if name in PRIORITIES:
+            return PRIORITIES[name]
+        return int(name)
+    return int(value)
+
+class LaneStats:
+    """סטטיסטיקת המתנה בתור של נתיב"""
+    __slots__ = ("sent", "waits", "max_wait", "starved")
+
+    def __init__(self):
+        self.sent = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.max_wait = 0.0
+        self.starved = 0   # כמה פעמים נשלף בגלל הגנת ההרעבה
+
+    def record(self, wait: float, starved: bool):
+        self.sent += 1
+        self.waits.append(wait)
+        if wait > self.max_wait:
+            self.max_wait = wait
+        if starved:
+            self.starved += 1
+
+    def to_dict(self, queued: int) -> dict:
+        waits = sorted(self.waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "queued": queued,
+            "sent": self.sent,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p95_wait_ms": round(p95 * 1000, 1),
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "starved": self.starved,
+        }
+
+Job = Callable[[], Awaitable[Optional[float]]]   # מחזיר שניות → לנסות שוב אחר כך
+Entry = Tuple[int, int, float, Job]              # (-עדיפות, מספר סידורי, זמן כניסה לתור, job)
+
+class PriorityScheduler:
+    """תור לכל key (זרם, למשל (owner, dest, source)) עם שליחה אחת בדרך לכל key; keys שונים במקביל
+
+    התור של key מסודר לפי (עדיפות, סדר הגעה): הודעה דחופה עוקפת backlog נמוך של אותו זרם,
+    והודעות באותה עדיפות (כולל אלבומים) יוצאות בסדר שבו התקבלו. ה-keys המוכנים ממתינים בנתיב
+    (deque) לפי העדיפות של ההודעה הראשונה בתור שלהם, ו-workers שולפים מהנתיב הגבוה ביותר.
+    נתיב נמוך שההודעה הוותיקה בו ממתינה יותר מ-STARVATION_AFTER נשלף לפני הגבוהים.
+    job שמחזיר מספר שניות חוזר למקומו בתור של ה-key וממתין בלי להחזיק worker.
+    """
+
+    def __init__(self, workers: int = SEND_WORKERS, starvation_after: float = STARVATION_AFTER,
+                 max_queued: int = SEND_QUEUE_MAX, reserve: int = SEND_QUEUE_RESERVE):
+        self.workers = workers
+        self.starvation_after = starvation_after
+        self.max_queued = max_queued
+        self.reserve = reserve             # מקומות ל-high/urgent כשהתור מלא בתעבורה רגילה
+        self.queues: Dict[Hashable, List[Entry]] = {}  # key → heap של Entry
+        self.ready_in: Dict[Hashable, int] = {}        # key → הנתיב שהוא ממתין בו
+        self._seq = itertools.count()
+        self.busy = set()                  # keys עם שליחה בדרך
+        self.deferred = set()              # keys שההודעה הראשונה שלהם ממתינה לניסיון חוזר
+        self.lanes: Dict[int, Deque[Hashable]] = {}   # keys מוכנים לפי עדיפות ההודעה הראשונה
+        self.order: Tuple[int, ...] = ()   # עדיפויות מהגבוהה לנמוכה
+        self.stats: Dict[int, LaneStats] = {}
+        self.queued_by: Dict[int, int] = {}
+        self.pending = 0                   # בתור + בשליחה
+        self._tasks = []
+        self._timers = set()
+        self._ready: Optional[asyncio.Condition] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._idle: Optional[asyncio.Event] = None
+
+    def _lane(self, priority: int) -> Deque[Hashable]:
+        lane = self.lanes.get(priority)
+        if lane is None:
+            lane = self.lanes[priority] = deque()
+            self.stats[priority] = LaneStats()
+            self.queued_by[priority] = 0
+            self.order = tuple(sorted(self.lanes, reverse=True))
+        return lane
+
+    def start(self):
+        """מפעיל את ה-workers (בתוך event loop רץ)"""
+        if self._tasks:
+            return
+        self._ready = asyncio.Condition()
+        self._space = asyncio.Condition()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, priority: int, job: Job, key: Hashable = None):
+        """מוסיף שליחה לתור של key (למשל (owner, dest, source)); ממתין כשהתור מלא (backpressure)
+
+        high/urgent (עדיפות > 0) ממתינים רק אחרי SEND_QUEUE_RESERVE מקומות נוספים, כך שהצפה
+        של תעבורה רגילה לא חוסמת קליטה של הודעות דחופות
+        """
+        self.start()
+        limit = self.max_queued + (self.reserve if priority > 0 else 0)
+        if self.pending >= limit:
+            async with self._space:
+                await self._space.wait_for(lambda: self.pending < limit)
+        if key is None:
+            key = object()  # בלי סדר מחייב - key חד-פעמי
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = []
+        heapq.heappush(queue, (-priority, next(self._seq), time.monotonic(), job))
+        self._lane(priority)
+        self.queued_by[priority] += 1
+        self.pending += 1
+        self._idle.clear()
+        lane = self.ready_in.get(key)
+        if lane is not None and priority > lane:
+            # הודעה דחופה יותר בראש התור - ה-key עובר לנתיב שלה
+            self.lanes[lane].remove(key)
+            del self.ready_in[key]
+            await self._make_ready(key)
+        elif lane is None and key not in self.busy and key not in self.deferred:
+            await self._make_ready(key)
+
+    async def _make_ready(self, key: Hashable):
+        """key שיש לו הודעה בתור ואין לו שליחה בדרך - נכנס לנתיב של ההודעה הראשונה"""
+        priority = -self.queues[key][0][0]
+        self._lane(priority).append(key)
+        self.ready_in[key] = priority
+        async with self._ready:
+            self._ready.notify()
+
+    def _pick(self) -> Optional[Tuple[Hashable, int, Entry, bool]]:
+        """הנתיב הגבוה ביותר שלא ריק, אלא אם נתיב נמוך יותר ממתין יותר מדי
+
+        (key, עדיפות, Entry, נשלף בגלל הרעבה)
+        """
+        now = time.monotonic()
+        top = None
+        picked = None
+        for priority in self.order:
+            lane = self.lanes[priority]
+            if not lane:
+                continue
+            if top is None:
+                top = priority
+            elif now - self.queues[lane[0]][0][2] >= self.starvation_after:
+                picked = (priority, True)
+                break
+        if picked is None:
+            if top is None:
+                return None
+            picked = (top, False)
+        priority, starved = picked
+        key = self.lanes[priority].popleft()
+        del self.ready_in[key]
+        entry = heapq.heappop(self.queues[key])
+        self.busy.add(key)
+        self.queued_by[priority] -= 1
+        return key, priority, entry, starved
+
+    async def _worker(self):
+        while True:
+            async with self._ready:
+                picked = self._pick()
+                while picked is None:
+                    await self._ready.wait()
+                    picked = self._pick()
+            key, priority, entry, starved = picked
+            enqueued, job = entry[2], entry[3]
+            self.stats[priority].record(time.monotonic() - enqueued, starved)
+            retry = None
+            try:
+                retry = await job()
+            except Exception as e:
+                print(f"✗ Send job failed: {e}")
+            if retry:
+                self._defer(key, retry, entry)
+                continue
+            self.pending -= 1
+            await self._release(key)
+            if self.pending == 0:
+                self._idle.set()
+
+    def _defer(self, key: Hashable, delay: float, entry: Entry):
+        """ה-job חוזר למקומו בתור של key, וה-key נכנס לנתיב רק אחרי delay"""
+        heapq.heappush(self.queues[key], entry)
+        self.queued_by[-entry[0]] += 1
+        self.busy.discard(key)
+        self.deferred.add(key)
+        timer = asyncio.create_task(self._resume(key, delay))
+        self._timers.add(timer)
+        timer.add_done_callback(self._timers.discard)
+
+    async def _resume(self, key: Hashable, delay: float):
+        await asyncio.sleep(delay)
+        if key not in self.deferred:
+            return  # נזרק בינתיים (discard)
+        self.deferred.discard(key)
+        if self.queues.get(key):
+            await self._make_ready(key)
+
+    async def _release(self, key: Hashable):
+        """סיום שליחה של key - ההודעה הבאה שלו (אם יש) נכנסת לנתיב"""
+        self.busy.discard(key)
+        if self.queues[key]:
+            await self._make_ready(key)
+        else:
+            del self.queues[key]
+        async with self._space:
+            self._space.notify()
+
+    async def join(self, timeout: float = None) -> bool:
+        """ממתין שכל השליחות יסתיימו; False אם עבר ה-timeout"""
+        if self._idle is None or self.pending == 0:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def pending_for(self, match: Callable[[Hashable], bool]) -> int:
+        """שליחות בתור או בדרך של keys ש-match מחזיר עליהם True"""
+        return (sum(len(queue) for key, queue in self.queues.items() if match(key))
+                + sum(1 for key in self.busy if match(key)))
+
+    async def wait_for(self, match: Callable[[Hashable], bool], timeout: float) -> bool:
+        """ממתין שהשליחות של keys מסוימים (למשל חשבון שנעצר) יסתיימו; False אם עבר ה-timeout"""
+        deadline = time.monotonic() + timeout
+        while self.pending_for(match):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def discard(self, match: Callable[[Hashable], bool]) -> int:
+        """זורק שליחות שעוד בתור של keys מסוימים (שליחה שכבר בדרך מסתיימת); מחזיר כמה נזרקו"""
+        dropped = 0
+        for key in [k for k in self.queues if match(k)]:
+            queue = self.queues[key]
+            for entry in queue:
+                self.queued_by[-entry[0]] -= 1
+            dropped += len(queue)
+            queue.clear()
+            self.deferred.discard(key)
+            lane = self.ready_in.pop(key, None)
+            if lane is not None:
+                self.lanes[lane].remove(key)
+            if key not in self.busy:
+                del self.queues[key]
+        self.pending -= dropped
+        if dropped and self.pending == 0:
+            self._idle.set()
+        return dropped
+
+    def queued(self) -> int:
+        return sum(self.queued_by.values())
+
+    def stop(self):
+        """עוצר את ה-workers (שליחות שבתור נזרקות)"""
+        for task in self._tasks + list(self._timers):
+            task.cancel()
+        self._tasks = []
+
+    def status(self) -> Dict[str, dict]:
+        """סטטיסטיקה לכל נתיב (לקובץ הסטטוס)"""
+        return {str(priority): self.stats[priority].to_dict(self.queued_by[priority])
+                for priority in self.order}
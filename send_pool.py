@@ -0,0 +1,159 @@
+"""
+מאגר חשבונות שולחים לכל יעד - פיזור שליחות לפי token bucket והיסטוריית FloodWait
+
+ה-token bucket משמש לדירוג בלבד (לאיזה חשבון נשלח הכי מעט לאחרונה) ולא מגביל קצב;
+ההגבלה בפועל היא FloodWait של טלגרם, שמוציא את החשבון מהבחירה עד שהוא עובר.
+"""
+import os
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Set
+
+SEND_RATE = float(os.getenv("SEND_RATE", "1.0"))        # שליחות לשנייה לכל חשבון
+SEND_BURST = float(os.getenv("SEND_BURST", "5"))        # גודל הדלי
+FLOOD_MEMORY = float(os.getenv("FLOOD_MEMORY", "900"))  # כמה זמן (שניות) FloodWait נחשב בהיסטוריה
+FORBIDDEN_TTL = float(os.getenv("FORBIDDEN_TTL", "3600"))  # כמה זמן (שניות) חשבון בלי הרשאה ליעד לא נבחר
+FLOOD_PENALTY = 2.0  # ניכוי מה-headroom לכל FloodWait אחרון
+FLOOD_HISTORY = 32   # מספר FloodWait אחרונים שנשמרים לכל חשבון
+
+class TokenBucket:
+    """token bucket פשוט (לדירוג - לא חוסם שליחה)"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float = SEND_RATE, capacity: float = SEND_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def headroom(self, now: float) -> float:
+        """כמות ה-tokens הזמינה כרגע"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, now: float):
+        """צורך token (יכול לרדת מתחת לאפס - מייצג חוב)"""
+        self.headroom(now)
+        self.tokens -= 1
+
+class SendPool:
+    """בוחר דרך איזה חשבון לשלוח ליעד"""
+
+    def __init__(self, is_alive: Callable[[str], bool]):
+        self.is_alive = is_alive
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.flood_until: Dict[str, float] = {}        # account → עד מתי חסום
+        self.floods: Dict[str, deque] = {}             # account → זמני FloodWait אחרונים
+        self.pools: Dict[object, Set[str]] = {}        # dest → חשבונות שיכולים לשלוח אליו
+        self.dests: Dict[str, frozenset] = {}          # account → היעדים שלו
+        self.forbidden: Dict[object, Dict[str, float]] = {}  # dest → account → עד מתי לא נבחר
+
+    def set_destinations(self, account_name: str, dests: Iterable):
+        """מעדכן לאילו יעדים חשבון מורשה לשלוח (לפי ה-routes שלו)"""
+        dests = frozenset(dests)
+        old = self.dests.pop(account_name, frozenset())
+        if dests:
+            self.dests[account_name] = dests
+        for dest in old - dests:
+            pool = self.pools.get(dest)
+            if pool is not None:
+                pool.discard(account_name)
+                if not pool:
+                    del self.pools[dest]
+        for dest in dests - old:
+            self.pools.setdefault(dest, set()).add(account_name)
+
+    def remove_account(self, account_name: str):
+        """מסיר חשבון מכל המאגרים"""
+        self.set_destinations(account_name, ())
+        self.buckets.pop(account_name, None)
+
+    def _bucket(self, account_name: str) -> TokenBucket:
+        bucket = self.buckets.get(account_name)
+        if bucket is None:
+            bucket = self.buckets[account_name] = TokenBucket()
+        return bucket
+
+    def _recent_floods(self, account_name: str, now: float) -> int:
+        history = self.floods.get(account_name)
+        if not history:
+            return 0
+        while history and now - history[0] > FLOOD_MEMORY:
+            history.popleft()
+        return len(history)
+
+    def _forbidden(self, dest, now: float) -> Set[str]:
+        forbidden = self.forbidden.get(dest)
+        if not forbidden:
+            return set()
+        for account_name in [a for a, until in forbidden.items() if until <= now]:
+            del forbidden[account_name]
+        if not forbidden:
+            del self.forbidden[dest]
+        return set(forbidden)
+
+    def _candidates(self, dest, fallback: str, readers: Optional[Iterable[str]], now: float) -> Set[str]:
+        candidates = set(self.pools.get(dest, ()))
+        if readers is not None:
+            candidates.intersection_update(readers)
+        candidates.add(fallback)
+        return candidates - self._forbidden(dest, now)
+
+    def reachable(self, dest, fallback: str, readers: Optional[Iterable[str]] = None) -> bool:
+        """האם יש חשבון שמורשה לשלוח ליעד (גם אם כרגע ב-FloodWait / מנותק)"""
+        return bool(self._candidates(dest, fallback, readers, time.monotonic()))
+
+    def retry_after(self, dest, fallback: str, readers: Optional[Iterable[str]] = None) -> Optional[float]:
+        """שניות עד שה-FloodWait הקרוב של מועמד ליעד נגמר; None אם אף מועמד לא ב-FloodWait"""
+        now = time.monotonic()
+        waits = [self.flood_until[account_name] - now
+                 for account_name in self._candidates(dest, fallback, readers, now)
+                 if self.flood_until.get(account_name, 0.0) > now and self.is_alive(account_name)]
+        return min(waits) if waits else None
+
+    def choose(self, dest, fallback: str, exclude: Set[str] = frozenset(),
+               readers: Optional[Iterable[str]] = None) -> Optional[str]:
+        """בוחר את החשבון עם הכי הרבה headroom (בשוויון - fallback)
+
+        None אם כל המועמדים (כולל fallback) ב-FloodWait, מנותקים או בלי הרשאה ליעד.
+        readers - החשבונות שרואים את צ'אט המקור (רק הם יכולים להעביר ממנו לפי מזהה)
+        """
+        now = time.monotonic()
+        candidates = self._candidates(dest, fallback, readers, now) - exclude
+
+        best, best_score = None, None
+        for account_name in candidates:
+            if self.flood_until.get(account_name, 0.0) > now or not self.is_alive(account_name):
+                continue
+            score = (self._bucket(account_name).headroom(now)
+                     - FLOOD_PENALTY * self._recent_floods(account_name, now))
+            # בשוויון - עדיפות לחשבון שקיבל את ההודעה
+            if best is None or score > best_score or (score == best_score and account_name == fallback):
+                best, best_score = account_name, score
+
+        if best is not None:
+            self._bucket(best).take(now)
+        return best
+
+    def on_flood(self, account_name: str, seconds: float):
+        """רושם FloodWait - החשבון לא ייבחר עד שיעבור"""
+        now = time.monotonic()
+        self.flood_until[account_name] = now + seconds
+        self.floods.setdefault(account_name, deque(maxlen=FLOOD_HISTORY)).append(now)
+
+    def on_forbidden(self, dest, account_name: str, ttl: float = FORBIDDEN_TTL):
+        """החשבון לא יכול לשלוח ליעד - לא לבחור אותו עד שיעבור ttl (אולי יקבל הרשאה)"""
+        self.forbidden.setdefault(dest, {})[account_name] = time.monotonic() + ttl
+
+    def status(self) -> Dict[str, dict]:
+        """מצב החשבונות: headroom ו-FloodWait"""
+        now = time.monotonic()
+        return {
+            account_name: {
+                "headroom": round(bucket.headroom(now), 2),
+                "flood_wait_s": round(max(0.0, self.flood_until.get(account_name, 0.0) - now), 1),
+                "recent_floods": self._recent_floods(account_name, now),
+            }
+            for account_name, bucket in self.buckets.items()
+        }
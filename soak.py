@@ -0,0 +1,364 @@
+"""
+בדיקת soak - MultiAccountTelefeed מול לקוחות מזויפים עם הזרקת תקלות אקראית
+(FloodWait, ניתוקים, timeouts, טעינת routes מחדש) ובדיקת invariants
+
+python soak.py                                   # 60 שניות, 200 הודעות לשנייה
+python soak.py --duration 600 --rate 500 --report soak.json
+python soak.py --compare soak_old.json --report soak_new.json
+
+ספים (כדי שריצות קצרות לא ייכשלו על רעש):
+- latency_recovers: p95 בשנייה אחרי סוף התקלות <= max(baseline p95 × --recover-factor, --recover-floor-ms);
+  שנייה עם פחות מ-MIN_BUCKET_SAMPLES שליחות מצטרפת לבאה, ו-baseline מפחות מ-MIN_WARMUP_SAMPLES
+  שליחות לא נחשב (רק ה-floor). --cooldown חייב להיות לפחות --recover-within.
+- urgent_first: p95 של שליחות דחופות <= max(חצי מ-p95 של התעבורה ההמונית, --recover-floor-ms).
+- memory_bounded: גידול הזיכרון של ה-router (בלי הרישומים של ה-soak עצמו) מאמצע הריצה לסופה.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import contextlib
+import io
+import tracemalloc
+from types import SimpleNamespace
+from telethon import errors
+from traffic_trace import FakeClient
+
+FAULTS = ("flood", "disconnect", "timeout", "reload")
+MIN_BUCKET_SAMPLES = 20   # שליחות מינימליות לחישוב p95 של שנייה אחרי התקלות
+MIN_WARMUP_SAMPLES = 50   # שליחות מינימליות ב-warmup כדי שה-baseline ייחשב
+
+class FaultyClient(FakeClient):
+    """FakeClient שאפשר להכניס אליו תקלה לפרק זמן"""
+
+    def __init__(self, send_latency: float = 0.0, flood_sleep_threshold: int = 0):
+        super().__init__(send_latency)
+        self.flood_sleep_threshold = flood_sleep_threshold   # כמו ב-TelegramClient
+        self.flood_until = 0.0
+        self.down_until = 0.0
+        self.slow_until = 0.0
+        self.delivered = []  # (source msg id, dest, זמן שליחה)
+        self.floods_raised = 0
+        self.floods_slept = 0
+
+    def is_connected(self) -> bool:
+        return self.connected and time.monotonic() >= self.down_until
+
+    async def _send(self, method: str, dest, payload):
+        now = time.monotonic()
+        if now < self.down_until:
+            raise ConnectionError("Cannot send requests while disconnected")
+        if now < self.flood_until:
+            seconds = max(1, int(self.flood_until - now))
+            if seconds <= self.flood_sleep_threshold:
+                # Telethon ממתין בעצמו ושולח שוב - ה-router לא רואה את ה-FloodWait
+                self.floods_slept += 1
+                await asyncio.sleep(seconds)
+                return await self._send(method, dest, payload)
+            self.floods_raised += 1
+            raise errors.FloodWaitError(request=None, capture=seconds)
+        if now < self.slow_until:
+            await asyncio.sleep(0.5)
+            raise asyncio.TimeoutError("request timed out")
+        sent = await super()._send(method, dest, payload)
+        self.delivered.append((payload, dest, time.monotonic()))
+        return sent
+
+def make_routes(rng: random.Random, accounts: int, chats: int, dests: int, per_account: int,
+                urgent: int = 0) -> dict:
+    """routes אקראיים - מקורות ויעדים משותפים בין חשבונות
+
+    כל חשבון מקבל גם עד urgent routes דחופים (מילת המפתח "urgent") על אותו מקור ויעד של route
+    המוני שלו - הודעה דחופה ותעבורה המונית חולקות את אותו זרם בתור
+    """
+    raw = {}
+    for i in range(accounts):
+        raw[f"acc{i}"] = [
+            {"source": -1000000000000 - rng.randrange(chats),
+             "dest": -1009000000000 - rng.randrange(dests),
+             "mode": "FORWARD", "priority": "low"}
+            for _ in range(per_account)
+        ]
+    # רק זוגות שאין לחשבון אחר (אחרת מניעת הכפילויות בין חשבונות שולחת דרך ה-route ההמוני)
+    pairs = {}
+    for name, routes in raw.items():
+        for route in routes:
+            pairs.setdefault((route["source"], route["dest"]), set()).add(name)
+    for name, routes in raw.items():
+        own = sorted({pair for pair, names in pairs.items() if names == {name}})
+        raw[name] = [
+            {"source": source, "dest": dest, "mode": "FORWARD", "priority": "urgent",
+             "filters": {"keywords": ["urgent"]}}
+            for source, dest in rng.sample(own, min(urgent, len(own)))
+        ] + routes   # לפני ה-route ההמוני - ההתאמה הראשונה ליעד קובעת את העדיפות
+    return raw
+
+def _router_memory() -> int:
+    """בתים שהוקצו ולא שוחררו, בלי הקצאות של הקובץ הזה (רשימות התוצאות גדלות עם הריצה)"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, __file__),))
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def soak(args) -> dict:
+    from telefeed_multi import MultiAccountTelefeed
+    from message_index import MessageIndex
+    from routing import compile_routes
+
+    rng = random.Random(args.seed)
+    raw = make_routes(rng, args.accounts, args.chats, args.dests, args.routes, args.urgent_routes)
+    urgent_pairs = {(route["source"], route["dest"]) for routes in raw.values() for route in routes
+                    if route.get("priority") == "urgent"}
+    system = MultiAccountTelefeed(index=MessageIndex(":memory:"), digest_file=None,
+                                  peer_cache_file=None, stats_file=None, trace_file=None)
+    # אותו סף כמו ב-clients האמיתיים של ה-router (FLOOD_SLEEP_THRESHOLD)
+    clients = {name: FaultyClient(args.send_latency, args.flood_sleep_threshold) for name in raw}
+    system.manager.accounts = {name: {"enabled": True} for name in raw}
+    system.manager.clients = dict(clients)
+    for name, routes in raw.items():
+        system.set_routes(name, compile_routes(routes))
+
+    # מי מקבל כל צ'אט (כל חשבון שיש לו route ממנו - כמו חבר בערוץ)
+    members = {}
+    for name, routes in raw.items():
+        for route in routes:
+            members.setdefault(route["source"], set()).add(name)
+    chats = sorted(members)
+
+    received_at = {}   # msg id → זמן קבלה
+    urgent_msgs = {}   # msg id דחוף → צ'אט
+    expected = set()   # (msg id, dest)
+    faults = []        # (kind, account, start, end)
+    tasks = set()
+    start = time.monotonic()
+    fault_stop = start + args.duration
+    end = fault_stop + args.cooldown
+
+    async def inject():
+        await asyncio.sleep(args.warmup)
+        while time.monotonic() < fault_stop:
+            await asyncio.sleep(rng.expovariate(1 / args.fault_every))
+            kind = rng.choice(FAULTS)
+            name = rng.choice(list(clients))
+            client = clients[name]
+            length = rng.uniform(1, args.fault_max)
+            now = time.monotonic()
+            if kind == "flood":
+                client.flood_until = now + length
+            elif kind == "disconnect":
+                client.down_until = now + length
+            elif kind == "timeout":
+                client.slow_until = now + length
+            else:
+                system.set_routes(name, compile_routes(raw[name]))
+                length = 0.0
+            faults.append((kind, name, now - start, now + length - start))
+
+    async def receive(msg_id, chat, text):
+        message = SimpleNamespace(chat_id=chat, id=msg_id, message=text, text=text, media=None)
+        event = SimpleNamespace(message=message)
+        online = [name for name in sorted(members[chat]) if clients[name].is_connected()]
+        if not online:
+            return  # אף חשבון לא מחובר - טלגרם לא מסרה את ההודעה
+        received_at[msg_id] = time.monotonic()
+        if text != "soak":
+            urgent_msgs[msg_id] = chat
+        for owner in system.elector.owners(chat):
+            for route in system.routes_cache[owner].for_chat(chat):
+                expected.add((msg_id, route.dest))
+        # כל חשבון מחובר מקבל את ההודעה בנפרד
+        await asyncio.gather(*(system.handle_new_message(name, event) for name in online))
+
+    tracemalloc.start()
+    injector = asyncio.create_task(inject())
+    mem_mid = None
+    mid = start + (args.duration + args.cooldown) / 2
+    msg_id = 0
+    interval = 1 / args.rate
+    while time.monotonic() < end:
+        msg_id += 1
+        text = "urgent soak" if rng.random() < args.urgent_share else "soak"
+        task = asyncio.create_task(receive(msg_id, rng.choice(chats), text))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        if mem_mid is None and time.monotonic() >= mid:
+            mem_mid = _router_memory()
+        await asyncio.sleep(interval)
+    injector.cancel()
+    await asyncio.gather(*tasks)
+    drained = await system.scheduler.join(args.drain_timeout)
+    mem_end = _router_memory()
+    tracemalloc.stop()
+
+    # ====== תוצאות ======
+    deliveries = {}
+    latencies = []    # (זמן שליחה יחסי, השהייה)
+    urgent_lat = []   # השהייה של שליחות דרך route דחוף
+    bulk_lat = []     # השהייה של כל השאר
+    for client in clients.values():
+        for src_msg, dest, sent_at in client.delivered:
+            key = (src_msg, dest)
+            deliveries[key] = deliveries.get(key, 0) + 1
+            latencies.append((sent_at - start, sent_at - received_at[src_msg]))
+            if (urgent_msgs.get(src_msg), dest) in urgent_pairs:
+                urgent_lat.append(sent_at - received_at[src_msg])
+            else:
+                bulk_lat.append(sent_at - received_at[src_msg])
+    duplicates = sum(count - 1 for count in deliveries.values() if count > 1)
+    lost = len(expected - set(deliveries))
+    failed = sum(entry[2] for entry in system.counters.totals.values())
+    floods_slept = sum(c.floods_slept for c in clients.values())
+    floods_raised = sum(c.floods_raised for c in clients.values())
+    pool_floods = sum(len(history) for history in system.send_pool.floods.values())
+
+    warm = [lat for t, lat in latencies if t < args.warmup]
+    baseline = _percentile(warm, 95) if len(warm) >= MIN_WARMUP_SAMPLES else None
+    threshold = max((baseline or 0.0) * args.recover_factor, args.recover_floor_ms / 1000)
+    # זמן התאוששות: השנייה הראשונה אחרי סוף התקלות שבה p95 חזר לסף
+    buckets = {}
+    for t, lat in latencies:
+        if t >= args.duration:
+            buckets.setdefault(int(t - args.duration), []).append(lat)
+    recovered_after = None
+    window = []
+    for second in sorted(buckets):
+        window += buckets[second]
+        if len(window) < MIN_BUCKET_SAMPLES:
+            continue  # מעט מדי שליחות - מצטרפת לשנייה הבאה
+        if _percentile(window, 95) <= threshold:
+            recovered_after = float(second)
+            break
+        window = []
+    last_fault_end = max((f[3] for f in faults), default=0.0)
+    mem_mid = mem_end if mem_mid is None else mem_mid
+    all_lat = [lat for _, lat in latencies]
+    urgent_p95 = _percentile(urgent_lat, 95)
+
+    invariants = {
+        "no_duplicates": duplicates == 0,
+        "no_loss": lost == 0,
+        "no_silent_loss": lost <= failed,
+        # כל FloodWait מגיע ל-SendPool (מעבר לחשבון אחר) ולא נבלע בהמתנה בתוך ה-client
+        "floods_reach_pool": floods_slept == 0 and (floods_raised == 0 or pool_floods > 0),
+        "drained": drained,
+        "memory_bounded": (mem_end - mem_mid) / 2**20 <= args.mem_growth_mb,
+        "latency_recovers": recovered_after is not None and recovered_after <= args.recover_within,
+        # דחוף לא ממתין מאחורי backlog המוני באותו זרם / בתור מלא
+        "urgent_first": not urgent_lat or urgent_p95 <= max(_percentile(bulk_lat, 95) / 2,
+                                                            args.recover_floor_ms / 1000),
+    }
+    system.index.close()
+    return {
+        "config": vars(args),
+        "python": platform.python_version(),
+        "messages": msg_id,
+        "received": len(received_at),
+        "expected_deliveries": len(expected),
+        "delivered": len(deliveries),
+        "duplicates": duplicates,
+        "lost": lost,
+        "failed_sends": failed,
+        "flood_waits": {"raised": floods_raised, "slept_in_client": floods_slept, "pool": pool_floods},
+        "throughput_msg_s": round(len(received_at) / (args.duration + args.cooldown), 1),
+        "latency_ms": {
+            "baseline_p95": round(baseline * 1000, 1) if baseline is not None else None,
+            "recover_threshold": round(threshold * 1000, 1),
+            "p50": round(_percentile(all_lat, 50) * 1000, 1),
+            "p95": round(_percentile(all_lat, 95) * 1000, 1),
+            "p99": round(_percentile(all_lat, 99) * 1000, 1),
+            "urgent_p95": round(urgent_p95 * 1000, 1),
+            "max": round(max(all_lat, default=0.0) * 1000, 1),
+        },
+        "recovered_after_s": recovered_after,
+        "last_fault_end_s": round(last_fault_end, 1),
+        "memory_mb": {"mid": round(mem_mid / 2**20, 2), "end": round(mem_end / 2**20, 2)},
+        "faults": {kind: sum(1 for f in faults if f[0] == kind) for kind in FAULTS},
+        "lanes": system.scheduler.status(),
+        "invariants": invariants,
+        "passed": all(invariants.values()),
+    }
+
+COMPARE_KEYS = ("throughput_msg_s", "delivered", "lost", "failed_sends", "recovered_after_s")
+
+def compare(old: dict, new: dict):
+    """מדפיס הפרשים מול דוח קודם"""
+    print("📊 Compared to previous report:")
+    for key in COMPARE_KEYS:
+        print(f"   {key}: {old.get(key)} → {new.get(key)}")
+    for key in ("p50", "p95", "p99"):
+        print(f"   latency {key} ms: {old['latency_ms'].get(key)} → {new['latency_ms'].get(key)}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Telefeed soak test with fault injection")
+    parser.add_argument("--duration", type=float, default=60, help="seconds with fault injection")
+    parser.add_argument("--cooldown", type=float, default=15, help="seconds without faults at the end")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before the first fault (baseline)")
+    parser.add_argument("--rate", type=float, default=200, help="incoming messages per second")
+    parser.add_argument("--accounts", type=int, default=3)
+    parser.add_argument("--routes", type=int, default=30, help="routes per account")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--dests", type=int, default=10)
+    parser.add_argument("--urgent-routes", type=int, default=3,
+                        help="urgent routes per account sharing a source and dest with a bulk route")
+    parser.add_argument("--urgent-share", type=float, default=0.05, help="fraction of messages that are urgent")
+    parser.add_argument("--send-latency", type=float, default=0.005)
+    parser.add_argument("--fault-every", type=float, default=3, help="mean seconds between faults")
+    parser.add_argument("--fault-max", type=float, default=5, help="max fault length in seconds")
+    parser.add_argument("--recover-within", type=float, default=10, help="seconds to recover after faults")
+    parser.add_argument("--recover-factor", type=float, default=3, help="recovered = p95 <= baseline × factor")
+    parser.add_argument("--recover-floor-ms", type=float, default=50,
+                        help="p95 at or below this always counts as recovered (timer/scheduling noise)")
+    parser.add_argument("--mem-growth-mb", type=float, default=5)
+    parser.add_argument("--flood-sleep-threshold", type=int, default=None,
+                        help="client flood_sleep_threshold (default: the router's FLOOD_SLEEP_THRESHOLD)")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--report", help="write JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to compare with")
+    parser.add_argument("--verbose", action="store_true", help="show router log lines")
+    args = parser.parse_args(argv)
+    if args.flood_sleep_threshold is None:
+        from telefeed_multi import FLOOD_SLEEP_THRESHOLD
+        args.flood_sleep_threshold = FLOOD_SLEEP_THRESHOLD
+    if args.cooldown < args.recover_within:
+        parser.error("--cooldown must be at least --recover-within (recovery is measured during the cooldown)")
+
+    # לוג ה-router מוסתר אלא אם ביקשו --verbose
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        result = asyncio.run(soak(args))
+    result["config"] = {k: v for k, v in result["config"].items()
+                        if k not in ("report", "compare", "verbose")}
+
+    print("=" * 50)
+    print(f"📨 Messages: {result['received']} received, {result['expected_deliveries']} expected deliveries")
+    print(f"📤 Delivered: {result['delivered']}  lost: {result['lost']}  "
+          f"duplicates: {result['duplicates']}  failed sends: {result['failed_sends']}")
+    lat = result["latency_ms"]
+    print(f"⌛ Latency ms: baseline p95={lat['baseline_p95']} p50={lat['p50']} "
+          f"p95={lat['p95']} p99={lat['p99']} max={lat['max']} urgent p95={lat['urgent_p95']}")
+    if result["recovered_after_s"] is None:
+        print(f"🔁 Latency did not recover to {lat['recover_threshold']} ms during the cooldown")
+    else:
+        print(f"🔁 Recovered {result['recovered_after_s']}s after faults stopped")
+    print(f"💥 Faults: {result['faults']}  FloodWaits: {result['flood_waits']}")
+    for name, ok in result["invariants"].items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    print("=" * 50)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0 if result["passed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,16 @@
 
 # Start telefeed in background
 python telefeed_multi.py &
+ROUTER_PID=$!
 
-# Start web UI in foreground
-python web_ui.py
+# Start web UI
+python web_ui.py &
+WEB_PID=$!
+
+# העברת SIGTERM/SIGINT (redeploy) לשני התהליכים - ה-router מסיים שליחות לפני יציאה
+trap 'kill -TERM $ROUTER_PID $WEB_PID 2>/dev/null' TERM INT
+
+# ממתינים עד שאחד התהליכים יוצא, ואז עוצרים את השני
+wait -n
+kill -TERM $ROUTER_PID $WEB_PID 2>/dev/null
+wait
@@ -0,0 +1,88 @@
+"""
+ציר זמן של הפעלה קרה: import → config → connect → authorize → first update → first delivery
+
+הזמנים נמדדים מתחילת התהליך (כולל עליית ה-interpreter) ונשמרים עם היסטוריה של הפעלות קודמות,
+כדי לזהות רגרסיות בזמן העלייה בין deploys. המודול בלי תלויות כדי שאפשר לייבא אותו ראשון.
+"""
+import os
+import json
+import time
+from typing import Dict, Optional
+
+T0 = time.perf_counter()
+STARTUP_FILE = os.path.join("accounts", "startup.json")            # ACCOUNTS_DIR (בלי לייבא את telethon)
+STARTUP_HISTORY = int(os.getenv("STARTUP_HISTORY", "20"))         # כמה הפעלות קודמות לשמור
+
+def _process_age() -> float:
+    """כמה זמן התהליך רץ לפני שהמודול יובא (Linux; 0 אם לא ידוע)"""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+class StartupTimeline:
+    """הפעם הראשונה שכל שלב קרה - כללית ולכל חשבון"""
+
+    def __init__(self, path: Optional[str] = None, t0: float = T0):
+        self.path = path   # None = לא שומרים (כלי בדיקה שמריצים את ה-router)
+        self.t0 = t0 - _process_age()
+        self.started_at = time.time() - (time.perf_counter() - self.t0)
+        self.phases: Dict[str, float] = {}
+        self.accounts: Dict[str, Dict[str, float]] = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def mark(self, phase: str, account_name: str = None) -> bool:
+        """רושם שלב אם הוא קורה לראשונה; True אם זו הפעם הראשונה בתהליך"""
+        if account_name is not None:
+            phases = self.accounts.get(account_name)
+            if phases is None:
+                phases = self.accounts[account_name] = {}
+            if phase not in phases:
+                phases[phase] = round(self.elapsed(), 4)
+        if phase in self.phases:
+            return False
+        self.phases[phase] = round(self.elapsed(), 4)
+        if phase == "first_delivery":
+            self.save()  # ההפעלה הקרה הסתיימה
+        return True
+
+    def report(self) -> dict:
+        return {"started_at": self.started_at, "pid": os.getpid(),
+                "phases": self.phases, "accounts": self.accounts}
+
+    def format(self) -> str:
+        return " → ".join(f"{phase} {t:.2f}s"
+                          for phase, t in sorted(self.phases.items(), key=lambda item: item[1]))
+
+    def save(self):
+        """שומר את ההפעלה הנוכחית בראש הקובץ, עם ההפעלות הקודמות (כתיבה אטומית)"""
+        if not self.path:
+            return
+        report = self.report()
+        history = [run for run in read_startup(self.path).get("history", [])
+                   if (run.get("pid"), run.get("started_at")) != (report["pid"], report["started_at"])]
+        history = ([report] + history)[:STARTUP_HISTORY]
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"last": report, "history": history}, f, ensure_ascii=False, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            print(f"Warning: Could not save startup timeline: {e}")
+
+def read_startup(path: str = STARTUP_FILE) -> dict:
+    """ציר הזמן האחרון וההיסטוריה ({} אם אין)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, IOError):
+        return {}
+
+# ציר זמן אחד לתהליך; נקודת הכניסה מגדירה path כדי לשמור
+timeline = StartupTimeline()
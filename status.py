@@ -0,0 +1,80 @@
+"""
+קובץ מצב משותף בין ה-router ל-Web UI (תהליכים נפרדים)
+"""
+import os
+import json
+import time
+from accounts_manager import ACCOUNTS_DIR
+
+STATUS_FILE = os.path.join(ACCOUNTS_DIR, "status.json")
+
+def write_status(data: dict, path: str = STATUS_FILE):
+    """כותב את מצב ה-router (כתיבה אטומית)"""
+    data = dict(data, updated_at=time.time())
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_file, path)
+
+def read_status(path: str = STATUS_FILE) -> dict:
+    """קורא את מצב ה-router; מחזיר {} אם אין"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, IOError):
+        return {}
+
+def format_duration(seconds) -> str:
+    """מציג משך זמן בקצרה: 45s / 12m / 3h 5m / 2d 4h"""
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m"
+    if seconds < 86400:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+
+class TrafficCounters:
+    """מוני הודעות/שליחות לכל חשבון, עם חישוב קצב בין snapshots"""
+
+    def __init__(self):
+        self.totals = {}   # account → [received, delivered, failed]
+        self._last = {}    # account → totals ב-snapshot הקודם
+        self._last_time = time.monotonic()
+
+    def _entry(self, account_name: str) -> list:
+        entry = self.totals.get(account_name)
+        if entry is None:
+            entry = self.totals[account_name] = [0, 0, 0]
+        return entry
+
+    def received(self, account_name: str):
+        self._entry(account_name)[0] += 1
+
+    def delivered(self, account_name: str):
+        self._entry(account_name)[1] += 1
+
+    def failed(self, account_name: str):
+        self._entry(account_name)[2] += 1
+
+    def snapshot(self) -> dict:
+        """סיכומים וקצב (לשנייה) מאז ה-snapshot הקודם"""
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-6)
+        result = {}
+        for account_name, (received, delivered, failed) in self.totals.items():
+            prev = self._last.get(account_name, (0, 0, 0))
+            result[account_name] = {
+                "received": received,
+                "delivered": delivered,
+                "failed": failed,
+                "msg_rate": round((received - prev[0]) / elapsed, 2),
+                "delivery_rate": round((delivered - prev[1]) / elapsed, 2),
+            }
+            self._last[account_name] = (received, delivered, failed)
+        self._last_time = now
+        return result
@@ -0,0 +1,185 @@
+"""
+מפקח חיבורים - זיהוי ניתוקים ותקיעות, וחיבור מחדש מדורג עם backoff
+"""
+import os
+import time
+import random
+import asyncio
+from typing import Dict, Optional
+from telethon.tl import functions
+
+SUPERVISE_EVERY = float(os.getenv("SUPERVISE_EVERY", "15"))     # שניות בין בדיקות
+PING_TIMEOUT = float(os.getenv("PING_TIMEOUT", "10"))
+STALL_AFTER = float(os.getenv("STALL_AFTER", "1800"))           # שניות שהמצב המקומי מפגר אחרי השרת → חיבור מחדש (0 = כבוי)
+MAX_PARALLEL_RECONNECTS = int(os.getenv("MAX_PARALLEL_RECONNECTS", "2"))
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+
+class AccountHealth:
+    """מצב חיבור של חשבון"""
+    __slots__ = ("state", "connected_since", "last_update", "rtt_ms",
+                 "reconnects", "last_error", "behind_since", "behind_target")
+
+    def __init__(self):
+        self.state = "connected"
+        self.connected_since: Optional[float] = time.time()
+        self.last_update: Optional[float] = None
+        self.rtt_ms: Optional[float] = None
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self.behind_since: Optional[float] = None   # מתי ה-pts/qts המקומי התחיל לפגר אחרי השרת
+        self.behind_target: Optional[tuple] = None  # מצב השרת באותו רגע - להגיע אליו = יש התקדמות
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        return {
+            "state": self.state,
+            "connected_since": self.connected_since,
+            "uptime_s": round(now - self.connected_since) if self.connected_since else None,
+            "last_update": self.last_update,
+            "since_update_s": round(now - self.last_update) if self.last_update else None,
+            "rtt_ms": self.rtt_ms,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
+
+class ConnectionSupervisor:
+    """task לכל חשבון שבודק חיבור, RTT וזרימת עדכונים"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.health: Dict[str, AccountHealth] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._reconnect_slots: Optional[asyncio.Semaphore] = None
+
+    def touch(self, account_name: str):
+        """נקרא על כל עדכון שמגיע לחשבון"""
+        health = self.health.get(account_name)
+        if health is not None:
+            health.last_update = time.time()
+
+    def is_healthy(self, account_name: str) -> bool:
+        """False אם החשבון באמצע חיבור מחדש / לא מורשה (חשבון בלי פיקוח נחשב תקין)"""
+        health = self.health.get(account_name)
+        return health is None or health.state == "connected"
+
+    def start(self, account_name: str):
+        """מתחיל לפקח על חשבון מחובר"""
+        if self._reconnect_slots is None:
+            self._reconnect_slots = asyncio.Semaphore(MAX_PARALLEL_RECONNECTS)
+        self.stop(account_name)
+        self.health[account_name] = AccountHealth()
+        self.tasks[account_name] = asyncio.create_task(self._watch(account_name))
+
+    def stop(self, account_name: str):
+        """מפסיק לפקח על חשבון"""
+        task = self.tasks.pop(account_name, None)
+        if task:
+            task.cancel()
+        health = self.health.get(account_name)
+        if health:
+            health.state = "stopped"
+            health.connected_since = None
+
+    def stop_all(self):
+        for account_name in list(self.tasks):
+            self.stop(account_name)
+
+    async def _ping(self, client):
+        """RPC קל ומדידת RTT - (מילישניות, מצב העדכונים בשרת)"""
+        start = time.perf_counter()
+        state = await asyncio.wait_for(client(functions.updates.GetStateRequest()), PING_TIMEOUT)
+        return round((time.perf_counter() - start) * 1000, 1), state
+
+    @staticmethod
+    def _local_state(client) -> Optional[tuple]:
+        """(pts, qts) שה-client כבר עיבד (None אם אין מצב מקומי להשוות)"""
+        try:
+            local = client._message_box.session_state()[0]
+            return local["pts"], local["qts"]
+        except Exception:
+            return None
+
+    def _check_stall(self, health: AccountHealth, client, server_state) -> Optional[str]:
+        """תקיעה = השרת התקדם וה-client לא מגיע לשם STALL_AFTER שניות; חשבון שקט לא מתקדם בכלל"""
+        local = self._local_state(client)
+        if local is None or server_state is None:
+            return None
+        server = (server_state.pts, server_state.qts)
+        # 0 = עוד אין מצב לתיבה הזאת
+        if health.behind_target is not None and all(
+                not mine or mine >= target for mine, target in zip(local, health.behind_target)):
+            health.behind_since = health.behind_target = None   # הגיע לאן שהשרת היה - יש זרימה
+        if any(mine and theirs > mine for mine, theirs in zip(local, server)):
+            if health.behind_since is None:
+                health.behind_since, health.behind_target = time.time(), server
+            elif time.time() - health.behind_since > STALL_AFTER:
+                return f"updates behind server for {STALL_AFTER:.0f}s"
+        return None
+
+    async def _watch(self, account_name: str):
+        health = self.health[account_name]
+        while True:
+            await asyncio.sleep(SUPERVISE_EVERY * random.uniform(0.8, 1.2))
+            client = self.manager.get_client(account_name)
+            if client is None:
+                return
+
+            problem = None
+            server_state = None
+            if not client.is_connected():
+                problem = "disconnected"
+            else:
+                try:
+                    health.rtt_ms, server_state = await self._ping(client)
+                except asyncio.TimeoutError:
+                    problem = f"ping timeout ({PING_TIMEOUT:.0f}s)"
+                except Exception as e:
+                    problem = f"ping failed: {e}"
+
+            if problem is None and STALL_AFTER:
+                problem = self._check_stall(health, client, server_state)
+
+            if problem:
+                print(f"[{account_name}] ⚠ {problem}, reconnecting")
+                health.last_error = problem
+                if not await self._reconnect(account_name, client, health):
+                    return
+
+    async def _reconnect(self, account_name: str, client, health: AccountHealth) -> bool:
+        """חיבור מחדש עם backoff אקספוננציאלי + jitter, מוגבל במקביליות"""
+        health.state = "reconnecting"
+        health.connected_since = None
+        attempt = 0
+        while True:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            await asyncio.sleep(delay)
+            async with self._reconnect_slots:
+                try:
+                    await client.disconnect()
+                    await client.connect()
+                    if not await client.is_user_authorized():
+                        health.state = "unauthorized"
+                        health.last_error = "session no longer authorized"
+                        print(f"[{account_name}] ✗ Not authorized after reconnect, need login via web UI")
+                        return False
+                    # משיכת עדכונים שהוחמצו בזמן הניתוק
+                    try:
+                        await client.catch_up()
+                    except Exception:
+                        pass
+                    health.state = "connected"
+                    health.connected_since = time.time()
+                    health.last_update = time.time()
+                    health.behind_since = health.behind_target = None
+                    health.reconnects += 1
+                    print(f"[{account_name}] ✓ Reconnected (attempt {attempt + 1})")
+                    return True
+                except Exception as e:
+                    health.last_error = f"reconnect failed: {e}"
+                    print(f"[{account_name}] ✗ Reconnect attempt {attempt + 1} failed: {e}")
+            attempt += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """מצב כל החשבונות (לקובץ הסטטוס)"""
+        return {name: health.to_dict() for name, health in self.health.items()}
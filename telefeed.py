@@ -1,23 +1,35 @@
 import os
-import asyncio
-from dotenv import load_dotenv
-load_dotenv()
 import time
 import asyncio
 import yaml
 from dotenv import load_dotenv
+
+# ====== ENV ======
+# לפני ייבוא המודולים של הפרויקט - הם קוראים משתני סביבה בזמן import
+APP_DIR  = os.path.dirname(os.path.abspath(__file__))
+ENV_FILE = os.path.join(APP_DIR, ".env")
+load_dotenv()
+load_dotenv(ENV_FILE)
+
+from startup import timeline
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
+from message_index import MessageIndex, message_id_of
+from traffic_trace import open_recorder
+from profiling import profiler
+from digest import DigestManager, parse_digest_config
+from scheduler import parse_priority
+
+timeline.mark("import")
 
 # ====== נתיבים וקבצים ======
-APP_DIR      = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR     = os.path.join(APP_DIR, "data")
 ROUTES_FILE  = os.path.join(APP_DIR, "routes.yaml")
-ENV_FILE     = os.path.join(APP_DIR, ".env")
-RELOAD_EVERY = int(os.getenv("ROUTES_RELOAD_EVERY", "5"))  # שניות לבדיקה אוטומטית
+INDEX_FILE   = os.path.join(DATA_DIR, "message_index.sqlite3")
+DIGEST_FILE  = os.path.join(DATA_DIR, "digest_buffers.json")
+STARTUP_FILE = os.path.join(DATA_DIR, "startup.json")
 
-# ====== ENV ======
-load_dotenv(ENV_FILE)
+RELOAD_EVERY = int(os.getenv("ROUTES_RELOAD_EVERY", "5"))  # שניות לבדיקה אוטומטית
 
 API_ID   = int(os.environ["API_ID"])
 API_HASH = os.environ["API_HASH"]
@@ -30,12 +42,14 @@ PHONE          = os.getenv("PHONE")                   # מספר טלפון לה
 
 # ====== ברירת מחדל גלובלית לחוקים ======
 global_defaults = {
-    "mode":       os.getenv("TRANSFER_MODE", "FORWARD").upper(),  # FORWARD | COPY | PREFIX
+    "mode":       os.getenv("TRANSFER_MODE", "FORWARD").upper(),  # FORWARD | COPY | PREFIX | DIGEST
     "prefix":     os.getenv("PREFIX", ""),
     "text_only":  os.getenv("TEXT_ONLY",  "false").lower() == "true",
     "media_only": os.getenv("MEDIA_ONLY", "false").lower() == "true",
 }
 
+timeline.mark("config")
+
 # ====== לוג פשוט עם חותמת זמן ======
 def log(*a):
     ts = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -76,17 +90,26 @@ def load_routes(force=False):
     routes   = cfg.get("routes", []) or []
 
     normalized = []
-    for r in routes:
+    for i, r in enumerate(routes, 1):
         # normalize + ירושה של ברירות מחדל
-        rr = dict(r)
-        rr["sources"]    = [int(x) for x in rr.get("sources", [])]
-        rr["dests"]      = [int(x) for x in rr.get("dests", [])]
-        rr["mode"]       = str(rr.get("mode", defaults["mode"])).upper()
-        rr["prefix"]     = rr.get("prefix", defaults["prefix"])
-        rr["text_only"]  = bool(rr.get("text_only",  defaults["text_only"]))
-        rr["media_only"] = bool(rr.get("media_only", defaults["media_only"]))
+        try:
+            rr = dict(r)
+            rr["sources"]    = [int(x) for x in rr.get("sources", [])]
+            rr["dests"]      = [int(x) for x in rr.get("dests", [])]
+            rr["mode"]       = str(rr.get("mode", defaults["mode"])).upper()
+            rr["prefix"]     = rr.get("prefix", defaults["prefix"])
+            rr["text_only"]  = bool(rr.get("text_only",  defaults["text_only"]))
+            rr["media_only"] = bool(rr.get("media_only", defaults["media_only"]))
+            rr["priority"]   = parse_priority(rr.get("priority"))
+            rr["digest"]     = parse_digest_config(rr.get("digest")) if rr["mode"] == "DIGEST" else None
+        except (TypeError, ValueError) as e:
+            # route שגוי מדולג - שאר ה-routes ממשיכים לרוץ
+            log(f"⚠️ route {i} skipped: {e}")
+            continue
         normalized.append(rr)
 
+    # חוקים בעדיפות גבוהה נשלחים ראשונים
+    normalized.sort(key=lambda rr: rr["priority"], reverse=True)
     _routes = normalized
     _routes_mtime = mtime
     log(f"🔁 routes reloaded: {len(_routes)} rule(s)")
@@ -98,30 +121,54 @@ def get_routes():
 # ====== הכנת הלקוח ======
 os.makedirs(DATA_DIR, exist_ok=True)
 
-if SESSION_STRING:
-    session = StringSession(SESSION_STRING)
-else:
-    # Telethon יוצר/טוען קובץ בשם <SESSION_NAME>.session בתוך /app/data
-    session = os.path.join(DATA_DIR, SESSION_NAME)
+# נוצר ב-main() - ה-handlers נרשמים עם events.register ומחוברים אליו שם
+client = None
+
+def build_client():
+    if SESSION_STRING:
+        session = StringSession(SESSION_STRING)
+    else:
+        # Telethon יוצר/טוען קובץ בשם <SESSION_NAME>.session בתוך /app/data
+        session = os.path.join(DATA_DIR, SESSION_NAME)
+    return TelegramClient(session, API_ID, API_HASH)
 
-client = TelegramClient(session, API_ID, API_HASH)
+# מיפוי הודעת מקור → העתקים ביעדים (לעדכון עריכות ומחיקות)
+msg_index = MessageIndex(INDEX_FILE)
+
+# הקלטת תעבורה לבדיקות עומס (TRACE_FILE)
+recorder = open_recorder()
+
+# באפרים של חוקים במצב DIGEST
+async def send_digest(_, dest, text):
+    try:
+        await client.send_message(dest, text, link_preview=False)
+        return True
+    except Exception as e:
+        log(f"❌ FAILED to send digest to {dest}: {e}")
+        return False
+
+digests = DigestManager(send_digest, DIGEST_FILE)
 
 # ====== עזר לזיהוי מדיה ======
 def is_media(msg):
     return bool(msg.media)
 
 # ====== שליחה/העברה ======
-async def deliver(msg, dest, mode, prefix):
-    if mode == "FORWARD":
-        await client.forward_messages(dest, msg)
-        return
-
+def render_text(msg, mode, prefix):
     text = msg.message or ""
     if mode == "PREFIX" and text:
         text = f"{prefix} {text}" if prefix else text
+    return text
+
+async def deliver(msg, dest, mode, prefix):
+    if mode == "FORWARD":
+        return await client.forward_messages(dest, msg)
+
+    with profiler.span("render"):
+        text = render_text(msg, mode, prefix)
 
     if is_media(msg):
-        await client.send_file(
+        return await client.send_file(
             dest,
             file=msg.media,
             caption=text if text else None,
@@ -129,14 +176,18 @@ async def deliver(msg, dest, mode, prefix):
             supports_streaming=True,
         )
     else:
-        await client.send_message(dest, text or " ", parse_mode="html")
+        return await client.send_message(dest, text or " ", parse_mode="html")
 
 # ====== מאזין להודעות ======
 _last_reload_check = 0.0
+_routes_loading = None  # טעינת ה-routes הראשונה (רצה ב-thread בזמן ההתחברות)
 
-@client.on(events.NewMessage())
+@events.register(events.NewMessage())
 async def on_new_message(event):
     global _last_reload_check
+    timeline.mark("first_update")
+    if _routes_loading is not None and not _routes_loading.done():
+        await _routes_loading
 
     # בדיקת עדכון קובץ החוקים כל RELOAD_EVERY שניות
     now = time.time()
@@ -147,10 +198,14 @@ async def on_new_message(event):
     src = event.chat_id
     msg = event.message
 
+    if recorder:
+        recorder.record(msg)
+
     log(f"📥 message in {src} | text={bool(msg.message)} media={bool(msg.media)}")
 
     routes = get_routes()
-    matching = [r for r in routes if src in r["sources"]]
+    with profiler.span("match"):
+        matching = [r for r in routes if src in r["sources"]]
     if not matching:
         log(f"↪️ no matching routes for {src}")
         return
@@ -161,12 +216,13 @@ async def on_new_message(event):
             f"text_only={rule['text_only']} media_only={rule['media_only']}"
         )
 
-        if rule["text_only"] and not (msg.message and msg.message.strip()):
-            log("   ⏭ skipped: text_only and message has no text")
-            continue
-        if rule["media_only"] and not is_media(msg):
-            log("   ⏭ skipped: media_only and no media")
-            continue
+        with profiler.span("filter"):
+            if rule["text_only"] and not (msg.message and msg.message.strip()):
+                log("   ⏭ skipped: text_only and message has no text")
+                continue
+            if rule["media_only"] and not is_media(msg):
+                log("   ⏭ skipped: media_only and no media")
+                continue
 
         sent_to = set()
         for dest in rule["dests"]:
@@ -176,22 +232,91 @@ async def on_new_message(event):
             if dest in sent_to:
                 log(f"   ⏭ skipped: duplicate dest ({dest})")
                 continue
+            if rule["mode"] == "DIGEST":
+                sent_to.add(dest)
+                if digests.add("", dest, rule["digest"], msg):
+                    await digests.flush("", dest, complete_only=True)
+                log(f"📰 buffered for digest {dest}")
+                continue
             try:
-                await deliver(msg, dest, rule["mode"], rule["prefix"])
+                with profiler.span("send"):
+                    sent = await deliver(msg, dest, rule["mode"], rule["prefix"])
                 sent_to.add(dest)
+                dest_msg = message_id_of(sent)
+                # יעד שלא נפתר למספר (@username) לא נכנס לאינדקס - lookup לפי מזהה מספרי
+                if dest_msg is not None and isinstance(dest, int):
+                    msg_index.add("", src, msg.id, dest, dest_msg)
                 log(f"✅ sent to {dest}")
+                if timeline.mark("first_delivery"):
+                    log(f"⏱ cold start: {timeline.format()}")
             except Exception as e:
                 log(f"❌ FAILED to send to {dest}: {e}")
         log(f"➡️ {src} → {list(sent_to)} [{rule['mode']}]")
 
+# ====== עריכות ומחיקות במקור ======
+@events.register(events.MessageEdited())
+async def on_message_edited(event):
+    src = event.chat_id
+    msg = event.message
+
+    copies = msg_index.lookup("", src, msg.id)
+    if not copies:
+        return
+
+    # mode/prefix לכל יעד לפי החוקים הנוכחיים
+    dest_rules = {}
+    for rule in get_routes():
+        if src in rule["sources"]:
+            for dest in rule["dests"]:
+                dest_rules.setdefault(dest, rule)
+
+    for dest, dest_msg, _ in copies:
+        rule = dest_rules.get(dest)
+        if not rule or rule["mode"] in ("FORWARD", "DIGEST"):
+            continue  # הודעה מועברת / סיכום לא נערכים
+        try:
+            text = render_text(msg, rule["mode"], rule["prefix"])
+            if not text and not is_media(msg):
+                continue  # הודעת טקסט לא יכולה להיות ריקה
+            # כיתוב שנמחק נשלח כ-"" ומוחק גם את הכיתוב בהעתק
+            await client.edit_message(dest, dest_msg, text, parse_mode="html")
+            log(f"✏️ edited copy {dest}/{dest_msg} (source {src}/{msg.id})")
+        except Exception as e:
+            log(f"❌ FAILED to edit {dest}/{dest_msg}: {e}")
+
+@events.register(events.MessageDeleted())
+async def on_message_deleted(event):
+    # טלגרם מדווחת chat_id רק למחיקות בערוצים/סופרגרופים
+    src = event.chat_id
+    if src is None:
+        return
+
+    deleted = list(event.deleted_ids)
+    copies = msg_index.lookup_many("", src, deleted)
+    if not copies:
+        return
+
+    by_dest = {}
+    for _, dest, dest_msg, _ in copies:
+        by_dest.setdefault(dest, []).append(dest_msg)
+
+    for dest, dest_msgs in by_dest.items():
+        try:
+            await client.delete_messages(dest, dest_msgs)
+            log(f"🗑 deleted {len(dest_msgs)} copies in {dest} (source {src})")
+        except Exception as e:
+            log(f"❌ FAILED to delete copies in {dest}: {e}")
+
+    msg_index.remove("", src, deleted)
+
 # ====== פקודות ניהול: /id ו-/reload ======
-@client.on(events.NewMessage(pattern=r'^/id$'))
+@events.register(events.NewMessage(pattern=r'^/id$'))
 async def cmd_id(event):
     chat_id = event.chat_id
     await event.reply(f"🆔 chat_id: `{chat_id}`", parse_mode="md")
     log(f"ℹ️ /id in {chat_id}")
 
-@client.on(events.NewMessage(pattern=r'^/reload$'))
+@events.register(events.NewMessage(pattern=r'^/reload$'))
 async def cmd_reload(event):
     user_id = (await event.get_sender()).id
     if OWNER_ID and user_id != OWNER_ID:
@@ -202,27 +327,73 @@ async def cmd_reload(event):
     await event.reply("🔁 routes reloaded" if changed else "✅ routes unchanged")
     log(f"🔁 /reload by {user_id} → {'changed' if changed else 'unchanged'}")
 
+@events.register(events.NewMessage(pattern=r'^/profile(?:\s+(on|off|sample|mem|dump|reset))?$'))
+async def cmd_profile(event):
+    user_id = (await event.get_sender()).id
+    if not OWNER_ID or user_id != OWNER_ID:
+        await event.reply("⛔ only OWNER can /profile")
+        log(f"⛔ /profile denied for user {user_id}")
+        return
+
+    action = event.pattern_match.group(1) or "dump"
+    if action == "on":
+        profiler.start()
+    elif action == "sample":
+        profiler.start(sampling=True, tracemalloc_on=profiler.tracing_memory)
+    elif action == "mem":
+        profiler.start(sampling=profiler.sampling, tracemalloc_on=True)
+    elif action == "off":
+        profiler.stop()
+    elif action == "reset":
+        profiler.reset()
+
+    profiler.dump(os.path.join(DATA_DIR, "profile"))
+    await event.reply(f"⏱ /profile {action}\n{profiler.format_summary()}")
+    log(f"⏱ /profile {action} by {user_id}")
+
 # ====== main ======
+HANDLERS = (on_new_message, on_message_edited, on_message_deleted, cmd_id, cmd_reload, cmd_profile)
+
 async def main():
+    global client, _routes_loading
+    timeline.path = STARTUP_FILE
+    if not (BOT_TOKEN or SESSION_STRING or PHONE):
+        log("❌ ERROR: Must provide BOT_TOKEN, SESSION_STRING, or PHONE in environment")
+        return
+
+    client = build_client()
+    for handler in HANDLERS:
+        client.add_event_handler(handler)
+
+    # routes.yaml נקרא ומנורמל ב-thread בזמן שה-client מתחבר
+    _routes_loading = asyncio.ensure_future(asyncio.to_thread(load_routes, True))
+    await client.connect()
+    timeline.mark("connect")
+
     if BOT_TOKEN:
         await client.start(bot_token=BOT_TOKEN)
         log("🤖 TeleFeed started as BOT account")
     elif SESSION_STRING:
-        await client.connect()
         if not await client.is_user_authorized():
             log("❌ SESSION_STRING is invalid or expired")
             return
         log("👤 TeleFeed started as USER account (via SESSION_STRING)")
-    elif PHONE:
+    else:
         await client.start(phone=PHONE)
         log(f"👤 TeleFeed started as USER account ({PHONE})")
-    else:
-        log("❌ ERROR: Must provide BOT_TOKEN, SESSION_STRING, or PHONE in environment")
-        return
+    timeline.mark("authorize")
 
-    load_routes(force=True)
+    await _routes_loading
     log("📡 TeleFeed running with multiple routes…")
-    await client.run_until_disconnected()
+    digest_task = asyncio.create_task(digests.run())
+    try:
+        await client.run_until_disconnected()
+    finally:
+        digest_task.cancel()
+        digests.save(force=True)
+        timeline.save()
+        if recorder:
+            recorder.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -2,111 +2,489 @@
 Telefeed Multi-Account - מערכת routing לריבוי חשבונות טלגרם
 """
 import os
+import time
+import signal
 import asyncio
+import functools
+from typing import List, Optional, Tuple
 import yaml
-from accounts_manager import AccountManager
-from telethon import events
+from startup import timeline, STARTUP_FILE
+from accounts_manager import AccountManager, ACCOUNTS_DIR
+from message_index import MessageIndex, message_id_of
+from traffic_trace import open_recorder, TRACE_FILE
+from profiling import profiler
+from ingest import IngestElector
+from send_pool import SendPool
+from supervisor import ConnectionSupervisor
+from status import write_status, TrafficCounters
+from routing import Route, RouteTable, compile_route, compile_routes, split_routes, EMPTY_TABLE
+from route_store import journal_position, read_journal
+from peer_resolver import PeerResolver, PEER_CACHE_FILE
+from digest import DigestManager, DIGEST_FILE
+from scheduler import PriorityScheduler
+from route_stats import RouteStats, route_key, dest_key, STATS_FILE, STATS_SAVE_EVERY
+from telethon import events, errors
+
+timeline.mark("import")
 
 # ====== נתיבים וקבצים ======
 RELOAD_EVERY = int(os.getenv("ROUTES_RELOAD_EVERY", "5"))
+INDEX_FILE = os.path.join(ACCOUNTS_DIR, "message_index.sqlite3")
+PROFILE_DUMP_EVERY = int(os.getenv("PROFILE_DUMP_EVERY", "10"))  # שניות בין שמירות profile
+STATUS_EVERY = float(os.getenv("STATUS_EVERY", "1"))             # שניות בין עדכוני status ל-Web UI
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))          # שניות לסיום שליחות בכיבוי
+SEND_RETRY_FOR = float(os.getenv("SEND_RETRY_FOR", "60"))        # שניות לנסות שוב כשאף חשבון לא זמין
+FLOOD_SLEEP_THRESHOLD = int(os.getenv("FLOOD_SLEEP_THRESHOLD", "0"))  # FloodWait עד כמה שניות Telethon ממתין בעצמו (0 = הכל למאגר השולחים)
+TRANSIENT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError)
+# שגיאות הרשאת כתיבה - תמיד בצד היעד
+DEST_ERRORS = (errors.ChatWriteForbiddenError, errors.ChatAdminRequiredError,
+               errors.UserBannedInChannelError)
+USE_UVLOOP = os.getenv("USE_UVLOOP", "false").lower() == "true"
+PEER_CHECK_EVERY = 60                                            # שניות בין בדיקות רענון של usernames
+RECONCILE_EVERY = float(os.getenv("RECONCILE_EVERY", "5"))       # שניות בין השוואות accounts.json לחשבונות שרצים
+RECONCILE_RETRY = float(os.getenv("RECONCILE_RETRY", "300"))     # שניות עד ניסיון חוזר לחשבון שלא עלה (אם לא השתנה)
+
+class PendingSend:
+    """שליחה אחת ליעד בתור - המצב נשמר בין ניסיונות (מעבר ל-route גיבוי, המתנה לחשבון פנוי)"""
+    __slots__ = ("owner", "receiver", "route", "dest", "message", "fallbacks", "retry_until", "attempt")
+
+    def __init__(self, owner: str, receiver: str, route: Route, dest, message, fallbacks: list = None):
+        self.owner = owner
+        self.receiver = receiver
+        self.route = route
+        self.dest = dest
+        self.message = message
+        self.fallbacks = fallbacks
+        self.retry_until: Optional[float] = None   # monotonic; נקבע בפעם הראשונה שאין חשבון זמין
+        self.attempt = 0
+
+def account_fingerprint(account: dict) -> tuple:
+    """פרטי ההתחברות של חשבון - שינוי בהם (למשל התחברות מחדש ב-Web UI) מחייב חיבור מחדש"""
+    return (account.get('api_id'), account.get('api_hash'),
+            account.get('bot_token'), account.get('session_string'))
 
 class MultiAccountTelefeed:
     """מערכת telefeed לריבוי חשבונות"""
     
-    def __init__(self):
-        self.manager = AccountManager()
-        self.routes_cache = {}  # cache של routes לכל חשבון
+    def __init__(self, manager: AccountManager = None, index: MessageIndex = None,
+                 digest_file: str = DIGEST_FILE, peer_cache_file: str = PEER_CACHE_FILE,
+                 stats_file: str = STATS_FILE, trace_file: str = TRACE_FILE):
+        self.manager = manager or AccountManager()
+        self.routes_cache = {}  # RouteTable מקומפל לכל חשבון
         self.last_reload = {}   # זמן טעינה אחרון לכל חשבון
+        self.journal_pos = {}   # מיקום ביומן השינויים של ה-routes לכל חשבון
+        self.index = index or MessageIndex(INDEX_FILE)  # מקור → העתקים, לעדכון עריכות ומחיקות
+        self.recorder = open_recorder(trace_file)  # הקלטת תעבורה (TRACE_FILE; None = בלי)
+        self._last_profile_dump = 0.0
+        self.elector = IngestElector(self.is_account_alive)  # קולט יחיד לכל מקור משותף
+        self.send_pool = SendPool(self.is_account_alive)     # חשבונות שולחים לכל יעד
+        self.supervisor = ConnectionSupervisor(self.manager)  # ניטור חיבורים
+        self.counters = TrafficCounters()                     # קצב הודעות ושליחות
+        self.digests = DigestManager(self.send_digest, digest_file)  # באפרים של routes במצב DIGEST
+        self.scheduler = PriorityScheduler()                  # תור שליחה לפי priority של route
+        self.resolver = PeerResolver(peer_cache_file)         # @username / קישור → מזהה מספרי
+        self.stats = RouteStats(stats_file)                   # היסטוריית תעבורה לכל route ויעד
+        self._last_stats_save = time.monotonic()
+        self.accepting = True                                 # False בזמן כיבוי - לא מקבלים הודעות חדשות
+        self.started = {}       # חשבון → {fingerprint, routes_file, failed_at} מההפעלה האחרונה
+        self.transitions = {}   # חשבון → task של הפעלה/עצירה שעדיין רץ
+        self.draining = {}      # חשבון (None = כולם) → זמן (monotonic) שעד אליו ניסיונות חוזרים מותרים
+        
+    @staticmethod
+    def read_routes_file(routes_file: str) -> Tuple[Optional[list], List[str], Tuple[int, int], float]:
+        """קריאה ואימות של קובץ routes: (routes תקינים או None, שגיאות, מיקום ביומן, mtime)
         
-    async def load_routes_for_account(self, account_name: str):
-        """טוען routes עבור חשבון מסוים"""
+        בלי רשת ובלי מצב משותף - בהפעלה רץ ב-thread במקביל לחיבור החשבון
+        """
+        # מיקום היומן לפני הקריאה - שינוי שייכתב בינתיים יוחל שוב (idempotent)
+        position = journal_position(routes_file)
+        mtime = os.path.getmtime(routes_file)
+        with open(routes_file, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f) or {}
+        return (*split_routes(data), position, mtime)
+    
+    async def load_routes_for_account(self, account_name: str, preloaded: tuple = None):
+        """טוען routes עבור חשבון מסוים (preloaded - תוצאה של read_routes_file)"""
         account = self.manager.get_account(account_name)
         if not account:
             return
         
         routes_file = account.get('routes_file')
         if not routes_file or not os.path.exists(routes_file):
-            self.routes_cache[account_name] = []
+            self.set_routes(account_name, EMPTY_TABLE)
             return
         
         try:
-            with open(routes_file, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
-                self.routes_cache[account_name] = data.get('routes', [])
-                self.last_reload[account_name] = os.path.getmtime(routes_file)
-                print(f"[{account_name}] ✓ Loaded {len(self.routes_cache[account_name])} routes")
+            routes, errors, position, mtime = preloaded or self.read_routes_file(routes_file)
+            self.last_reload[account_name] = mtime
+            if routes is None:
+                # קובץ שגוי לא מוחק את ה-routes שכבר רצים
+                print(f"[{account_name}] ✗ Invalid routes file, keeping previous routes: {errors[0]}")
+                self.routes_cache.setdefault(account_name, EMPTY_TABLE)
+                return
+            # route שגוי מדולג - שאר ה-routes של החשבון ממשיכים לרוץ
+            for error in errors:
+                print(f"[{account_name}] ✗ Skipped invalid {error}")
+            raw_routes = self.resolver.resolve_routes(account_name, routes)
+            self.set_routes(account_name, compile_routes(raw_routes))
+            self.journal_pos[account_name] = position
+            print(f"[{account_name}] ✓ Loaded {len(self.routes_cache[account_name])} routes")
+            self.report_unresolved(account_name)
         except Exception as e:
             print(f"[{account_name}] ✗ Error loading routes: {e}")
-            self.routes_cache[account_name] = []
+            self.routes_cache.setdefault(account_name, EMPTY_TABLE)
     
-    def should_forward_message(self, route: dict, message) -> bool:
-        """בודק אם הודעה עומדת בתנאי route"""
-        filters = route.get('filters', {})
-        
-        # בדיקת מילות מפתח
-        keywords = filters.get('keywords')
-        if keywords:
-            text = message.text or ""
-            if not any(kw in text for kw in keywords):
-                return False
-        
-        # בדיקת אורך מינימלי
-        min_length = filters.get('min_length')
-        if min_length and len(message.text or "") < min_length:
+    def report_unresolved(self, account_name: str):
+        """מדפיס usernames/קישורים שלא נפתרו (routes שלהם לא יתאימו / ייפתרו בכל שליחה)"""
+        for key, info in self.resolver.unresolved(account_name).items():
+            print(f"[{account_name}] ⚠ Unresolved peer {key}: {info['error']}")
+    
+    async def apply_route_journal(self, account_name: str, routes_file: str, mtime: float) -> bool:
+        """מחיל שינויים מהיומן (API) על הטבלה המקומפלת; False = צריך טעינה מלאה"""
+        position = self.journal_pos.get(account_name)
+        if position is None or account_name not in self.routes_cache:
             return False
-        
-        # בדיקת מדיה
-        only_media = filters.get('only_media')
-        if only_media and not message.media:
+        entries, position = read_journal(routes_file, position)
+        # השינוי בקובץ חייב להגיע כולו מהיומן (אחרת - עריכה ידנית)
+        if not entries or entries[-1].get('mtime') != mtime:
             return False
         
-        # בדיקת טקסט בלבד
-        only_text = filters.get('only_text')
-        if only_text and message.media:
-            return False
+        put, delete = {}, set()
+        for entry in entries:
+            route_id = entry['id']
+            if entry['op'] == 'put':
+                raw, = self.resolver.resolve_routes(account_name, [entry['route']], full=False)
+                put[route_id] = compile_route(raw)
+                delete.discard(route_id)
+            else:
+                delete.add(route_id)
+                put.pop(route_id, None)
         
+        self.set_routes(account_name, self.routes_cache[account_name].with_changes(put, delete))
+        self.journal_pos[account_name] = position
+        self.last_reload[account_name] = mtime
+        print(f"[{account_name}] ✓ Applied {len(entries)} route changes "
+              f"({len(self.routes_cache[account_name])} routes)")
+        self.report_unresolved(account_name)
         return True
     
+    def set_routes(self, account_name: str, table: RouteTable):
+        """מעדכן את ה-routes של חשבון ואת מפת המקורות והיעדים המשותפים"""
+        self.routes_cache[account_name] = table
+        self.elector.set_subscriptions(account_name, table.sources())
+        self.send_pool.set_destinations(account_name, table.dests())
+    
+    def is_account_alive(self, account_name: str) -> bool:
+        """האם לחשבון יש client מחובר ופעיל"""
+        account = self.manager.get_account(account_name)
+        client = self.manager.get_client(account_name)
+        return bool(account and account.get('enabled') and client and client.is_connected()
+                    and self.supervisor.is_healthy(account_name))
+    
+    def should_forward_message(self, route: Route, message) -> bool:
+        """בודק אם הודעה עומדת בתנאי route"""
+        return route.filter.matches(message)
+    
+    @staticmethod
+    def render_text(route: Route, message) -> str:
+        """בונה את הטקסט לשליחה לפי mode של ה-route"""
+        text = message.message or ""
+        if route.mode == 'PREFIX' and text and route.prefix:
+            text = f"{route.prefix} {text}"
+        return text
+    
+    async def deliver(self, client, route: Route, dest, message, foreign: bool = False):
+        """שולח הודעה ליעד לפי mode: FORWARD | COPY | PREFIX
+        
+        foreign=True - ההודעה התקבלה בחשבון אחר (ingestor), ולכן ה-client
+        שולח לפי מזהים ולא לפי אובייקט ההודעה של החשבון האחר
+        """
+        if route.mode == 'FORWARD':
+            if foreign:
+                return await client.forward_messages(dest, message.id, from_peer=message.chat_id)
+            return await client.forward_messages(dest, message)
+        
+        with profiler.span("render"):
+            text = self.render_text(route, message)
+        if message.media and foreign:
+            # מזהי מדיה שייכים לחשבון שקיבל - טוענים את ההודעה דרך החשבון השולח
+            own = await client.get_messages(message.chat_id, ids=message.id)
+            if own is not None:
+                message = own
+        if message.media:
+            return await client.send_file(
+                dest,
+                file=message.media,
+                caption=text if text else None,
+                supports_streaming=True,
+            )
+        return await client.send_message(dest, text or " ")
+    
     async def handle_new_message(self, account_name: str, event):
         """מטפל בהודעה חדשה מחשבון מסוים"""
+        if not self.accepting:
+            return
+        timeline.mark("first_update", account_name)
         message = event.message
+        self.supervisor.touch(account_name)
+        self.elector.touch(account_name)
+        self.counters.received(account_name)
+        
+        if self.recorder:
+            self.recorder.record(message)
         
         # טוען routes אם צריך
         if account_name not in self.routes_cache:
+            if account_name not in self.manager.clients:
+                return  # החשבון נעצר - עדכון שנשאר בדרך
             await self.load_routes_for_account(account_name)
         
-        routes = self.routes_cache.get(account_name, [])
+        owners = self.elector.owners(message.chat_id)
+        if len(owners) <= 1:
+            # גם routes זהים (יעד, mode, prefix) של אותו חשבון שולחים פעם אחת
+            await self.process_routes(account_name, account_name, message, sent_to={})
+            return
+        
+        # מקור משותף לכמה חשבונות - רק ה-ingestor מעבד, עבור כל בעלי ה-routes
+        if self.elector.should_ingest(account_name, message.chat_id, message.id):
+            sent_to = {}  # (יעד, mode, prefix) → routes חופפים של חשבונות אחרים (גיבוי אם השליחה נכשלה)
+            for owner in owners:
+                await self.process_routes(owner, account_name, message, catch_all=False,
+                                          sent_to=sent_to)
+        # routes ללא source של החשבון עצמו
+        await self.process_routes(account_name, account_name, message, sourced=False)
+    
+    async def process_routes(self, owner: str, receiver: str, message,
+                             sourced: bool = True, catch_all: bool = True,
+                             sent_to: dict = None):
+        """מריץ את ה-routes של owner על הודעה שהתקבלה ב-receiver
+        
+        sourced/catch_all - האם להריץ routes עם source / בלי source
+        sent_to - (יעד, mode, prefix) → (owner, route) חופפים: היעד מקבל את ההודעה פעם אחת לכל
+        צורה (FORWARD ו-PREFIX לאותו יעד שולחים שניהם), והם משמשים לניסיון חוזר אם השליחה נכשלה
+        """
+        # בדיקת source - חיפוש באינדקס לפי צ'אט
+        with profiler.span("match"):
+            table = self.routes_cache.get(owner, EMPTY_TABLE)
+            routes = table.for_chat(message.chat_id, sourced, catch_all)
         
         for route in routes:
-            # בדיקת source
-            source = route.get('source')
-            if source:
-                # תמיכה בשניהם - מספר וסטרינג
-                if isinstance(source, str):
-                    source = int(source) if source.lstrip('-').isdigit() else source
-                
-                msg_chat_id = message.chat_id
-                
-                # השוואה
-                if source != msg_chat_id:
-                    continue
-            
             # בדיקת filters
-            if not self.should_forward_message(route, message):
-                continue
+            with profiler.span("filter"):
+                if not self.should_forward_message(route, message):
+                    continue
             
             # העברת הודעה
-            dest = route.get('dest')
-            if dest:
-                try:
-                    client = self.manager.get_client(account_name)
-                    if client:
-                        await client.forward_messages(dest, message)
-                        print(f"[{account_name}] ✓ Forwarded: {source} → {dest}")
-                except Exception as e:
-                    print(f"[{account_name}] ✗ Error forwarding: {e}")
-    
-    async def setup_account_handlers(self, account_name: str):
+            dest = route.dest
+            if not dest:
+                continue
+            fallbacks = None
+            if sent_to is not None:
+                same = (dest, route.mode, route.prefix)
+                if same in sent_to:
+                    if sent_to[same] is not None:
+                        sent_to[same].append((owner, route))
+                    print(f"[{owner}] ⏭ Skipped duplicate route to {dest} ({route.mode})")
+                    continue
+                # DIGEST לא משתמש בגיבוי - נכנס לבאפר ולא נכשל כאן
+                fallbacks = sent_to[same] = [] if route.mode != 'DIGEST' else None
+            if route.mode == 'DIGEST':
+                # נאסף לבאפר של היעד ונשלח כפוסט מסכם
+                self.stats.record(route_key(owner, route), len((message.message or "").encode()))
+                if self.digests.add(owner, dest, route.digest, message):
+                    # באפר מלא - השליחה בתור כמו שאר ה-modes, כך שהקליטה לא ממתינה לה
+                    await self.scheduler.submit(route.priority, functools.partial(
+                        self.digests.flush, owner, dest, complete_only=True), key=(owner, dest))
+                continue
+            # FIFO לכל זרם (חשבון, יעד, צ'אט מקור) - הסדר (כולל אלבומים, שמגיעים מאותו צ'אט) נשמר
+            # בתוך זרם; מקורות שונים לאותו יעד נשלחים במקביל דרך חשבונות שונים במאגר
+            await self.scheduler.submit(route.priority, functools.partial(
+                self.send_via_pool, PendingSend(owner, receiver, route, dest, message, fallbacks)),
+                key=(owner, dest, message.chat_id))
+    
+    def _readers(self, send: PendingSend) -> tuple:
+        """רק חשבונות שרואים את המקור יכולים להעביר ממנו"""
+        return self.elector.owners(send.message.chat_id) + (send.receiver,)
+    
+    def _retry_deadline(self, send: PendingSend, now: float) -> float:
+        """עד מתי לנסות שוב: SEND_RETRY_FOR, ובזמן עצירה - לפני שה-drain מוותר (כך הכישלון נרשם)"""
+        send.retry_until = send.retry_until or now + SEND_RETRY_FOR
+        deadline = send.retry_until
+        for name in (None, send.owner):
+            if name in self.draining:
+                deadline = min(deadline, self.draining[name] - 1.0)
+        return deadline
+    
+    async def send_via_pool(self, send: PendingSend) -> Optional[float]:
+        """שולח ליעד; אם השליחה נכשלה סופית - דרך route חופף של חשבון אחר (fallbacks)
+        
+        כשאף חשבון לא זמין מחזיר שניות להמתנה - ה-scheduler מחזיר את השליחה לתור בלי להחזיק worker
+        """
+        while True:
+            sent = await self.send_route(send.owner, send.receiver, send.route, send.dest, send.message)
+            if sent is None:
+                # כל החשבונות ב-FloodWait / מנותקים - ניסיון חוזר עם backoff עד SEND_RETRY_FOR
+                now = time.monotonic()
+                deadline = self._retry_deadline(send, now)
+                readers = self._readers(send)
+                if now < deadline and self.send_pool.reachable(send.dest, send.owner, readers):
+                    send.attempt += 1
+                    # עד שה-FloodWait הקרוב נגמר; בלי FloodWait (ניתוק) - backoff
+                    wait = self.send_pool.retry_after(send.dest, send.owner, readers)
+                    if wait is None:
+                        wait = min(2 ** (send.attempt - 1), 10)
+                    return max(0.05, min(wait, deadline - now))
+                print(f"[{send.owner}] ✗ No account available to send to {send.dest}")
+                self.record_failure(send.owner, send.route, send.dest)
+            elif sent:
+                return None
+            if not send.fallbacks:
+                return None
+            send.owner, send.route = send.fallbacks.pop(0)
+            send.retry_until, send.attempt = None, 0
+            print(f"[{send.owner}] ↪ Retrying {send.dest} through this account's route")
+    
+    async def send_route(self, owner: str, receiver: str, route: Route, dest, message) -> Optional[bool]:
+        """שולח דרך החשבון עם הכי הרבה headroom ליעד, עם מעבר לחשבון אחר ב-FloodWait
+        
+        False אם השליחה נכשלה סופית; None אם אין כרגע חשבון זמין
+        """
+        source = route.source
+        tried = set()
+        readers = self.elector.owners(message.chat_id) + (receiver,)
+        while True:
+            sender = self.send_pool.choose(dest, fallback=owner, exclude=tried, readers=readers)
+            client = self.manager.get_client(sender) if sender else None
+            if not client:
+                return None
+            tried.add(sender)
+            try:
+                with profiler.span("send"):
+                    sent = await self.deliver(client, route, dest, message,
+                                              foreign=sender != receiver)
+                dest_msg = message_id_of(sent)
+                if dest_msg is not None and isinstance(dest, int):
+                    self.index.add(owner, message.chat_id, message.id, dest, dest_msg,
+                                   sender=sender)
+                via = f" (via {sender})" if sender != owner else ""
+                print(f"[{owner}] ✓ Forwarded: {source} → {dest}{via}")
+                if timeline.mark("first_delivery", owner):
+                    print(f"⏱ Cold start: {timeline.format()}")
+                self.counters.delivered(owner)
+                nbytes = len((message.message or "").encode())
+                self.stats.record(route_key(owner, route), nbytes)
+                self.stats.record(dest_key(dest), nbytes)
+                return True
+            except errors.FloodWaitError as e:
+                self.send_pool.on_flood(sender, e.seconds)
+                print(f"[{sender}] ⏳ FloodWait {e.seconds}s sending to {dest}, trying another account")
+            except DEST_ERRORS as e:
+                if sender == owner:
+                    print(f"[{owner}] ✗ Error forwarding: {e}")
+                    self.record_failure(owner, route, dest)
+                    return False
+                self.send_pool.on_forbidden(dest, sender)
+                print(f"[{sender}] ✗ Cannot send to {dest} ({e}), removed from pool")
+            except errors.ChannelPrivateError as e:
+                # יכול להיות המקור או היעד - לא חוסמים את החשבון ליעד, רק לא מנסים אותו שוב להודעה הזו
+                if sender == owner:
+                    print(f"[{owner}] ✗ Error forwarding: {e}")
+                    self.record_failure(owner, route, dest)
+                    return False
+                print(f"[{sender}] ✗ Cannot access {message.chat_id} or {dest} ({e}), trying another account")
+            except Exception as e:
+                if sender == owner and not isinstance(e, TRANSIENT_ERRORS):
+                    print(f"[{owner}] ✗ Error forwarding: {e}")
+                    self.record_failure(owner, route, dest)
+                    return False
+                print(f"[{sender}] ✗ Error forwarding to {dest}: {e}, falling back")
+    
+    def record_failure(self, owner: str, route: Route, dest):
+        """שליחה שנכשלה סופית - מונים ו-route stats"""
+        self.counters.failed(owner)
+        self.stats.record(route_key(owner, route), failed=True)
+        self.stats.record(dest_key(dest), failed=True)
+    
+    async def send_digest(self, owner: str, dest, text: str) -> bool:
+        """שולח פוסט digest דרך מאגר השולחים; False = להשאיר בבאפר לניסיון הבא"""
+        tried = set()
+        while True:
+            sender = self.send_pool.choose(dest, fallback=owner, exclude=tried)
+            client = self.manager.get_client(sender) if sender else None
+            if not client:
+                return False
+            tried.add(sender)
+            try:
+                with profiler.span("send"):
+                    await client.send_message(dest, text, link_preview=False)
+                self.counters.delivered(owner)
+                return True
+            except errors.FloodWaitError as e:
+                self.send_pool.on_flood(sender, e.seconds)
+                print(f"[{sender}] ⏳ FloodWait {e.seconds}s sending digest to {dest}")
+            except Exception as e:
+                print(f"[{sender}] ✗ Error sending digest to {dest}: {e}")
+                if sender == owner:
+                    self.counters.failed(owner)
+                    return False
+    
+    async def handle_message_edited(self, account_name: str, event):
+        """מעדכן העתקים ביעדים כשהודעת מקור נערכה (COPY/PREFIX בלבד)"""
+        message = event.message
+        copies = self.index.lookup(account_name, message.chat_id, message.id)
+        if not copies:
+            return
+        
+        # mode/prefix לכל יעד לפי ה-routes הנוכחיים
+        dest_routes = {}
+        for route in self.routes_cache.get(account_name, EMPTY_TABLE).for_chat(message.chat_id):
+            dest_routes.setdefault(route.dest, route)
+        
+        for dest, dest_msg, sender in copies:
+            route = dest_routes.get(dest)
+            if not route or route.mode in ('FORWARD', 'DIGEST'):
+                continue  # הודעה מועברת / סיכום לא נערכים
+            # רק החשבון ששלח את ההעתק יכול לערוך אותו
+            client = self.manager.get_client(sender)
+            if not client:
+                continue
+            text = self.render_text(route, message)
+            if not text and not message.media:
+                continue  # הודעת טקסט לא יכולה להיות ריקה
+            try:
+                # כיתוב שנמחק נשלח כ-"" ומוחק גם את הכיתוב בהעתק
+                await client.edit_message(dest, dest_msg, text)
+                print(f"[{account_name}] ✎ Edited: {message.chat_id}/{message.id} → {dest}/{dest_msg}")
+            except Exception as e:
+                print(f"[{account_name}] ✗ Error editing: {e}")
+    
+    async def handle_message_deleted(self, account_name: str, event):
+        """מוחק העתקים ביעדים כשהודעת מקור נמחקה"""
+        # טלגרם מדווחת chat_id רק למחיקות בערוצים/סופרגרופים
+        if event.chat_id is None:
+            return
+        
+        copies = self.index.lookup_many(account_name, event.chat_id, list(event.deleted_ids))
+        if not copies:
+            return
+        
+        by_dest = {}
+        for _, dest, dest_msg, sender in copies:
+            by_dest.setdefault((sender, dest), []).append(dest_msg)
+        
+        for (sender, dest), dest_msgs in by_dest.items():
+            client = self.manager.get_client(sender)
+            if not client:
+                continue
+            try:
+                await client.delete_messages(dest, dest_msgs)
+                print(f"[{account_name}] 🗑 Deleted {len(dest_msgs)} copies in {dest}")
+            except Exception as e:
+                print(f"[{account_name}] ✗ Error deleting: {e}")
+        
+        self.index.remove(account_name, event.chat_id, list(event.deleted_ids))
+    
+    async def setup_account_handlers(self, account_name: str, preloaded: tuple = None):
         """מגדיר event handlers לחשבון"""
         client = self.manager.get_client(account_name)
         if not client:
@@ -114,20 +492,92 @@ class MultiAccountTelefeed:
             return
         
         # טוען routes
-        await self.load_routes_for_account(account_name)
+        await self.load_routes_for_account(account_name, preloaded)
+        timeline.mark("routes", account_name)
         
         # רישום handler
         @client.on(events.NewMessage())
         async def handler(event):
             await self.handle_new_message(account_name, event)
         
+        @client.on(events.MessageEdited())
+        async def edit_handler(event):
+            self.supervisor.touch(account_name)
+            await self.handle_message_edited(account_name, event)
+        
+        @client.on(events.MessageDeleted())
+        async def delete_handler(event):
+            self.supervisor.touch(account_name)
+            await self.handle_message_deleted(account_name, event)
+        
         print(f"[{account_name}] ✓ Handler registered")
     
+    def poll_profiler(self):
+        """מחיל בקשות פרופיילינג מה-Web UI ושומר תוצאות מעת לעת"""
+        changed = profiler.poll_control_file()
+        if changed:
+            state = "on" if profiler.enabled else "off"
+            print(f"⏱ Profiling {state} (sampling={profiler.sampling}, "
+                  f"tracemalloc={profiler.tracing_memory})")
+        
+        now = time.time()
+        if changed or (profiler.enabled and now - self._last_profile_dump >= PROFILE_DUMP_EVERY):
+            self._last_profile_dump = now
+            profiler.dump()
+    
+    def save_status(self, **extra):
+        """שומר מצב חשבונות ל-Web UI"""
+        try:
+            accounts = self.supervisor.snapshot()
+            for account_name, traffic in self.counters.snapshot().items():
+                accounts.setdefault(account_name, {}).update(traffic)
+            write_status({
+                "accounts": accounts,
+                "shared_sources": self.elector.status(),
+                "senders": self.send_pool.status(),
+                "lanes": self.scheduler.status(),
+                "unresolved_peers": self.resolver.unresolved(),
+                **extra,
+            })
+        except Exception as e:
+            print(f"Warning: Could not save status: {e}")
+    
+    async def status_loop(self):
+        """לולאה לעדכון קובץ ה-status (קצב, מצב חיבור) עבור ה-Web UI"""
+        while True:
+            await asyncio.sleep(STATUS_EVERY)
+            self.save_status()
+            if time.monotonic() - self._last_stats_save >= STATS_SAVE_EVERY:
+                self._last_stats_save = time.monotonic()
+                # הסיכום והעותק של מה שהשתנה - כאן; הכתיבה לדיסק ב-thread
+                await asyncio.to_thread(self.stats.write, self.stats.snapshot(self.routes_cache))
+    
+    async def peer_refresh_loop(self):
+        """רענון ברקע של usernames/קישורים; חשבון שמזהה שלו השתנה נטען מחדש
+
+        מתעורר מיד כשטעינת routes נתקלה במפתח שלא ב-cache
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self.resolver.wakeup.wait(), PEER_CHECK_EVERY)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                changed = await self.resolver.refresh(self.manager.get_client)
+            except Exception as e:
+                print(f"✗ Peer refresh error: {e}")
+                continue
+            for account_name in changed:
+                print(f"[{account_name}] 🔁 Resolved peers changed, reloading routes")
+                await self.load_routes_for_account(account_name)
+    
     async def reload_routes_loop(self):
         """לולאה לטעינה מחדש של routes"""
         while True:
             await asyncio.sleep(RELOAD_EVERY)
             
+            self.poll_profiler()
+            
             for account_name in self.manager.list_accounts():
                 account = self.manager.get_account(account_name)
                 if not account or not account.get('enabled'):
@@ -136,79 +586,305 @@ class MultiAccountTelefeed:
                 routes_file = account.get('routes_file')
                 if not routes_file or not os.path.exists(routes_file):
                     continue
+                if account_name not in self.routes_cache:
+                    continue  # עדיין מתחבר - start_account יטען את ה-routes
                 
                 # בדיקה אם הקובץ השתנה
                 current_mtime = os.path.getmtime(routes_file)
                 last_mtime = self.last_reload.get(account_name, 0)
                 
                 if current_mtime > last_mtime:
+                    if await self.apply_route_journal(account_name, routes_file, current_mtime):
+                        continue
                     print(f"[{account_name}] Routes file changed, reloading...")
                     await self.load_routes_for_account(account_name)
     
-    async def start_all_accounts(self):
-        """מתחיל את כל החשבונות"""
-        print("🚀 Starting Telefeed Multi-Account System")
-        print("=" * 50)
+    async def connect_account(self, account_name: str, account: dict):
+        """יוצר client, מתחבר ומוודא הרשאה; None אם החשבון צריך התחברות דרך ה-Web UI"""
+        # FloodWait צריך להגיע ל-send_route (מעבר לחשבון אחר) ולא להיבלע בהמתנה בתוך Telethon
+        client = await self.manager.create_client(account_name, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD)
+        if not client:
+            print(f"[{account_name}] ✗ Failed to create client")
+            return None
+        
+        if not account.get('bot_token') and not account.get('session_string'):
+            print(f"[{account_name}] ✗ No session_string, need login via web UI")
+            return None
+        try:
+            await client.connect()
+            timeline.mark("connect", account_name)
+            if account.get('bot_token'):
+                await client.start(bot_token=account['bot_token'])
+            elif not await client.is_user_authorized():
+                print(f"[{account_name}] ✗ Not authorized, need login via web UI")
+                await client.disconnect()  # reconcile ינסה שוב עם client חדש
+                return None
+        except BaseException:
+            await self._disconnect(account_name, client)
+            raise
+        timeline.mark("authorize", account_name)
+        return client
+    
+    async def _disconnect(self, account_name: str, client):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            print(f"[{account_name}] ✗ Error disconnecting: {e}")
+    
+    async def start_account(self, account_name: str) -> bool:
+        """מחבר חשבון ומתחיל לטפל בהודעות שלו מיד, בלי לחכות לשאר החשבונות"""
+        account = self.manager.get_account(account_name)
+        if not account or not account.get('enabled'):
+            print(f"[{account_name}] Skipped (disabled)")
+            return False
+        state = self.started[account_name] = {
+            "fingerprint": account_fingerprint(account),
+            "routes_file": account.get('routes_file'),
+            "failed_at": time.monotonic(),  # מתאפס בהצלחה
+        }
+        
+        # קובץ ה-routes נקרא ומאומת ב-thread בזמן שהחשבון מתחבר
+        reading = None
+        routes_file = account.get('routes_file')
+        if routes_file and os.path.exists(routes_file):
+            reading = asyncio.ensure_future(asyncio.to_thread(self.read_routes_file, routes_file))
+        try:
+            client = await self.connect_account(account_name, account)
+        except Exception as e:
+            print(f"[{account_name}] ✗ Error: {e}")
+            client = None
+        preloaded = None
+        if reading is not None:
+            try:
+                preloaded = await reading
+            except Exception:
+                pass  # load_routes_for_account יקרא שוב וידווח על השגיאה
+        if not client:
+            return False
+        
+        try:
+            # שמירת client
+            self.manager.clients[account_name] = client
+            
+            # הגדרת handlers
+            await self.setup_account_handlers(account_name, preloaded)
+            self.supervisor.start(account_name)
+            state["failed_at"] = None
+            
+            print(f"[{account_name}] ✓ Started successfully")
+            return True
+        except Exception as e:
+            print(f"[{account_name}] ✗ Error: {e}")
+            await self.stop_account(account_name)
+            self.started[account_name] = state  # reconcile ינסה שוב אחרי RECONCILE_RETRY
+            return False
+    
+    async def stop_account(self, account_name: str):
+        """עוצר חשבון אחד בלי לגעת בשאר - מקורות ויעדים משותפים עוברים לחשבונות האחרים
         
-        # התחברות לכל החשבונות
-        for account_name in self.manager.list_accounts():
+        לפני הניתוק נשלחים ה-digests שנאספו והשליחות שכבר בתור של החשבון (עד DRAIN_TIMEOUT)
+        """
+        self.supervisor.stop(account_name)
+        deleted = not self.manager.get_account(account_name)
+        if account_name in self.routes_cache:
+            self.set_routes(account_name, EMPTY_TABLE)  # הודעות חדשות כבר לא מנותבות לחשבון
+        if account_name in self.manager.clients:
+            owned = lambda key: isinstance(key, tuple) and key[0] == account_name
+            await self.digests.flush_owner(account_name, drop=deleted)
+            self.draining[account_name] = time.monotonic() + DRAIN_TIMEOUT
+            if not await self.scheduler.wait_for(owned, DRAIN_TIMEOUT):
+                dropped = self.scheduler.discard(owned)
+                print(f"[{account_name}] ⚠ Drain timeout: dropped {dropped} pending sends")
+            self.draining.pop(account_name, None)
+        elif deleted:
+            await self.digests.flush_owner(account_name, drop=True)
+        client = self.manager.clients.pop(account_name, None)
+        self.routes_cache.pop(account_name, None)
+        self.last_reload.pop(account_name, None)
+        self.journal_pos.pop(account_name, None)
+        self.resolver.resolve_routes(account_name, [])
+        self.started.pop(account_name, None)  # הפעלה חוזרת (enabled) תתחיל מיד
+        if deleted:
+            self.supervisor.health.pop(account_name, None)  # החשבון נמחק - לא מציגים אותו יותר
+        if client:
+            await self._disconnect(account_name, client)
+        print(f"[{account_name}] ■ Stopped")
+    
+    async def restart_account(self, account_name: str):
+        """חיבור מחדש של חשבון שפרטי ההתחברות שלו השתנו"""
+        await self.stop_account(account_name)
+        await self.start_account(account_name)
+    
+    async def reconcile(self) -> dict:
+        """משווה את accounts.json לחשבונות שרצים ומפעיל/עוצר/מחבר מחדש רק את מה שהשתנה
+        
+        כל פעולה רצה כ-task נפרד, כך שחשבון שמתחבר לאט לא מעכב את האחרים
+        """
+        self.manager.reload_accounts()
+        now = time.monotonic()
+        actions = {"start": [], "stop": [], "reauthorize": [], "routes": []}
+        names = set(self.manager.list_accounts()) | set(self.manager.clients) | set(self.started)
+        for account_name in sorted(names):
+            if account_name in self.transitions:
+                continue  # הפעלה/עצירה קודמת עדיין רצה
             account = self.manager.get_account(account_name)
-            if not account or not account.get('enabled'):
-                print(f"[{account_name}] Skipped (disabled)")
+            wanted = bool(account and account.get('enabled'))
+            running = account_name in self.manager.clients
+            state = self.started.get(account_name)
+            if not running and not wanted:
+                self.started.pop(account_name, None)  # נכשל ואז כובה - הפעלה מחדש תנסה מיד
                 continue
-            
-            try:
-                client = await self.manager.create_client(account_name)
-                if not client:
-                    print(f"[{account_name}] ✗ Failed to create client")
-                    continue
-                
-                # התחברות
-                if account.get('bot_token'):
-                    await client.start(bot_token=account['bot_token'])
-                elif account.get('session_string'):
-                    await client.connect()
-                    if not await client.is_user_authorized():
-                        print(f"[{account_name}] ✗ Not authorized, need login via web UI")
-                        continue
+            if running and not wanted:
+                action = "stop"
+            elif running and state and state["fingerprint"] != account_fingerprint(account):
+                action = "reauthorize"
+            elif running and state and state["routes_file"] != account.get('routes_file'):
+                action = "routes"
+            elif not running and wanted and (
+                    state is None or state["fingerprint"] != account_fingerprint(account)
+                    or (state["failed_at"] is not None and now - state["failed_at"] >= RECONCILE_RETRY)):
+                action = "start"
+            else:
+                continue
+            actions[action].append(account_name)
+        
+        for action, names in actions.items():
+            for account_name in names:
+                if action == "stop":
+                    coro = self.stop_account(account_name)
+                elif action == "reauthorize":
+                    coro = self.restart_account(account_name)
+                elif action == "start":
+                    coro = self.start_account(account_name)
                 else:
-                    print(f"[{account_name}] ✗ No session_string, need login via web UI")
-                    continue
-                
-                # שמירת client
-                self.manager.clients[account_name] = client
-                
-                # הגדרת handlers
-                await self.setup_account_handlers(account_name)
-                
-                print(f"[{account_name}] ✓ Started successfully")
-                
+                    self.started[account_name]["routes_file"] = self.manager.get_account(account_name)['routes_file']
+                    coro = self.load_routes_for_account(account_name)
+                print(f"[{account_name}] 🔄 Reconcile: {action}")
+                self.transition(account_name, coro)
+        return actions
+    
+    def transition(self, account_name: str, coro) -> asyncio.Task:
+        """מריץ הפעלה/עצירה של חשבון כ-task; reconcile לא נוגע בחשבון עד שהיא מסתיימת"""
+        task = asyncio.create_task(coro)
+        self.transitions[account_name] = task
+        task.add_done_callback(functools.partial(self._transition_done, account_name))
+        return task
+    
+    def _transition_done(self, account_name: str, task: asyncio.Task):
+        if self.transitions.get(account_name) is task:
+            del self.transitions[account_name]
+        if not task.cancelled() and task.exception():
+            print(f"[{account_name}] ✗ Reconcile error: {task.exception()}")
+    
+    async def reconcile_loop(self):
+        """לולאה שמחילה שינויים ב-accounts.json (הוספה, התחברות, הפעלה/כיבוי, מחיקה) בלי הפעלה מחדש"""
+        while True:
+            await asyncio.sleep(RECONCILE_EVERY)
+            try:
+                await self.reconcile()
             except Exception as e:
-                print(f"[{account_name}] ✗ Error: {e}")
-        
+                print(f"✗ Reconcile error: {e}")
+    
+    async def start_all_accounts(self):
+        """מתחיל את כל החשבונות - במקביל; כל חשבון מתחיל להעביר הודעות ברגע שהוא מוכן"""
+        print("🚀 Starting Telefeed Multi-Account System")
         print("=" * 50)
-        print(f"✓ {len(self.manager.clients)} accounts running")
-        print("📡 Listening for messages...")
+        timeline.mark("config")
         
-        # לולאת reload
-        await self.reload_routes_loop()
+        # לולאות reload, status, digest, רענון usernames ו-reconcile - לא מחכות לחיבור החשבונות
+        loops = asyncio.gather(self.reload_routes_loop(), self.status_loop(), self.digests.run(),
+                               self.peer_refresh_loop(), self.reconcile_loop())
+        try:
+            # התחברות לכל החשבונות במקביל
+            await asyncio.gather(*(self.transition(account_name, self.start_account(account_name))
+                                   for account_name in self.manager.list_accounts()))
+            timeline.mark("ready")
+            timeline.save()
+            
+            print("=" * 50)
+            print(f"✓ {len(self.manager.clients)} accounts running "
+                  f"(ready {timeline.phases['ready']:.2f}s after process start)")
+            print("📡 Listening for messages...")
+            await loops
+        finally:
+            loops.cancel()
     
-    async def stop_all_accounts(self):
-        """עוצר את כל החשבונות"""
+    async def stop_all_accounts(self, drain_timeout: float = DRAIN_TIMEOUT) -> dict:
+        """עוצר את כל החשבונות: הפסקת קליטה, סיום שליחות עד drain_timeout, שמירה וניתוק"""
         print("\n🛑 Stopping all accounts...")
+        self.accepting = False
+        self.supervisor.stop_all()
+        for task in list(self.transitions.values()):
+            task.cancel()
+        
+        # סיום שליחות שבתור / בדרך
+        start = time.monotonic()
+        self.draining[None] = start + drain_timeout
+        pending = self.scheduler.pending
+        drained = await self.scheduler.join(drain_timeout)
+        dropped = self.scheduler.pending
+        self.scheduler.stop()
+        report = {
+            "drain_s": round(time.monotonic() - start, 3),
+            "pending_at_stop": pending,
+            "dropped": dropped,
+            "digest_buffered": sum(len(b.entries) for b in self.digests.buffers.values()),
+        }
+        if drained:
+            print(f"✓ Drained {pending} pending sends in {report['drain_s']}s")
+        else:
+            print(f"⚠ Drain timeout ({drain_timeout:.0f}s): dropped {dropped} of {pending} pending sends")
+        
+        # שמירת מצב
+        self.digests.save(force=True)  # באפרים שלא נשלחו ימשיכו אחרי הפעלה מחדש
+        self.resolver.save()
+        self.stats.save(self.routes_cache)
+        if profiler.enabled:
+            profiler.dump()
+        self.save_status(shutdown=report)
+        timeline.save()
+        
         await self.manager.disconnect_all()
+        self.index.close()
+        if self.recorder:
+            self.recorder.close()
         print("✓ All accounts stopped")
+        return report
 
-async def main():
-    """נקודת כניסה ראשית"""
+async def run():
+    """מריץ את ה-router עד SIGTERM/SIGINT ואז מבצע כיבוי מסודר"""
+    timeline.path = STARTUP_FILE
     system = MultiAccountTelefeed()
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
     
+    runner = asyncio.create_task(system.start_all_accounts())
+    stopper = asyncio.create_task(stop.wait())
     try:
-        await system.start_all_accounts()
-    except KeyboardInterrupt:
-        print("\n⚠ Received stop signal")
+        await asyncio.wait({runner, stopper}, return_when=asyncio.FIRST_COMPLETED)
+        if stop.is_set():
+            print("\n⚠ Received stop signal")
+        elif runner.exception():
+            print(f"✗ Router failed: {runner.exception()}")
     finally:
+        runner.cancel()
+        stopper.cancel()
         await system.stop_all_accounts()
 
+def main():
+    """נקודת כניסה ראשית (USE_UVLOOP=true - event loop של uvloop אם מותקן)"""
+    loop_factory = None
+    if USE_UVLOOP:
+        try:
+            import uvloop
+            loop_factory = uvloop.new_event_loop
+            print("⚡ Using uvloop")
+        except ImportError:
+            print("⚠ USE_UVLOOP=true but uvloop is not installed, using asyncio")
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(run())
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,294 @@
+"""
+הקלטה והרצה חוזרת של תעבורת הודעות - לבדיקות עומס offline
+
+הקלטה: TRACE_FILE=accounts/traffic.trace python telefeed_multi.py
+הרצה:  python traffic_trace.py replay accounts/traffic.trace --routes accounts/main_routes.yaml --speed max
+"""
+import os
+import sys
+import time
+import struct
+import asyncio
+import hashlib
+import datetime
+import contextlib
+from types import SimpleNamespace
+from typing import Iterator, List, Optional
+
+TRACE_FILE = os.getenv("TRACE_FILE")                               # ריק = ללא הקלטה
+TRACE_REDACT = os.getenv("TRACE_REDACT", "true").lower() == "true"  # לא לשמור את הטקסט עצמו
+
+MAGIC = b"TFTRACE1"
+# chat_id, msg_id, msg_date, recv_ts, text_len, text_hash, media_kind, grouped_id, stored_len
+RECORD = struct.Struct("<qqddIQBqI")
+
+MEDIA_KINDS = ["none", "photo", "video", "document", "webpage", "other"]
+
+def media_kind(message) -> int:
+    """מסווג את סוג המדיה של הודעה"""
+    if not message.media:
+        return 0
+    if getattr(message, "photo", None):
+        return 1
+    if getattr(message, "video", None):
+        return 2
+    if getattr(message, "document", None):
+        return 3
+    if getattr(message, "web_preview", None):
+        return 4
+    return 5
+
+def text_hash(text: str) -> int:
+    """hash קצר (8 בתים) של טקסט ההודעה"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+class TraceRecorder:
+    """כותב trace בינארי append-only של השדות הרלוונטיים ל-routing"""
+
+    def __init__(self, path: str, redact: bool = TRACE_REDACT, flush_every: int = 100):
+        self.path = path
+        self.redact = redact
+        self.flush_every = flush_every
+        self._pending = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, "ab")
+        if is_new:
+            self.f.write(MAGIC)
+
+    def record(self, message):
+        """מוסיף הודעה ל-trace"""
+        text = message.message or ""
+        data = b"" if self.redact else text.encode("utf-8")
+        date = message.date.timestamp() if message.date else 0.0
+        self.f.write(RECORD.pack(
+            message.chat_id or 0, message.id, date, time.time(),
+            len(text), text_hash(text), media_kind(message),
+            message.grouped_id or 0, len(data)
+        ))
+        if data:
+            self.f.write(data)
+
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self._pending = 0
+            self.f.flush()
+
+    def close(self):
+        """סוגר את הקובץ"""
+        if not self.f.closed:
+            self.f.flush()
+            self.f.close()
+
+def open_recorder(path: Optional[str] = TRACE_FILE) -> Optional[TraceRecorder]:
+    """מחזיר recorder אם TRACE_FILE מוגדר"""
+    if not path:
+        return None
+    print(f"⏺ Recording traffic trace to {path} (redact={TRACE_REDACT})")
+    return TraceRecorder(path)
+
+def read_trace(path: str) -> Iterator[SimpleNamespace]:
+    """קורא רשומות מ-trace; רשומה חלקית בסוף (הקלטה שנקטעה) נחשבת סוף הקובץ"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a telefeed trace file")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            (chat_id, msg_id, msg_date, recv_ts, text_len, thash,
+             kind, grouped_id, stored_len) = RECORD.unpack(head)
+            text = None
+            if stored_len:
+                data = f.read(stored_len)
+                if len(data) < stored_len:
+                    return
+                try:
+                    text = data.decode("utf-8")
+                except UnicodeDecodeError:
+                    return
+            yield SimpleNamespace(
+                chat_id=chat_id, msg_id=msg_id, msg_date=msg_date, recv_ts=recv_ts,
+                text_len=text_len, text_hash=thash, media_kind=kind,
+                grouped_id=grouped_id, text=text
+            )
+
+# ====== לקוח מזויף ======
+class FakeClient:
+    """לקוח טלגרם מזויף - סופר שליחות ומדמה השהיית רשת"""
+
+    def __init__(self, send_latency: float = 0.0):
+        self.send_latency = send_latency
+        self.sent = []  # (method, dest, source msg id / text)
+        self.connected = True
+        self._next_id = 1
+
+    async def _send(self, method: str, dest, payload):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        msg_id = self._next_id
+        self._next_id += 1
+        self.sent.append((method, dest, payload))
+        return SimpleNamespace(id=msg_id, chat_id=dest)
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        msg_id = messages.id if hasattr(messages, "id") else messages
+        return [await self._send("forward", entity, msg_id)]
+
+    async def send_message(self, entity, message="", **kwargs):
+        return await self._send("message", entity, message)
+
+    async def send_file(self, entity, file=None, caption=None, **kwargs):
+        return await self._send("file", entity, caption)
+
+    async def edit_message(self, entity, message=None, text=None, **kwargs):
+        return await self._send("edit", entity, text)
+
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        return await self._send("delete", entity, message_ids)
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+def fake_message(rec: SimpleNamespace) -> SimpleNamespace:
+    """בונה הודעה מזויפת מרשומת trace
+
+    ב-trace מוסתר (TRACE_REDACT) אין טקסט, ולכן ההודעה היא "x" באורך המקורי: filters של
+    אורך/מדיה מתנהגים כמו במקור, אבל מילות מפתח לא יתאימו.
+    """
+    text = rec.text if rec.text is not None else "x" * rec.text_len
+    media = SimpleNamespace(kind=MEDIA_KINDS[rec.media_kind]) if rec.media_kind else None
+    return SimpleNamespace(
+        chat_id=rec.chat_id, id=rec.msg_id, message=text, text=text, media=media,
+        grouped_id=rec.grouped_id or None,
+        date=datetime.datetime.fromtimestamp(rec.msg_date, datetime.timezone.utc),
+    )
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def replay(trace_path: str, routes_file: str, speed: float = 0.0,
+                 send_latency: float = 0.0, account_name: str = "replay") -> dict:
+    """מריץ trace דרך MultiAccountTelefeed מול לקוח מזויף; speed=0 → מהירות מקסימלית"""
+    from telefeed_multi import MultiAccountTelefeed
+    from message_index import MessageIndex
+
+    system = MultiAccountTelefeed(index=MessageIndex(":memory:"), digest_file=None,
+                                  peer_cache_file=None, stats_file=None, trace_file=None)
+    client = FakeClient(send_latency)
+    system.manager.accounts = {account_name: {"routes_file": routes_file, "enabled": True}}
+    system.manager.clients = {account_name: client}
+    await system.load_routes_for_account(account_name)
+
+    records = list(read_trace(trace_path))
+    latencies = []   # מהגעת ההודעה עד סיום השליחה ליעד (כולל ההמתנה בתור)
+    tasks = []
+    due_at = {}
+    send_via_pool = system.send_via_pool
+
+    async def timed_send(send):
+        retry = await send_via_pool(send)
+        if retry is None:  # אחרת השליחה חוזרת לתור
+            latencies.append(time.perf_counter() - due_at[id(send.message)])
+        return retry
+
+    # ה-scheduler מקבל את system.send_via_pool בזמן submit - מודדים את סיום השליחה עצמה
+    system.send_via_pool = timed_send
+
+    async def run_one(rec, due):
+        message = fake_message(rec)
+        due_at[id(message)] = due
+        await system.handle_new_message(account_name, SimpleNamespace(message=message))
+
+    start = time.perf_counter()
+    first_ts = records[0].recv_ts if records else 0.0
+    for rec in records:
+        due = start
+        if speed > 0:
+            due = start + (rec.recv_ts - first_ts) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            due = time.perf_counter()
+        tasks.append(asyncio.create_task(run_one(rec, due)))
+        if speed <= 0 and len(tasks) >= 1000:
+            await asyncio.gather(*tasks)
+            tasks.clear()
+    await asyncio.gather(*tasks)
+    await system.scheduler.join()
+    await system.digests.flush_all()
+    elapsed = time.perf_counter() - start
+    system.index.close()
+
+    return {
+        "messages": len(records),
+        "redacted_messages": sum(1 for rec in records if rec.text is None and rec.text_len),
+        "deliveries": len(client.sent),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(len(records) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p95": round(_percentile(latencies, 95) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+            "max": round(max(latencies, default=0.0) * 1000, 3),
+        },
+        "lanes": system.scheduler.status(),
+    }
+
+def main(argv=None):
+    """נקודת כניסה ל-CLI"""
+    import argparse  # רק ל-CLI - לא נטען כשה-router מייבא את ה-recorder
+    parser = argparse.ArgumentParser(description="Telefeed traffic trace tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    info = sub.add_parser("info", help="summary of a trace file")
+    info.add_argument("trace")
+
+    rep = sub.add_parser("replay", help="replay a trace through the router")
+    rep.add_argument("trace")
+    rep.add_argument("--routes", required=True, help="routes YAML file to replay against")
+    rep.add_argument("--speed", default="1", help="1, N (e.g. 10) or 'max'")
+    rep.add_argument("--send-latency", type=float, default=0.0, help="simulated seconds per send")
+    rep.add_argument("--verbose", action="store_true", help="show router log lines")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "info":
+        records = list(read_trace(args.trace))
+        chats = {r.chat_id for r in records}
+        span = records[-1].recv_ts - records[0].recv_ts if records else 0.0
+        print(f"📼 {len(records)} messages from {len(chats)} chats over {span:.1f}s")
+        return 0
+
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    # לוג השליחות של ה-router מוסתר אלא אם ביקשו --verbose
+    with open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        result = asyncio.run(replay(args.trace, args.routes, speed, args.send_latency))
+    print("=" * 50)
+    print(f"📨 Messages:   {result['messages']}")
+    if result["redacted_messages"]:
+        print(f"⚠ {result['redacted_messages']} messages without text (redacted trace) - "
+              f"keyword filters never match them")
+    print(f"📤 Deliveries: {result['deliveries']}")
+    print(f"⏱ Elapsed:    {result['elapsed_s']}s")
+    print(f"🚀 Throughput: {result['throughput_msg_s']} msg/s")
+    lat = result["latency_ms"]
+    print(f"⌛ Latency ms: p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} max={lat['max']}")
+    for priority, lane in result["lanes"].items():
+        print(f"🚦 Lane {priority}: sent={lane['sent']} wait ms avg={lane['avg_wait_ms']} "
+              f"p95={lane['p95_wait_ms']} max={lane['max_wait_ms']} starved={lane['starved']}")
+    print("=" * 50)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
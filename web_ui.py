@@ -1,10 +1,31 @@
 """
 Web UI לניהול חשבונות טלגרם
 """
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_file, Response
 import asyncio
+import hashlib
+import json
 import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+import yaml
 from accounts_manager import AccountManager
+from profiling import PROFILE_SUMMARY_FILE, PROFILE_FOLDED_FILE, write_control
+from status import read_status, format_duration
+from route_store import list_routes, put_route, delete_route, write_routes_text
+from route_stats import read_summary, read_series
+from startup import read_startup
+from route_eval import load_history, load_table, run as evaluate_routes
+from routing import RouteTable
+from peer_resolver import PeerResolver, PEER_CACHE_FILE
+
+STATUS_STALE_AFTER = 60  # שניות - אחרי זה ה-router נחשב לא פעיל
+SNAPSHOT_EVERY = 1.0     # שניות - בנייה מחדש של snapshot החשבונות לכל היותר פעם בזה
+STREAM_KEEPALIVE = 15    # שניות בין הודעות keepalive ב-SSE
+STREAM_LIFETIME = int(os.getenv("STREAM_LIFETIME", "300"))  # שניות עד שה-stream נסגר (הדפדפן מתחבר מחדש)
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", "20"))           # streams פתוחים במקביל (כל אחד תופס thread)
 
 app = Flask(__name__)
 manager = AccountManager()
@@ -25,19 +46,87 @@ def run_async(coro):
     loop = get_or_create_event_loop()
     return loop.run_until_complete(coro)
 
-@app.route('/')
-def index():
-    """דף הבית - רשימת חשבונות"""
+def router_status() -> dict:
+    """מצב החשבונות כפי שה-router דיווח ({} אם ה-router לא פעיל)"""
+    status = read_status()
+    if time.time() - status.get('updated_at', 0) > STATUS_STALE_AFTER:
+        return {}
+    return status.get('accounts', {})
+
+def build_accounts() -> list:
+    """רשימת החשבונות עם מצב החיבור והתעבורה מה-router"""
+    live = router_status()
     accounts = []
     for name in manager.list_accounts():
         account = manager.get_account(name)
+        health = live.get(name, {})
+        # זמנים מוחלטים - משכי הזמן מחושבים בתצוגה, כך שה-ETag משתנה רק כשהמצב משתנה
         accounts.append({
             'name': name,
-            'phone': account.get('phone', 'Bot'),
             'enabled': account.get('enabled', True),
-            'has_client': name in manager.clients
+            'connected': name in manager.clients or health.get('state') == 'connected',
+            'state': health.get('state'),
+            'connected_since': health.get('connected_since'),
+            'last_update': health.get('last_update'),
+            'rtt_ms': health.get('rtt_ms'),
+            'reconnects': health.get('reconnects', 0),
+            'received': health.get('received', 0),
+            'delivered': health.get('delivered', 0),
+            'failed': health.get('failed', 0),
+            'msg_rate': health.get('msg_rate', 0.0),
+            'delivery_rate': health.get('delivery_rate', 0.0),
         })
-    return render_template('index.html', accounts=accounts)
+    return accounts
+
+class DashboardSnapshot:
+    """snapshot משותף לכל הדשבורדים - נבנה לכל היותר פעם ב-SNAPSHOT_EVERY"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = 0.0
+        self._current = SimpleNamespace(version=0, accounts=[], body='[]', etag='')
+    
+    def get(self) -> SimpleNamespace:
+        """מחזיר את ה-snapshot הנוכחי (version, accounts, body, etag)"""
+        with self._lock:
+            if time.monotonic() - self._built_at >= SNAPSHOT_EVERY:
+                self._rebuild()
+            return self._current
+    
+    def invalidate(self):
+        """מכריח בנייה מחדש בבקשה הבאה (אחרי שינוי בחשבונות)"""
+        with self._lock:
+            self._built_at = 0.0
+    
+    def _rebuild(self):
+        accounts = build_accounts()
+        body = json.dumps(accounts, ensure_ascii=False, sort_keys=True)
+        etag = hashlib.blake2b(body.encode('utf-8'), digest_size=8).hexdigest()
+        if etag != self._current.etag:
+            self._current = SimpleNamespace(version=self._current.version + 1,
+                                            accounts=accounts, body=body, etag=etag)
+        self._built_at = time.monotonic()
+
+snapshot = DashboardSnapshot()
+
+@app.template_filter('duration')
+def duration_filter(seconds):
+    return format_duration(seconds)
+
+@app.template_filter('elapsed')
+def elapsed_filter(timestamp):
+    return format_duration(time.time() - timestamp if timestamp else None)
+
+@app.template_filter('ago')
+def ago_filter(timestamp):
+    return f"לפני {format_duration(time.time() - timestamp)}" if timestamp else "אף פעם"
+
+@app.route('/')
+def index():
+    """דף הבית - רשימת חשבונות"""
+    phones = {name: (manager.get_account(name) or {}).get('phone') or 'Bot'
+              for name in manager.list_accounts()}
+    return render_template('index.html', accounts=snapshot.get().accounts, phones=phones)
 
 @app.route('/account/add', methods=['GET', 'POST'])
 def add_account():
@@ -57,6 +146,7 @@ def add_account():
             phone = data.get('phone')
             manager.add_account(name, api_id, api_hash, phone=phone)
         
+        snapshot.invalidate()
         return redirect(url_for('index'))
     
     return render_template('add_account.html')
@@ -71,6 +161,7 @@ def login_account(name):
     if request.method == 'POST':
         code = request.form.get('code')
         result = run_async(manager.login_account(name, code))
+        snapshot.invalidate()
         
         if result.get('success'):
             # אחרי התחברות מוצלחת, הפעל מחדש את telefeed
@@ -105,14 +196,28 @@ def toggle_account(name):
     """הפעלה/כיבוי חשבון"""
     enabled = request.json.get('enabled', True)
     manager.toggle_account(name, enabled)
+    snapshot.invalidate()
     return jsonify({'success': True})
 
 @app.route('/account/<name>/delete', methods=['POST'])
 def delete_account(name):
     """מחיקת חשבון"""
     manager.remove_account(name)
+    snapshot.invalidate()
     return redirect(url_for('index'))
 
+def unresolved_source_errors(routes) -> list:
+    """sources שה-router ניסה לפתור ונכשל (לפי ה-cache המשותף) - route כזה לא יתאים לאף הודעה"""
+    return PeerResolver(PEER_CACHE_FILE).unresolved_sources(routes)
+
+def _routes_in(content: str) -> list:
+    try:
+        data = yaml.safe_load(content or "")
+    except yaml.YAMLError:
+        return []  # שגיאת ה-YAML עצמה מדווחת ב-write_routes_text
+    routes = data.get('routes') if isinstance(data, dict) else None
+    return routes if isinstance(routes, list) else []
+
 @app.route('/account/<name>/routes', methods=['GET', 'POST'])
 def edit_routes(name):
     """עריכת routes לחשבון"""
@@ -124,8 +229,11 @@ def edit_routes(name):
     
     if request.method == 'POST':
         content = request.form.get('content')
-        with open(routes_file, 'w', encoding='utf-8') as f:
-            f.write(content)
+        errors = unresolved_source_errors(_routes_in(content)) or write_routes_text(routes_file, content)
+        if errors:
+            # לא שומרים קובץ שגוי - מציגים שוב עם השגיאות
+            return render_template('edit_routes.html', name=name, content=content,
+                                   errors=errors), 400
         return redirect(url_for('index'))
     
     # GET - הצגת קובץ
@@ -135,20 +243,184 @@ def edit_routes(name):
     else:
         content = f"# Routes for {name}\nroutes: []"
     
-    return render_template('edit_routes.html', name=name, content=content)
+    return render_template('edit_routes.html', name=name, content=content,
+                           warnings=unresolved_source_errors(_routes_in(content)))
+
+def _put_route(routes_file: str, raw, route_id: str = None, status: int = 200):
+    errors = unresolved_source_errors([raw])
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+    return _route_result(put_route(routes_file, raw, route_id), status)
+
+def _route_result(result: dict, status: int = 200):
+    if result.get('success'):
+        return jsonify(result), status
+    return jsonify(result), 404 if result.get('not_found') else 400
+
+@app.route('/api/accounts/<name>/routes', methods=['GET', 'POST'])
+def api_routes(name):
+    """API - רשימת routes של חשבון / הוספת route"""
+    account = manager.get_account(name)
+    if not account:
+        return jsonify({'success': False, 'errors': ['Account not found']}), 404
+    if request.method == 'POST':
+        return _put_route(account['routes_file'], request.get_json(silent=True), status=201)
+    return jsonify(list_routes(account['routes_file']))
+
+@app.route('/api/accounts/<name>/routes/<route_id>', methods=['PUT', 'DELETE'])
+def api_route(name, route_id):
+    """API - עדכון / מחיקה של route לפי id"""
+    account = manager.get_account(name)
+    if not account:
+        return jsonify({'success': False, 'errors': ['Account not found']}), 404
+    if request.method == 'DELETE':
+        return _route_result(delete_route(account['routes_file'], route_id))
+    return _put_route(account['routes_file'], request.get_json(silent=True), route_id)
+
+@app.route('/api/accounts/<name>/routes/evaluate', methods=['POST'])
+def api_evaluate_routes(name):
+    """API - הרצת ה-routes הנוכחיים (ו-candidate אם נשלח) על היסטוריה שהועלתה (JSON-lines / trace)"""
+    account = manager.get_account(name)
+    if not account:
+        return jsonify({'success': False, 'errors': ['Account not found']}), 404
+    upload = request.files.get('history')
+    if not upload:
+        return jsonify({'success': False, 'errors': ['No history file uploaded']}), 400
+    routes_file = account['routes_file']
+    current = RouteTable()
+    try:
+        if os.path.exists(routes_file):
+            current = load_table(routes_file)
+        candidate_text = request.form.get('candidate')
+        candidate = load_table(content=candidate_text) if candidate_text else None
+    except ValueError as e:
+        return jsonify({'success': False, 'errors': e.args[0]}), 400
+    with tempfile.NamedTemporaryFile(suffix='.history') as tmp:
+        upload.save(tmp.name)
+        try:
+            history = load_history(tmp.name)
+        except ValueError as e:
+            return jsonify({'success': False, 'errors': [f"Could not read history: {e}"]}), 400
+    return jsonify(dict(evaluate_routes(history, current, candidate), success=True))
+
+@app.route('/stats')
+def route_stats_page():
+    """סטטיסטיקת routes - routes מתים ראשונים, אחר כך לפי תעבורה בשעה האחרונה"""
+    summary = read_summary()
+    routes = sorted(summary.get('routes', []), key=lambda r: (not r['dead'], -r['hour'][0]))
+    dests = sorted(summary.get('dests', []), key=lambda d: -d['hour'][0])
+    return render_template('route_stats.html', routes=routes, dests=dests,
+                           updated_at=summary.get('updated_at'))
+
+@app.route('/api/stats/routes')
+def api_route_stats():
+    """API - סיכום תעבורה לכל route ויעד (?dead=1 - רק routes מתים)"""
+    summary = read_summary()
+    if request.args.get('dead'):
+        summary['routes'] = [r for r in summary.get('routes', []) if r['dead']]
+    return jsonify(summary)
+
+@app.route('/api/stats/series')
+def api_route_series():
+    """API - סדרת זמן של route/יעד (?key=...&res=0 לשעה ב-10 שניות, res=1 לשבוע ב-10 דקות)"""
+    points = read_series(request.args.get('key', ''), 1 if request.args.get('res', 0, type=int) else 0)
+    if points is None:
+        return jsonify({'error': 'No stats for this key'}), 404
+    return jsonify([{'t': t, 'count': c, 'bytes': b, 'failed': f} for t, c, b, f in points])
+
+@app.route('/api/peers/unresolved')
+def api_unresolved_peers():
+    """API - usernames/קישורים ב-routes שה-router לא הצליח להמיר למזהה"""
+    return jsonify(read_status().get('unresolved_peers', {}))
+
+@app.route('/api/startup')
+def api_startup():
+    """API - ציר הזמן של הפעלת ה-router האחרונה וההפעלות הקודמות"""
+    return jsonify(read_startup())
 
 @app.route('/api/accounts')
 def api_accounts():
-    """API - רשימת חשבונות"""
-    accounts = []
-    for name in manager.list_accounts():
-        account = manager.get_account(name)
-        accounts.append({
-            'name': name,
-            'enabled': account.get('enabled'),
-            'connected': name in manager.clients
-        })
-    return jsonify(accounts)
+    """API - רשימת חשבונות (ETag + עמודים: ?page=1&per_page=50)"""
+    snap = snapshot.get()
+    accounts = snap.accounts
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', type=int)
+    if per_page:
+        page = max(page, 1)
+        accounts = accounts[(page - 1) * per_page:page * per_page]
+    
+    response = jsonify(accounts)
+    response.set_etag(f"{snap.etag}-{page}-{per_page or 0}")
+    response.headers['X-Total-Count'] = str(len(snap.accounts))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+_streams = threading.BoundedSemaphore(MAX_STREAMS)
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events - מצב החשבונות וקצב התעבורה בזמן אמת
+    
+    כל stream תופס thread, ולכן מספרם מוגבל ל-MAX_STREAMS וכל אחד נסגר אחרי
+    STREAM_LIFETIME שניות (EventSource מתחבר מחדש אוטומטית)
+    """
+    if not _streams.acquire(blocking=False):
+        return Response("retry: 30000\n\n", status=503, mimetype='text/event-stream')
+    
+    def events():
+        try:
+            last_version = None
+            idle = 0.0
+            deadline = time.monotonic() + STREAM_LIFETIME
+            while time.monotonic() < deadline:
+                snap = snapshot.get()
+                if snap.version != last_version:
+                    last_version = snap.version
+                    idle = 0.0
+                    yield f"data: {snap.body}\n\n"
+                elif idle >= STREAM_KEEPALIVE:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+                time.sleep(SNAPSHOT_EVERY)
+                idle += SNAPSHOT_EVERY
+        finally:
+            _streams.release()
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """הפעלה/כיבוי פרופיילינג ב-router וצפייה בסיכום top-N"""
+    if request.method == 'POST':
+        data = request.json or {}
+        control = {
+            'enabled': bool(data.get('enabled')),
+            'sampling': bool(data.get('sampling')),
+            'tracemalloc': bool(data.get('tracemalloc')),
+            'reset': bool(data.get('reset')),
+        }
+        write_control(control)
+        return jsonify({'success': True, 'control': control})
+    
+    if not os.path.exists(PROFILE_SUMMARY_FILE):
+        return jsonify({'enabled': False, 'message': 'No profile collected yet'})
+    
+    top = request.args.get('top', type=int)
+    with open(PROFILE_SUMMARY_FILE, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    if top:
+        for key in ('spans', 'hot_self', 'hot_cumulative', 'memory_top'):
+            summary[key] = summary.get(key, [])[:top]
+    return jsonify(summary)
+
+@app.route('/admin/profile/download')
+def download_profile():
+    """הורדת קובץ profile (פורמט folded stacks ל-flamegraph/speedscope)"""
+    if not os.path.exists(PROFILE_FOLDED_FILE):
+        return "No profile collected yet", 404
+    return send_file(os.path.abspath(PROFILE_FOLDED_FILE), as_attachment=True,
+                     download_name='telefeed.folded', mimetype='text/plain')
 
 if __name__ == '__main__':
     # יצירת תיקיות נדרשות